@@ -1,20 +1,24 @@
-from subprocess import PIPE
-import subprocess
+from collections import OrderedDict
 
 from termcolor import colored
 
 from src.common import get_collections_data
+from src.process import run_many
+
+
+def report(collection, error):
+    if error is None:
+        print(colored('%s [SUCCESS]' % collection, 'green'))
+    else:
+        print(colored('%s [ERROR]' % collection, 'red'))
+
 
 if __name__ == '__main__':
     collections = get_collections_data()['collections']
-    for collection in collections:
-        call = ['docker-compose', 'run', '--rm', 'snoop--' + collection, './manage.py',
-                'updatename', collection.lower(), collection]
-        print(call, end='', flush=True)
-        process = subprocess.run(call, stdout=PIPE, stderr=PIPE)
-        if process.returncode == 0:
-            print(colored(' [SUCCESS]', 'green'))
-        else:
-            print(colored(' [ERROR]', 'red'))
-            print(process.stderr.decode('ASCII'))
-            print(process.stdout.decode('ASCII'))
+    commands = OrderedDict(
+        (collection, 'docker-compose run --rm snoop--%s ./manage.py updatename %s %s' %
+         (collection, collection.lower(), collection))
+        for collection in collections)
+    results = run_many(commands, on_done=report)
+    if any(results.values()):
+        exit(1)
@@ -50,6 +50,13 @@ DATABASES = {
     },
 }
 
+if os.environ.get('DOCKER_HOOVER_PGBOUNCER_HOST'):
+    DATABASES['default'].update({
+        'HOST': os.environ['DOCKER_HOOVER_PGBOUNCER_HOST'],
+        'PORT': int(os.environ.get('DOCKER_HOOVER_PGBOUNCER_PORT', 6432)),
+        'DISABLE_SERVER_SIDE_CURSORS': True,
+    })
+
 STATIC_ROOT = str(base_dir / 'static')
 
 HOOVER_UPLOADS_ROOT = str(base_dir / 'uploads')
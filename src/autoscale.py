@@ -0,0 +1,55 @@
+import argparse
+
+from src.autoscaler import RabbitMQClient, DockerWorkers, Autoscaler, get_rabbitmq_url, \
+    default_interval, default_cooldown, default_tasks_per_worker, default_min_workers
+from src.common import get_collections_data, get_worker_services, root_dir, exit_msg
+from src.dockerapi import get_client, get_compose_project_name
+from src.resources import get_cpu_count
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Start and stop the snoop workers of the ' +
+                                                 'auto-indexing collections based on their queued tasks.')
+    parser.add_argument('--min-workers', type=int, default=default_min_workers,
+                        help='Minimum number of worker containers of each collection; 0 stops the ' +
+                             'workers of collections without queued tasks.')
+    parser.add_argument('--budget', type=int, default=get_cpu_count(),
+                        help='Maximum number of worker containers running on the host; ' +
+                             'the number of CPUs by default.')
+    parser.add_argument('--tasks-per-worker', type=int, default=default_tasks_per_worker,
+                        help='Queued tasks per worker container when scaling up.')
+    parser.add_argument('--cooldown', type=int, default=default_cooldown,
+                        help='Seconds a collection must need fewer workers before scaling down.')
+    parser.add_argument('--interval', type=int, default=default_interval,
+                        help='Seconds between scaling steps.')
+    parser.add_argument('--once', action='store_const', const=True, default=False,
+                        help='Run a single scaling step and exit.')
+    return parser.parse_args()
+
+
+def get_autoscaled_collections(min_workers):
+    '''Return the worker services and minimum workers of the auto-indexing
+    collections, read from the registry at every call to follow its changes.
+
+    :param min_workers: the minimum number of workers of each collection
+    :return: dictionary of collection name to (services, min workers)
+    '''
+    collections = get_collections_data()['collections']
+    return {collection: (get_worker_services(collection, settings), min_workers)
+            for collection, settings in collections.items() if settings.get('autoindex')}
+
+
+def autoscale(args):
+    if args.min_workers < 0 or args.budget < 1 or args.tasks_per_worker < 1:
+        exit_msg('--min-workers must not be negative, --budget and --tasks-per-worker must be positive')
+    try:
+        rabbitmq_url = get_rabbitmq_url(root_dir)
+    except (OSError, RuntimeError) as e:
+        exit_msg('Unable to find the RabbitMQ management API: %s', e)
+
+    autoscaler = Autoscaler(RabbitMQClient(rabbitmq_url),
+                            DockerWorkers(get_client(), get_compose_project_name(root_dir)),
+                            budget=args.budget, tasks_per_worker=args.tasks_per_worker,
+                            cooldown=args.cooldown)
+    autoscaler.run(lambda: get_autoscaled_collections(args.min_workers), interval=args.interval,
+                   iterations=1 if args.once else None)
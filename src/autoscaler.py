@@ -0,0 +1,229 @@
+from base64 import b64encode
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+from src.common import compose_command
+from src.dockerapi import get_client, get_compose_project_name
+
+default_interval = 30
+default_cooldown = 300
+default_tasks_per_worker = 100
+default_min_workers = 1
+default_timeout = 10
+management_port = 15672
+rabbitmq_service = 'snoop-rabbitmq'
+
+
+def get_rabbitmq_url(project_dir):
+    '''Return the RabbitMQ management API URL from the HOOVER_RABBITMQ_URL environment
+    variable or, if not set, the address of the snoop-rabbitmq container.
+
+    :param project_dir: the directory containing docker-compose.yml
+    :return: str
+    '''
+    if os.environ.get('HOOVER_RABBITMQ_URL'):
+        return os.environ['HOOVER_RABBITMQ_URL'].rstrip('/')
+    address = get_client().service_address(get_compose_project_name(project_dir), rabbitmq_service)
+    if not address:
+        raise RuntimeError('The %s service is not running.' % rabbitmq_service)
+    return 'http://%s:%d' % (address, management_port)
+
+
+class RabbitMQClient:
+    '''Client of the RabbitMQ management HTTP API.'''
+
+    def __init__(self, url, user='guest', password='guest', vhost='/', timeout=default_timeout):
+        self.url = url.rstrip('/')
+        self.vhost = vhost
+        self.timeout = timeout
+        self.authorization = 'Basic ' + b64encode(('%s:%s' % (user, password)).encode('utf-8')) \
+            .decode('ascii')
+
+    def queues(self):
+        '''Return the queues of the virtual host with their number of messages.
+
+        :return: list of dicts
+        '''
+        request = Request('%s/api/queues/%s?columns=name,messages' % (self.url, quote(self.vhost, safe='')),
+                          headers={'Authorization': self.authorization})
+        with urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def queue_depths(self, collections):
+        '''Return the number of messages queued for each collection. The snoop queues
+        are named after the collection, which is the snoop TASK_PREFIX setting.
+
+        :param collections: list of collection names
+        :return: dictionary of collection name to number of messages
+        '''
+        depths = {collection: 0 for collection in collections}
+        for queue in self.queues():
+            prefix = queue['name'].split('.')[0]
+            if prefix in depths:
+                depths[prefix] += queue.get('messages') or 0
+        return depths
+
+
+class DockerWorkers:
+    '''Starts and stops the worker services of the collections. Worker containers
+    which were never created are created with docker-compose.'''
+
+    def __init__(self, client, project, compose_cmd=tuple(compose_command.split())):
+        self.client = client
+        self.project = project
+        self.compose_cmd = list(compose_cmd)
+
+    def running(self, services):
+        '''Return the number of running services from the given list.
+
+        :param services: list of service names
+        :return: int
+        '''
+        self.client.clear_cache()
+        return sum(1 for service in services if self.client.service_containers(self.project, service))
+
+    def scale(self, services, count):
+        '''Run the first count services from the list and stop the others.
+
+        :param services: list of service names, in start order
+        :param count: the number of services to run
+        '''
+        self.client.clear_cache()
+        for service in services[:count]:
+            if self.client.service_containers(self.project, service):
+                continue
+            containers = self.client.service_containers(self.project, service, all=True)
+            if containers:
+                self.client.start(containers[0]['Id'])
+            else:
+                subprocess.run(self.compose_cmd + ['up', '-d', '--no-deps', service], check=True)
+        for service in reversed(services[count:]):
+            for container in self.client.service_containers(self.project, service):
+                self.client.stop(container['Id'])
+
+
+def compute_targets(depths, bounds, budget=None, tasks_per_worker=default_tasks_per_worker):
+    '''Return the number of workers each collection should run: one worker per
+    tasks_per_worker queued tasks, within the collection bounds. When the total
+    exceeds the budget, the workers above the minimums are handed out one at a time
+    to the collection with the most queued tasks per worker.
+
+    :param depths: dictionary of collection name to number of queued tasks
+    :param bounds: dictionary of collection name to (min, max) workers
+    :param budget: the maximum total number of workers; None for no limit
+    :param tasks_per_worker: queued tasks handled by one worker
+    :return: dictionary of collection name to number of workers
+    '''
+    wanted = {}
+    for collection, (minimum, maximum) in bounds.items():
+        needed = math.ceil(depths.get(collection, 0) / tasks_per_worker)
+        wanted[collection] = max(minimum, min(maximum, needed))
+    if budget is None or sum(wanted.values()) <= budget:
+        return wanted
+
+    targets = {collection: bounds[collection][0] for collection in bounds}
+    free = budget - sum(targets.values())
+    while free > 0:
+        candidates = [collection for collection in targets if targets[collection] < wanted[collection]]
+        if not candidates:
+            break
+        collection = max(candidates, key=lambda c: (depths.get(c, 0) / (targets[c] + 1), c))
+        targets[collection] += 1
+        free -= 1
+    return targets
+
+
+class Autoscaler:
+    '''Scales the collections workers with their queue depth. Scaling up happens
+    immediately, while scaling down waits until the collection wanted fewer workers
+    for the whole cooldown period, so short gaps in the queue do not restart the
+    workers.
+
+    :param queues: object with a queue_depths(collections) method, e.g. RabbitMQClient
+    :param workers: object with running(services) and scale(services, count) methods,
+        e.g. DockerWorkers
+    '''
+
+    def __init__(self, queues, workers, budget=None, tasks_per_worker=default_tasks_per_worker,
+                 cooldown=default_cooldown, clock=time.monotonic, output=sys.stdout):
+        self.queues = queues
+        self.workers = workers
+        self.budget = budget
+        self.tasks_per_worker = tasks_per_worker
+        self.cooldown = cooldown
+        self.clock = clock
+        self.output = output
+        self.low_since = {}
+
+    def step(self, collections):
+        '''Run one scaling step. Returns the number of workers of each collection.
+
+        :param collections: dictionary of collection name to (services, min workers),
+            the services being the collection worker services in start order
+        :return: dictionary of collection name to number of running workers
+        '''
+        depths = self.queues.queue_depths(list(collections))
+        bounds = {collection: (min(minimum, len(services)), len(services))
+                  for collection, (services, minimum) in collections.items()}
+        targets = compute_targets(depths, bounds, self.budget, self.tasks_per_worker)
+        current = {collection: self.workers.running(services)
+                   for collection, (services, _) in collections.items()}
+        now = self.clock()
+
+        counts = dict(current)
+        for collection in collections:
+            if targets[collection] < current[collection]:
+                since = self.low_since.setdefault(collection, now)
+                if now - since >= self.cooldown or self.budget_exceeded(counts):
+                    counts[collection] = targets[collection]
+            else:
+                self.low_since.pop(collection, None)
+        for collection in sorted(collections, key=lambda c: -depths.get(c, 0)):
+            missing = targets[collection] - current[collection]
+            if missing > 0:
+                free = self.budget - sum(counts.values()) if self.budget is not None else missing
+                counts[collection] = current[collection] + max(0, min(missing, free))
+
+        for collection, (services, _) in collections.items():
+            if counts[collection] != current[collection]:
+                self.output.write('%s: %d queued tasks, scaling workers %d -> %d\n' %
+                                  (collection, depths.get(collection, 0), current[collection],
+                                   counts[collection]))
+                self.output.flush()
+                self.workers.scale(services, counts[collection])
+                if counts[collection] <= targets[collection]:
+                    self.low_since.pop(collection, None)
+        for collection in set(self.low_since) - set(collections):
+            del self.low_since[collection]
+        return counts
+
+    def budget_exceeded(self, counts):
+        return self.budget is not None and sum(counts.values()) > self.budget
+
+    def run(self, get_collections, interval=default_interval, iterations=None):
+        '''Run scaling steps every interval seconds. Errors talking to RabbitMQ or
+        docker are reported and the step is retried at the next interval.
+
+        :param get_collections: callable returning the collections argument of step
+        :param interval: seconds between steps
+        :param iterations: number of steps; None to run until interrupted
+        '''
+        iteration = 0
+        try:
+            while iterations is None or iteration < iterations:
+                try:
+                    self.step(get_collections())
+                except (OSError, ValueError, RuntimeError, subprocess.CalledProcessError) as e:
+                    self.output.write('Scaling step failed: %s\n' % e)
+                    self.output.flush()
+                iteration += 1
+                if iterations is None or iteration < iterations:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
@@ -3,16 +3,25 @@ from collections import OrderedDict
 from copy import copy
 from curses.ascii import isalpha
 from distutils.util import strtobool
-from functools import reduce
+from functools import lru_cache, reduce, wraps
+import hashlib
 import os
 from pathlib import Path
 import re
-from shutil import rmtree
+from shutil import copyfile, rmtree
+import subprocess
+import sys
 
-from jinja2 import Template
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 import yaml
 import json
 
+from src.ports import PortAllocator
+from src import registry
+from src.resources import cpuset_pattern, memory_pattern, get_cpu_count, get_memory_bytes, size_tika, \
+    split_postgres_memory, size_postgres, size_pools, pg_max_connections
+from src.trash import move_to_trash
+
 root_dir = Path(__file__).absolute().parent.parent
 collection_allowed_chars = 'a-z, A-Z, 0-9'
 start_snoop_port = 45025
@@ -24,6 +33,8 @@ settings_dir_name = 'settings'
 templates_dir_name = 'templates'
 volumes_dir_name = 'volumes'
 blobs_dir_name = 'snoop-blobs'
+# --compatibility applies the deploy resource limits of the worker services
+compose_command = 'docker-compose --compatibility'
 docker_file_name = 'docker-compose.override.yml'
 docker_dev_file_name = 'docker-compose.override-dev.yml'
 orig_docker_file_name = 'docker-compose.override-orig.yml'
@@ -34,14 +45,65 @@ snoop_settings_file_name = 'snoop-settings.py'
 snoop_settings_profiling_file_name = 'snoop-settings-profiling.py'
 snoop_settings_dev_file_name = 'snoop-settings-dev.py'
 snoop_settings_tracing_file_name = 'snoop-settings-tracing.py'
+snoop_settings_stats_file_name = 'snoop-settings-stats.py'
+snoop_settings_workers_file_name = 'snoop-settings-workers.py'
+snoop_stats_file_name = 'snoop-stats.yml'
+snoop_stats_services = ['snoop-stats-es', 'snoop-stats-kibana']
+snoop_stats_volumes = 'volumes:\n  snoop-stats-es-data:\n'
+snoop_tika_file_name = 'snoop-tika.yml'
+tika_service = 'snoop-tika'
+default_tika_port = 9998
+tika_replica_prefix = tika_service + '-'
+tika_cache_file_name = 'snoop-tika-cache.yml'
+tika_cache_service = 'snoop-tika-cache'
+tika_cache_image = 'python:3.7-slim'
+tika_cache_url = 'http://%s:%d' % (tika_cache_service, default_tika_port)
+snoop_settings_tika_file_name = 'snoop-settings-tika.py'
+tika_proxy_file_name = 'tika-haproxy.cfg'
+tika_proxy_image = 'haproxy:2.0'
+global_settings_defaults = {
+    'tika_replicas': 1,
+    'tika_heap': None,
+    'tika_cache': None,
+    'shared_pg': False,
+    'pgbouncer': False,
+}
 collections_settings_file_name = 'collections.json'
+ports_settings_file_name = 'ports.json'
 env_file_name = 'snoop.env'
 default_pg_port = 5432
+pg_config_file_name = 'postgresql.conf'
+pg_config_path = '/etc/postgresql/postgresql.conf'
+shared_pg_service = 'snoop-pg'
+shared_pg_file_name = 'snoop-pg.yml'
+shared_pg_config_file_name = 'snoop-pg.conf'
+shared_pg_profile = 'serve'
+pgbouncer_service = 'pgbouncer'
+pgbouncer_port = 6432
+pgbouncer_image = 'edoburu/pgbouncer:1.12.0'
+pgbouncer_file_name = 'pgbouncer.yml'
+pgbouncer_config_file_name = 'pgbouncer.ini'
+snoop_settings_pgbouncer_file_name = 'snoop-settings-pgbouncer.py'
+search_pg = ('search-pg', 'search', 'search')
+search_pool_size = 20
+snoop_web_connections = 4
+min_client_connections = 1000
+start_pg_port = default_pg_port + 1
+port_settings = OrderedDict((
+    ('snoop_port', start_snoop_port),
+    ('flower_port', start_flower_port),
+    ('pg_port', start_pg_port),
+))
 collection_exists_msg = 'Collection %s already exists!'
 default_snoop_image = 'liquidinvestigations/hoover-snoop2:0.1'
 DOCKER_HOOVER_SNOOP_SECRET_KEY = 'DOCKER_HOOVER_SNOOP_SECRET_KEY'
 DOCKER_HOOVER_SNOOP_DEBUG = 'DOCKER_HOOVER_SNOOP_DEBUG'
 DOCKER_HOOVER_SNOOP_BASE_URL = 'DOCKER_HOOVER_SNOOP_BASE_URL'
+HOOVER_TEMPLATES_CACHE_DIR = 'HOOVER_TEMPLATES_CACHE_DIR'
+trash_lock_file_name = 'trash.lock'
+trash_log_file_name = 'trash.log'
+collection_services_prefixes = ['snoop-pg--', 'snoop--', 'snoop-worker--']
+yaml_loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
 default_collections_data = {
     'collections': {},
     'snoop_port': start_snoop_port,
@@ -151,7 +213,7 @@ def get_collections_data_old():
     dev_instances = 0
 
     with open(docker_file_name) as collections_file:
-        collections_settings = yaml.load(collections_file, Loader=yaml.FullLoader)
+        collections_settings = yaml.load(collections_file, Loader=yaml_loader)
         for service, settings in collections_settings['services'].items():
             if service.startswith('snoop--'):
                 collection_name = service[len('snoop--'):]
@@ -168,7 +230,7 @@ def get_collections_data_old():
                 collections[collection_name]['snoop_port'] = port
                 if port > last_snoop_port:
                     last_snoop_port = port
-            if service.startswith('snoop-worker--'):
+            if service.startswith('snoop-worker--') and '--' not in service[len('snoop-worker--'):]:
                 collection_name = service[len('snoop-worker--'):]
                 collections.setdefault(collection_name, {}).update({
                     'autoindex': settings.get('command', '').find('./manage.py runworkers') != -1})
@@ -192,73 +254,369 @@ def get_collections_data_old():
     }
 
 
+def read_port_allocators(collections, saved=None):
+    '''Create the port allocators from the state saved in the registry. The ports
+    assigned to the given collections are reserved and all other ports below the
+    end of each range are reused.
+
+    :param collections: the dictionary containing the collections settings
+    :param saved: dictionary of port setting name to saved allocator state
+    :return: dict of port setting name to PortAllocator
+    '''
+    saved = saved or {}
+    allocators = OrderedDict()
+    for port_setting, start_port in port_settings.items():
+        used = [settings[port_setting] for settings in collections.values() if settings.get(port_setting)]
+        allocators[port_setting] = PortAllocator.from_dict(start_port, saved.get(port_setting, {}), used)
+    return allocators
+
+
+def migrate_collections_settings(connection):
+    '''Initialize the collections registry from the collections.json and ports.json
+    settings files or, if they are missing, from the legacy override docker file.
+    The migrated settings files are renamed with the ".migrated" suffix.
+
+    :param connection: the registry connection
+    '''
+    collections_file_name = os.path.join(settings_dir_name, collections_settings_file_name)
+    ports_file_name = os.path.join(settings_dir_name, ports_settings_file_name)
+    migrated_files = []
+
+    if os.path.isfile(collections_file_name):
+        with open(collections_file_name) as collections_file:
+            collections = json.load(collections_file, object_pairs_hook=OrderedDict)
+        migrated_files.append(collections_file_name)
+    else:
+        collections = get_collections_data_old()['collections']
+
+    ports = {}
+    if os.path.isfile(ports_file_name):
+        with open(ports_file_name) as ports_file:
+            ports = json.load(ports_file)
+        migrated_files.append(ports_file_name)
+
+    registry.initialize(connection, collections, ports)
+    for file_name in migrated_files:
+        os.rename(file_name, file_name + '.migrated')
+    if collections:
+        print('Migrated %d collections to the collections registry.' % len(collections))
+
+
+def get_registry():
+    '''Return the connection to the collections registry. The registry is migrated
+    from the previous settings files on first use.
+
+    :return: sqlite3.Connection
+    '''
+    connection = registry.connect(settings_dir_name)
+    if not registry.is_initialized(connection):
+        migrate_collections_settings(connection)
+    return connection
+
+
+def registry_locked(command):
+    '''Decorator holding the collections registry lock while the command runs, so
+    that concurrent commands do not overwrite each other's changes.
+    '''
+    @wraps(command)
+    def decorator(*args, **kwargs):
+        with registry.lock(settings_dir_name):
+            return command(*args, **kwargs)
+
+    return decorator
+
+
 def get_collections_data():
     '''Return collections data in form of a tuple of ordered dictionary, next
     snoop available port, next postgresql available port (for development),
     next port available for flower web admin, number of development instance
+    and the port allocators
 
     :return: dict
     '''
-    collections_file_name = os.path.join(settings_dir_name, collections_settings_file_name)
+    connection = get_registry()
+    collections = registry.read_collections(connection)
+    ports = read_port_allocators(collections, registry.read_ports(connection))
+
+    return {
+        'collections': collections,
+        'snoop_port': ports['snoop_port'].peek(),
+        'pg_port': ports['pg_port'].peek(),
+        'flower_port': ports['flower_port'].peek(),
+        'dev_instances': sum(1 for settings in collections.values() if settings.get('for_dev')),
+        'stats_clients': sum(1 for settings in collections.values() if settings.get('stats')),
+        'ports': ports,
+        'global_settings': get_global_settings(connection)
+    }
 
-    if not os.path.isfile(collections_file_name):
-        return get_collections_data_old()
 
-    last_snoop_port = start_snoop_port - 1
-    pg_port = default_pg_port + 1
-    flower_port = start_flower_port
-    dev_instances = 0
+def get_global_settings(connection=None):
+    '''Return the settings shared by all collections, e.g. the Tika replicas.
 
-    with open(collections_file_name) as collections_file:
-        collections = json.load(collections_file)
+    :param connection: the registry connection; None to open the registry
+    :return: dict
+    '''
+    settings = dict(global_settings_defaults)
+    settings.update(registry.read_settings(connection or get_registry()))
+    return settings
 
-    for settings in collections.values():
-        if settings['for_dev']:
-            dev_instances += 1
-            pg_port += 1
-            if settings['pg_port'] >= pg_port:
-                pg_port = settings['pg_port'] + 1
-        if settings['snoop_port'] > last_snoop_port:
-            last_snoop_port = settings['snoop_port']
-        if settings.get('flower_port') and settings['flower_port'] >= flower_port:
-            flower_port = settings['flower_port'] + 1
 
-    ordered_collections = OrderedDict(sorted(collections.items(), key=lambda t: t[0]))
+def write_global_settings(settings):
+    '''Save the settings shared by all collections to the collections registry.
 
-    return {
-        'collections': ordered_collections,
-        'snoop_port': last_snoop_port + 1,
-        'pg_port': pg_port,
-        'flower_port': flower_port,
-        'dev_instances': dev_instances
-    }
+    :param settings: dictionary of setting name to value; None resets a setting
+    '''
+    registry.write_settings(get_registry(), settings)
+
+
+def get_tika_resources(global_settings):
+    '''Return the number of Tika replicas and the JVM heap of each replica. When the
+    replicas are set to "auto" they are sized from the host CPUs and memory. Without
+    an explicit heap, multiple replicas share a fraction of the host memory, while a
+    single replica keeps the JVM default.
+
+    :param global_settings: the global settings
+    :return: (int, str)
+    '''
+    replicas = global_settings.get('tika_replicas') or 1
+    heap = global_settings.get('tika_heap')
+    if replicas == 'auto':
+        replicas, auto_heap = size_tika(get_cpu_count(), get_memory_bytes())
+    elif replicas > 1:
+        replicas, auto_heap = size_tika(get_cpu_count(), get_memory_bytes(), replicas)
+    else:
+        auto_heap = None
+    return replicas, heap or auto_heap
 
 
 def write_collections_settings(settings):
-    '''Write collections settings to the settings file
+    '''Write collections settings to the collections registry in a single
+    transaction. If the port allocators are present they are saved as well.
     :param settings: dictionary containing collections
     '''
     coll_settings = settings if 'collections' not in settings else settings['collections']
+    ports = None
+    if 'ports' in settings and 'collections' in settings:
+        ports = {port_setting: allocator.to_dict() for port_setting, allocator in settings['ports'].items()}
+    registry.write(get_registry(), coll_settings, ports)
+
 
-    with open(os.path.join(settings_dir_name, collections_settings_file_name), 'w') as settings_file:
-        settings_file.write(json.dumps(coll_settings, indent=4))
+def release_collection_ports(ports, settings):
+    '''Return the ports assigned to a collection to the port allocators.
+
+    :param ports: the port allocators
+    :param settings: dictionary containing the collection settings
+    '''
+    for port_setting, allocator in ports.items():
+        if settings.get(port_setting):
+            allocator.release(settings[port_setting])
+
+
+def uses_shared_pg(collections, global_settings=None):
+    '''Return true if the shared postgres service is needed, either because a
+    collection keeps its database in it or because it was enabled globally.
+
+    :param collections: the dictionary containing the collections settings
+    :param global_settings: the settings shared by all collections; None for the defaults
+    :return: bool
+    '''
+    return bool((global_settings or {}).get('shared_pg')) or \
+        any(settings.get('shared_pg') for settings in collections.values())
+
+
+def get_collection_database(collection, settings):
+    '''Return the postgres service and the database name of a collection. Collections
+    using the shared postgres service have their own database in it.
+
+    :param collection: the collection name
+    :param settings: dictionary containing the collection settings
+    :return: (str, str)
+    '''
+    if settings.get('shared_pg'):
+        return shared_pg_service, 'snoop_' + collection.lower()
+    return 'snoop-pg--' + collection, 'snoop'
+
+
+def get_pgbouncer_database(collection):
+    '''Return the name of the collection database in the pgbouncer configuration.
+
+    :param collection: the collection name
+    :return: str
+    '''
+    return 'snoop_' + collection.lower()
+
+
+def get_pgbouncer_databases(collections):
+    '''Return the databases served by pgbouncer: the search database and the
+    database of each collection, with their pool sizes. A collection needs one
+    connection for each worker process and a few for the snoop web service. The
+    pools of the databases of a postgres server are scaled down to fit its
+    max_connections.
+
+    :param collections: the dictionary containing the collections settings
+    :return: list of (name, postgres service, database, user, pool size)
+    '''
+    databases = {get_pgbouncer_database(collection): get_collection_database(collection, settings)
+                 for collection, settings in collections.items()}
+    needs = {get_pgbouncer_database(collection):
+             (settings.get('workers') or get_cpu_count()) * (settings.get('replicas') or 1) +
+             snoop_web_connections
+             for collection, settings in collections.items()}
+    databases['search'], needs['search'] = search_pg[:2], search_pool_size
+
+    pool_sizes = {}
+    for pg_service in set(service for service, _ in databases.values()):
+        pool_sizes.update(size_pools({name: needs[name] for name, (service, _) in databases.items()
+                                      if service == pg_service}, pg_max_connections))
+    return [(name, service, database, search_pg[2] if name == 'search' else 'snoop', pool_sizes[name])
+            for name, (service, database) in sorted(databases.items())]
+
+
+def render_pgbouncer_service(collections):
+    '''Render the pgbouncer service of the override docker file and write its
+    configuration. pgbouncer pools the connections to the search and collections
+    databases in transaction mode.
+
+    :param collections: the dictionary containing the collections settings
+    :return: str
+    '''
+    databases = get_pgbouncer_databases(collections)
+    max_client_conn = max(min_client_connections, 2 * sum(database[4] for database in databases))
+    config = render_template(pgbouncer_config_file_name, databases=databases, pg_port=default_pg_port,
+                             port=pgbouncer_port, max_client_conn=max_client_conn) + '\n'
+    write_file_if_changed(os.path.join(settings_dir_name, pgbouncer_config_file_name), config)
+    return render_template(pgbouncer_file_name, service=pgbouncer_service, image=pgbouncer_image,
+                           config_file=pgbouncer_config_file_name,
+                           config_hash=get_content_hash(config)[:12],
+                           pg_services=sorted(set(database[1] for database in databases)))
+
+
+def get_pg_memory(collections, global_settings=None):
+    '''Return the memory of each postgres instance with a tuning profile. A share
+    of the host memory is split between the instances by their profiles. The
+    shared postgres service uses the shared_pg_profile.
+
+    :param collections: the dictionary containing the collections settings
+    :param global_settings: the settings shared by all collections; None for the defaults
+    :return: dictionary of collection name or shared_pg_service to memory in bytes
+    '''
+    profiles = {collection: settings.get('pg_profile') for collection, settings in collections.items()
+                if not settings.get('shared_pg')}
+    if uses_shared_pg(collections, global_settings):
+        profiles[shared_pg_service] = shared_pg_profile
+    return split_postgres_memory(profiles, get_memory_bytes())
+
+
+def write_pg_config_file(config_file_path, profile, pg_memory):
+    '''Write the postgres configuration file of a tuning profile, or remove it if
+    there is no profile. Returns the hash of the configuration, or None without a
+    profile.
+
+    :param config_file_path: the configuration file path
+    :param profile: one of the pg_profiles or None
+    :param pg_memory: the memory of the postgres instance in bytes
+    :return: str
+    '''
+    if not profile:
+        if os.path.isfile(config_file_path):
+            os.remove(config_file_path)
+        return None
+    config = render_template(pg_config_file_name, profile=profile, memory='%dMB' % (pg_memory // 2 ** 20),
+                             pg_settings=size_postgres(profile, pg_memory)) + '\n'
+    write_file_if_changed(config_file_path, config)
+    return get_content_hash(config)
+
+
+def render_pg_config(config_file, config_hash):
+    '''Return the volume and the command of a postgres service using the given
+    configuration file.
+
+    :param config_file: the configuration file path, relative to the settings directory
+    :param config_hash: the configuration hash returned by write_pg_config_file
+    :return: (str, str)
+    '''
+    pg_config_volume = '\n      - ./settings/%s:%s:ro' % (config_file, pg_config_path)
+    # the label changes with the configuration, so the service gets recreated
+    pg_config = '    command: postgres -c config_file=%s\n    labels:\n' \
+                '      org.hoover.pg-config: %s\n' % (pg_config_path, config_hash[:12])
+    return pg_config_volume, pg_config
+
+
+def add_workers_arguments(parser, replicas_default=1):
+    '''Add the options for the collection workers resources to the given parser.
+
+    :param parser: the argparse parser
+    :param replicas_default: the default number of worker containers
+    '''
+    parser.add_argument('--workers', type=int,
+                        help='Number of celery worker processes in each worker container; ' +
+                             '0 for the celery default (the number of CPUs).')
+    parser.add_argument('--replicas', type=int, default=replicas_default,
+                        help='Number of worker containers.')
+    parser.add_argument('--cpuset',
+                        help='CPUs the workers may run on, e.g. "0-3,6"; empty for all CPUs.')
+    parser.add_argument('--memory',
+                        help='Memory limit of each worker container, e.g. "4g"; empty for no limit.')
+
+
+def validate_workers_settings(settings):
+    '''Validate the workers resources settings. Returns the list of errors.
+
+    :param settings: dictionary containing the workers, replicas, cpuset and memory settings
+    :return: list
+    '''
+    errors = []
+    if settings.get('workers') is not None and settings['workers'] < 0:
+        errors.append('Invalid number of workers: %s' % settings['workers'])
+    if settings.get('replicas') is not None and settings['replicas'] < 1:
+        errors.append('Invalid number of replicas: %s' % settings['replicas'])
+    if settings.get('cpuset') and not cpuset_pattern.match(settings['cpuset']):
+        errors.append('Invalid cpuset "%s", expected e.g. "0-3,6"' % settings['cpuset'])
+    if settings.get('memory') and not memory_pattern.match(settings['memory'].lower()):
+        errors.append('Invalid memory limit "%s", expected e.g. "512m" or "4g"' % settings['memory'])
+    return errors
 
 
 def init_collection_settings(collections, args, data):
+    ports = data['ports']
     collections[args.collection] = {
         'autoindex': not args.manual_indexing,
         'image': args.snoop_image,
         'profiling': args.profiling,
         'tracing': args.tracing,
         'for_dev': args.dev,
-        'snoop_port': data['snoop_port'],
-        'flower_port': data['flower_port'] if not args.manual_indexing else None,
-        'pg_port': data['pg_port'] if args.dev else None,
-        'env': default_collection_settings['env']
+        'stats': args.stats,
+        'workers': args.workers or None,
+        'replicas': args.replicas,
+        'cpuset': args.cpuset or None,
+        'memory': args.memory.lower() if args.memory else None,
+        'pg_profile': args.pg_profile or None,
+        'shared_pg': args.shared_pg,
+        'snoop_port': ports['snoop_port'].allocate(),
+        'flower_port': ports['flower_port'].allocate() if not args.manual_indexing else None,
+        'pg_port': ports['pg_port'].allocate() if args.dev else None,
+        'env': dict(default_collection_settings['env'], **{DOCKER_HOOVER_SNOOP_SECRET_KEY: gen_secret_key()})
     }
     collections[args.collection]['env'][DOCKER_HOOVER_SNOOP_DEBUG] = args.dev
 
 
+def update_collection_port(ports, settings, port_setting, enabled):
+    '''Allocate or release the given collection port. An already assigned port is
+    kept when the port is enabled.
+
+    :param ports: the port allocators
+    :param settings: dictionary containing the collection settings
+    :param port_setting: the port setting name
+    :param enabled: if true the collection needs the port
+    '''
+    if enabled and not settings.get(port_setting):
+        settings[port_setting] = ports[port_setting].allocate()
+    elif not enabled:
+        if settings.get(port_setting):
+            ports[port_setting].release(settings[port_setting])
+        settings[port_setting] = None
+
+
 def update_collections_settings(settings, attributes, collections_names=None):
     if not collections_names:
         return
@@ -279,9 +637,9 @@ def update_collections_settings(settings, attributes, collections_names=None):
             setting[attribute] = new_value
 
             if attribute == 'autoindex':
-                collections[collection]['flower_port'] = settings['flower_port'] if new_value else None
+                update_collection_port(settings['ports'], collections[collection], 'flower_port', new_value)
             if attribute == 'for_dev':
-                collections[collection]['pg_port'] = settings['pg_port'] if new_value else None
+                update_collection_port(settings['ports'], collections[collection], 'pg_port', new_value)
                 collections[collection]['env'][DOCKER_HOOVER_SNOOP_DEBUG] = new_value
 
 
@@ -326,15 +684,36 @@ def collection_selected(collection, collections):
 
 def cleanup(collection_name):
     '''Does a cleanup of collection files. Used when the collection creation
-    encountered an error.
+    encountered an error. The postgresql data directory is moved to the trash,
+    to be deleted by the trash reaper, see start_trash_reaper.
     :param collection_name:
     '''
     settings_dir = os.path.join(settings_dir_name, collection_name)
     if os.path.isdir(settings_dir):
         rmtree(settings_dir, ignore_errors=True)
-    pg_dir = os.path.join(volumes_dir_name, 'snoop-pg--%s' % collection_name)
-    if os.path.isdir(pg_dir):
-        rmtree(pg_dir, ignore_errors=True)
+    move_to_trash(os.path.join(volumes_dir_name, 'snoop-pg--%s' % collection_name))
+
+
+def get_trash_roots():
+    '''Return the directories where collection data is moved to the trash.
+
+    :return: list
+    '''
+    return [volumes_dir_name, blobs_dir_name]
+
+
+def start_trash_reaper(rate_limit=None):
+    '''Start the emptytrash script in the background. Its progress is logged to
+    the trash log file in the settings directory.
+
+    :param rate_limit: the maximum number of files deleted per second
+    '''
+    cmd = [sys.executable, str(root_dir / 'emptytrash')]
+    if rate_limit is not None:
+        cmd += ['--rate-limit', str(rate_limit)]
+    with open(os.path.join(settings_dir_name, trash_log_file_name), 'a') as log_file:
+        subprocess.Popen(cmd, stdout=log_file, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                         start_new_session=True)
 
 
 def get_settings_dir(collection_name):
@@ -362,6 +741,77 @@ def create_settings_dir(collection_name, ignore_exists=False):
     return settings_dir
 
 
+def get_content_hash(content):
+    '''Return the hash of the given rendered content.
+
+    :param content: str
+    :return: str
+    '''
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def get_file_hash(file_path):
+    '''Return the hash of the given file content or None if the file does not exist.
+
+    :param file_path: the file path
+    :return: str
+    '''
+    try:
+        with open(file_path, 'rb') as file:
+            return hashlib.sha256(file.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def write_file_if_changed(file_path, content, tmp_file_path=None):
+    '''Write the content to the given file only if its hash differs from the hash
+    of the existing file. The file is replaced atomically. Returns true if the file
+    was written.
+
+    :param file_path: the file path
+    :param content: the new file content
+    :param tmp_file_path: the temporary file used for the atomic replace
+    :return: bool
+    '''
+    file_path = str(file_path)
+    if get_file_hash(file_path) == get_content_hash(content):
+        return False
+    tmp_file_path = str(tmp_file_path) if tmp_file_path else file_path + '.tmp'
+    with open(tmp_file_path, mode='w') as tmp_file:
+        tmp_file.write(content)
+    os.replace(tmp_file_path, file_path)
+    return True
+
+
+@lru_cache(maxsize=None)
+def get_templates_env(templates_dir):
+    '''Return the jinja environment loading templates from the given directory. The
+    environment is created once per directory and keeps the compiled templates. If
+    the HOOVER_TEMPLATES_CACHE_DIR environment variable is set the compiled templates
+    bytecode is also cached on disk in that directory.
+
+    :param templates_dir: the absolute path of the templates directory
+    :return: jinja2.Environment
+    '''
+    bytecode_cache = None
+    cache_dir = os.environ.get(HOOVER_TEMPLATES_CACHE_DIR)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    return Environment(loader=FileSystemLoader(templates_dir), bytecode_cache=bytecode_cache,
+                       cache_size=-1, auto_reload=False)
+
+
+def render_template(template_name, *args, **kwargs):
+    '''Render the given template from the templates directory.
+
+    :param template_name: the template file name
+    :return: str
+    '''
+    templates_env = get_templates_env(os.path.abspath(templates_dir_name))
+    return templates_env.get_template(template_name).render(*args, **kwargs)
+
+
 def read_env_file(settings_dir):
     '''Read the env file correspoding to the given collection. Returns a dictionary
     containing the environment variables.
@@ -384,10 +834,12 @@ def read_env_file(settings_dir):
 
 
 def write_env_file(settings_dir, settings):
-    '''Generate the environment file in the given settings directory.
+    '''Generate the environment file in the given settings directory. Returns true
+    if the file content changed.
 
     :param settings_dir: the directory containing the settings files
     :param env: dictionary with environment variables
+    :return: bool
     '''
     bool_params = {DOCKER_HOOVER_SNOOP_DEBUG: False}
     if 'env' not in settings:
@@ -400,69 +852,97 @@ def write_env_file(settings_dir, settings):
     settings['env'].setdefault(DOCKER_HOOVER_SNOOP_SECRET_KEY, gen_secret_key())
     settings['env'].setdefault(DOCKER_HOOVER_SNOOP_BASE_URL, 'http://localhost')
 
-    with open(os.path.join(templates_dir_name, env_file_name)) as env_template:
-        template = Template(env_template.read())
-        env_settings = template.render(tpl_env)
+    env_settings = render_template(env_file_name, tpl_env)
 
-    with open(os.path.join(settings_dir, env_file_name), mode='w') as env_file:
-        env_file.write(env_settings)
+    return write_file_if_changed(os.path.join(settings_dir, env_file_name), env_settings)
 
 
 def write_env_files(collections):
-    '''Generate environment files for the given collections.
+    '''Generate environment files for the given collections. Returns the list of
+    collections whose environment file changed.
 
     :param collections: list/dictionary of collections
+    :return: list
     '''
+    changed = []
     for collection, settings in collections.items():
         settings_dir = create_settings_dir(collection, ignore_exists=True)
-        write_env_file(settings_dir, settings)
+        if write_env_file(settings_dir, settings):
+            changed.append(collection)
+    return changed
 
 
-def write_python_settings_file(collection, settings_dir, settings):
-    '''Generate the corresponding collection python settings file.
+def get_collection_index(collection):
+    '''Return the name of the Elasticsearch index of a collection.
+
+    :param collection: the collection name
+    :return: str
+    '''
+    return collection.lower()
+
+
+def write_python_settings_file(collection, settings_dir, settings, global_settings=None):
+    '''Generate the corresponding collection python settings file. Returns true if
+    the file content changed.
 
     :param collection: the collection name
     :param settings_dir: the directory containing the settings files
     :param settings: dictionary containing collection settings
+    :param global_settings: the settings shared by all collections; None for the defaults
+    :return: bool
     '''
-    with open(os.path.join(templates_dir_name, snoop_settings_file_name)) as settings_template:
-        template = Template(settings_template.read())
-        snoop_settings = template.render(collection_name=collection,
-                                         collection_index=collection.lower(),
-                                         collection_root=get_collection_data_dir(collection))
+    pg_service, pg_database = get_collection_database(collection, settings)
+    snoop_settings = render_template(snoop_settings_file_name,
+                                     collection_name=collection,
+                                     pg_host=pg_service,
+                                     pg_database=pg_database,
+                                     collection_index=get_collection_index(collection),
+                                     collection_root=get_collection_data_dir(collection))
     if settings.get('profiling'):
-        with open(os.path.join(templates_dir_name, snoop_settings_profiling_file_name)) as \
-                profiling_template:
-            snoop_settings += Template(profiling_template.read()).render()
+        snoop_settings += render_template(snoop_settings_profiling_file_name)
     if settings.get('for_dev'):
-        with open(os.path.join(templates_dir_name, snoop_settings_dev_file_name)) as \
-                dev_template:
-            snoop_settings += Template(dev_template.read()).render()
+        snoop_settings += render_template(snoop_settings_dev_file_name)
     if settings.get('tracing'):
-        with open(os.path.join(templates_dir_name, snoop_settings_tracing_file_name)) as \
-                tracing_template:
-            snoop_settings += Template(tracing_template.read()).render()
+        snoop_settings += render_template(snoop_settings_tracing_file_name)
+    if settings.get('stats'):
+        snoop_settings += render_template(snoop_settings_stats_file_name)
+    if settings.get('workers'):
+        snoop_settings += render_template(snoop_settings_workers_file_name, workers=settings['workers'])
+    if (global_settings or {}).get('tika_cache'):
+        snoop_settings += render_template(snoop_settings_tika_file_name, tika_url=tika_cache_url)
+    if (global_settings or {}).get('pgbouncer'):
+        snoop_settings += render_template(snoop_settings_pgbouncer_file_name, host=pgbouncer_service,
+                                          port=pgbouncer_port, database=get_pgbouncer_database(collection))
 
-    with open(os.path.join(settings_dir, snoop_settings_file_name), mode='w') as settings_file:
-        settings_file.write(snoop_settings)
+    return write_file_if_changed(os.path.join(settings_dir, snoop_settings_file_name), snoop_settings)
 
 
-def write_python_settings_files(collections):
-    '''Generate the collections settings files.
+def write_python_settings_files(collections, global_settings=None):
+    '''Generate the collections settings files. Returns the list of collections
+    whose settings file changed.
 
     :param collections: the dictionary containing the collections settings
+    :param global_settings: the settings shared by all collections; None for the defaults
+    :return: list
     '''
+    changed = []
     for collection, settings in collections.items():
         settings_dir = create_settings_dir(collection, ignore_exists=True)
-        write_python_settings_file(collection, settings_dir, settings)
+        if write_python_settings_file(collection, settings_dir, settings, global_settings):
+            changed.append(collection)
+    return changed
 
 
-def write_collection_docker_file(collection, settings_dir, settings):
+def write_collection_docker_file(collection, settings_dir, settings, global_settings=None, pg_memory=None):
     '''Generate the corresponding collection docker file using the docker template.
+    Returns true if the file content changed.
 
     :param collection: the collection name
     :param settings_dir: the directory containing the settings files
     :param settings: dictionary containing the collection settings
+    :param global_settings: the settings shared by all collections; None for the defaults
+    :param pg_memory: the memory of the postgres instance in bytes, see get_pg_memory
+    :return: bool
     '''
     dev_volumes = '\n      - ../snoop2:/opt/hoover/snoop:cached' if settings.get('for_dev') else ''
     pg_port = settings.get('pg_port', default_pg_port + 1)
@@ -476,7 +956,9 @@ def write_collection_docker_file(collection, settings_dir, settings):
         profiling_volumes = '\n      - ./%s:/opt/hoover/snoop/profiles' % \
                             os.path.join('profiles', collection) + \
                             '\n      - ./settings/urls.py:/opt/hoover/snoop/snoop/urls.py'
-    if settings.get('autoindex'):
+    if settings.get('autoindex') and settings.get('cpuset'):
+        index_command = '    command: taskset -c %s ./manage.py runworkers\n' % settings['cpuset']
+    elif settings.get('autoindex'):
         index_command = '    command: ./manage.py runworkers\n'
     else:
         index_command = '    command: echo "disabled"\n'
@@ -484,21 +966,47 @@ def write_collection_docker_file(collection, settings_dir, settings):
         flower_port_text = '    ports:\n      - "%d:%d"\n' % (settings['flower_port'], default_flower_port)
     else:
         flower_port_text = ''
-
-    with open(os.path.join(templates_dir_name, docker_collection_file_name)) as docker_template:
-        template = Template(docker_template.read())
-        collection_settings = template.render(collection_name=collection,
-                                              snoop_image=settings['image'],
-                                              snoop_port=snoop_port,
-                                              profiling_volumes=profiling_volumes,
-                                              dev_volumes=dev_volumes,
-                                              dev_ports=dev_ports,
-                                              index_command=index_command,
-                                              flower_port=flower_port_text)
-
-    with open(os.path.join(settings_dir, docker_collection_file_name), mode='w') \
-            as collection_file:
-        collection_file.write(collection_settings)
+    # extra replicas are separate services because the flower port can be published only once
+    workers = [(service[len('snoop-worker--' + collection):], flower_port_text if index == 0 else '')
+               for index, service in enumerate(get_worker_services(collection, settings))]
+    if settings.get('memory'):
+        worker_resources = '    deploy:\n      resources:\n        limits:\n          memory: %s\n' % \
+            settings['memory']
+    else:
+        worker_resources = ''
+    snoop_stats = '\n      - snoop-stats-es' if settings.get('stats') else ''
+    tika_cache = '\n      - ' + tika_cache_service if (global_settings or {}).get('tika_cache') else ''
+    pgbouncer = '\n      - ' + pgbouncer_service if (global_settings or {}).get('pgbouncer') else ''
+    pg_service = get_collection_database(collection, settings)[0]
+    pg_config_hash = write_pg_config_file(os.path.join(settings_dir, pg_config_file_name),
+                                          None if settings.get('shared_pg') else settings.get('pg_profile'),
+                                          pg_memory)
+    if pg_config_hash:
+        pg_config_volume, pg_config = render_pg_config('%s/%s' % (collection, pg_config_file_name),
+                                                       pg_config_hash)
+    else:
+        pg_config_volume, pg_config = '', ''
+
+    collection_settings = render_template(docker_collection_file_name,
+                                          collection_name=collection,
+                                          snoop_image=settings['image'],
+                                          snoop_port=snoop_port,
+                                          profiling_volumes=profiling_volumes,
+                                          dev_volumes=dev_volumes,
+                                          dev_ports=dev_ports,
+                                          index_command=index_command,
+                                          workers=workers,
+                                          worker_resources=worker_resources,
+                                          snoop_stats=snoop_stats,
+                                          tika_cache=tika_cache,
+                                          shared_pg=settings.get('shared_pg'),
+                                          pg_service=pg_service,
+                                          pgbouncer=pgbouncer,
+                                          pg_config_volume=pg_config_volume,
+                                          pg_config=pg_config)
+
+    return write_file_if_changed(os.path.join(settings_dir, docker_collection_file_name),
+                                 collection_settings)
 
 
 def read_collection_docker_file(collection, settings_dir):
@@ -510,7 +1018,7 @@ def read_collection_docker_file(collection, settings_dir):
     :return: (str, int, int)
     '''
     with open(os.path.join(settings_dir, docker_collection_file_name)) as collection_file:
-        settings = yaml.load(collection_file, Loader=yaml.FullLoader)
+        settings = yaml.load(collection_file, Loader=yaml_loader)
         snoop_image = settings['snoop-worker--' + collection]['image']
         snoop_port = int(settings['snoop--' + collection]['ports'][0].split(sep=':')[0])
         if 'ports' in settings['snoop-worker--' + collection]:
@@ -520,18 +1028,21 @@ def read_collection_docker_file(collection, settings_dir):
         return snoop_image, snoop_port, flower_port
 
 
-def write_collections_docker_files(collections):
+def write_collections_docker_files(collections, ports=None, global_settings=None):
     '''Generate the collections docker files. Returns the number of dev instances.
+    Ports already assigned are kept; missing or duplicate ports are allocated. The
+    postgres memory is split between the collections with a tuning profile.
 
     :param collections: the dictionary containing the collections settings
+    :param ports: the port allocators; if missing they are loaded from settings
+    :param global_settings: the settings shared by all collections; None for the defaults
     :return: int
     '''
-    pg_port = default_pg_port + 1
-    last_snoop_port = start_snoop_port
-    next_flower_port = start_flower_port
+    if ports is None:
+        ports = read_port_allocators(collections)
     dev_instances = 0
-    flower_ports = set()
-    snoop_ports = set()
+    assigned = {port_setting: set() for port_setting in ports}
+    pg_memory = get_pg_memory(collections, global_settings)
 
     for collection, settings in collections.items():
         validate_collection_data_dir(collection)
@@ -540,66 +1051,276 @@ def write_collections_docker_files(collections):
 
         dev_instances += int(settings.get('for_dev', False))
 
-        if settings.get('autoindex'):
-            if not settings.get('flower_port') or settings['flower_port'] in flower_ports:
-                settings['flower_port'] = next_flower_port
-            if next_flower_port <= settings['flower_port']:
-                next_flower_port += 1
-            flower_ports.add(settings['flower_port'])
-        else:
-            settings['flower_port'] = None
+        enabled_ports = {
+            'snoop_port': True,
+            'flower_port': settings.get('autoindex'),
+            'pg_port': settings.get('for_dev'),
+        }
+        for port_setting, enabled in enabled_ports.items():
+            if settings.get(port_setting) in assigned[port_setting]:
+                settings[port_setting] = None
+            update_collection_port(ports, settings, port_setting, enabled)
+            assigned[port_setting].add(settings[port_setting])
+
+        write_collection_docker_file(collection, settings_dir, settings, global_settings,
+                                     pg_memory.get(collection))
+    return dev_instances
 
-        if settings.get('snoop_port') and settings['snoop_port'] not in snoop_ports:
-            last_snoop_port = settings['snoop_port']
-        else:
-            last_snoop_port += 1
-            settings['snoop_port'] = last_snoop_port
-        snoop_ports.add(last_snoop_port)
 
-        write_collection_docker_file(collection, settings_dir, settings)
-        pg_port += 1
-    return dev_instances
+def refresh_collections_docker_files(collections, global_settings=None):
+    '''Rewrite the docker files of the collections with a settings directory, with
+    the postgres memory split again between them. Called when collections are added,
+    renamed or removed, which changes the memory of every profiled postgres.
+
+    :param collections: the dictionary containing the collections settings
+    :param global_settings: the settings shared by all collections; None for the defaults
+    '''
+    pg_memory = get_pg_memory(collections, global_settings)
+    for collection, settings in collections.items():
+        settings_dir = get_settings_dir(collection)
+        if os.path.isdir(settings_dir):
+            write_collection_docker_file(collection, settings_dir, settings, global_settings,
+                                         pg_memory.get(collection))
 
 
-def write_global_docker_file(collections, for_dev=False):
-    '''Generate the override docker file from collection docker files.
+def read_docker_services(file_path):
+    '''Read the services defined in the given docker compose file. Returns an empty
+    dictionary if the file does not exist.
+
+    :param file_path: the docker compose file path
+    :return: dict
+    '''
+    if not os.path.isfile(str(file_path)):
+        return {}
+    with open(str(file_path)) as docker_file:
+        settings = yaml.load(docker_file, Loader=yaml_loader) or {}
+    return settings.get('services') or {}
 
-    :param collections: the collections name list
+
+def get_changed_services(old_file_path, new_file_path):
+    '''Return the sorted list of services that were added, removed or modified
+    between the given docker compose files.
+
+    :param old_file_path: the old docker compose file path
+    :param new_file_path: the new docker compose file path
+    :return: list
+    '''
+    return diff_services(read_docker_services(old_file_path), read_docker_services(new_file_path))
+
+
+def diff_services(old_services, new_services):
+    '''Return the sorted list of services that were added, removed or modified.
+
+    :param old_services: dictionary of service name to settings
+    :param new_services: dictionary of service name to settings
+    :return: list
+    '''
+    return sorted(service for service in set(old_services) | set(new_services)
+                  if old_services.get(service) != new_services.get(service))
+
+
+def get_collection_services_levels(services):
+    '''Split the collection services from the given list in groups ordered by their
+    dependencies: postgresql services, snoop web services, snoop workers. Services
+    not belonging to a collection are ignored.
+
+    :param services: list of service names
+    :return: list of lists
+    '''
+    levels = []
+    for prefix in collection_services_prefixes:
+        level = sorted(service for service in services if service.startswith(prefix))
+        if level:
+            levels.append(level)
+    return levels
+
+
+def get_worker_services(collection, settings):
+    '''Return the worker services of a collection, the main worker, which publishes
+    the flower port, being first.
+
+    :param collection: the collection name
+    :param settings: dictionary containing the collection settings
+    :return: list
+    '''
+    return ['snoop-worker--%s' % collection] + \
+        ['snoop-worker--%s--%d' % (collection, replica)
+         for replica in range(2, (settings.get('replicas') or 1) + 1)]
+
+
+def get_collection_services(collection, services):
+    '''Return the services from the given list which belong to the given collection.
+
+    :param collection: the collection name
+    :param services: list of service names
+    :return: list
+    '''
+    return sorted(service for service in services
+                  if any(service.startswith(prefix) for prefix in collection_services_prefixes) and
+                  service.split('--')[1] == collection)
+
+
+def render_tika_services(global_settings, for_dev=False):
+    '''Render the Tika services of the override docker file and write the Tika load
+    balancer configuration. With multiple replicas the snoop-tika service becomes a
+    least-connections proxy in front of the snoop-tika-<N> replicas, so the snoop
+    settings keep using http://snoop-tika:9998. Returns an empty string if the
+    snoop-tika service from docker-compose.yml is used unchanged.
+
+    :param global_settings: the global settings
+    :param for_dev: if true, the Tika port is published on the host
+    :return: str
+    '''
+    replicas, heap = get_tika_resources(global_settings)
+    if replicas == 1 and not heap and not for_dev:
+        return ''
+
+    java_environment = '\n    environment:\n      JAVA_TOOL_OPTIONS: -Xmx%s' % heap if heap else ''
+    tika_proxy, tika_environment, tika_replicas = '', '', []
+    if replicas > 1:
+        tika_replicas = list(range(1, replicas + 1))
+        tika_depends = ''.join('\n      - snoop-tika-%d' % replica for replica in tika_replicas)
+        tika_proxy = '\n    image: %s\n    volumes:' \
+                     '\n      - ./settings/%s:/usr/local/etc/haproxy/haproxy.cfg:ro' \
+                     '\n    depends_on:%s' % (tika_proxy_image, tika_proxy_file_name, tika_depends)
+        write_file_if_changed(os.path.join(settings_dir_name, tika_proxy_file_name),
+                              render_template(tika_proxy_file_name, tika_replicas=tika_replicas) + '\n')
+    else:
+        tika_environment = java_environment
+    tika_ports = '\n    ports:\n      - "%d:%d"' % (default_tika_port, default_tika_port) if for_dev else ''
+
+    return render_template(snoop_tika_file_name,
+                           tika_proxy=tika_proxy,
+                           tika_environment=tika_environment,
+                           tika_ports=tika_ports,
+                           tika_replicas=tika_replicas,
+                           replica_environment=java_environment) + '\n'
+
+
+def render_shared_pg_service(collections, global_settings=None):
+    '''Render the shared postgres service of the override docker file and write its
+    configuration file.
+
+    :param collections: the dictionary containing the collections settings
+    :param global_settings: the settings shared by all collections; None for the defaults
+    :return: str
+    '''
+    config_hash = write_pg_config_file(os.path.join(settings_dir_name, shared_pg_config_file_name),
+                                       shared_pg_profile,
+                                       get_pg_memory(collections, global_settings)[shared_pg_service])
+    pg_config_volume, pg_config = render_pg_config(shared_pg_config_file_name, config_hash)
+    return render_template(shared_pg_file_name, service=shared_pg_service,
+                           pg_config_volume=pg_config_volume, pg_config=pg_config)
+
+
+def write_global_docker_file(collections, for_dev=False, global_settings=None):
+    '''Generate the override docker file from collection docker files. The new file
+    is written only if its content changed. The orig docker file keeps the services
+    last applied, until apply_changed_services or starting docker-compose updates
+    it, so the changes of several runs are applied together. The snoop stats
+    services are added while at least one collection uses them. Returns the list of
+    services changed by this call.
+
+    :param collections: the dictionary containing the collections settings
     :param for_dev: if true, will add development settings
+    :param global_settings: the settings shared by all collections; None for the defaults
+    :return: list
     '''
+    docker_file_path = str(root_dir / docker_file_name)
+    orig_docker_file_path = str(root_dir / orig_docker_file_name)
+
+    old_services = read_docker_services(docker_file_path)
+    if os.path.isfile(docker_file_path) and not os.path.isfile(orig_docker_file_path):
+        copyfile(docker_file_path, orig_docker_file_path)
+
     if len(collections) == 0:
-        if os.path.isfile(docker_file_name):
-            os.rename(docker_file_name, orig_docker_file_name)
-        return
+        if os.path.isfile(docker_file_path):
+            os.remove(docker_file_path)
+        return diff_services(old_services, {})
+
+    docker_settings = ['version: "3.3"\n\nservices:\n']
+
+    custom_services_file_path = os.path.join(templates_dir_name, custom_services_file_name)
+    if os.path.isfile(custom_services_file_path):
+        with open(custom_services_file_path) as custom_services_file:
+            docker_settings.append(custom_services_file.read())
+        docker_settings.append('\n')
+
+    stats = any(settings.get('stats') for settings in collections.values())
+    if stats:
+        with open(os.path.join(templates_dir_name, snoop_stats_file_name)) as stats_file:
+            docker_settings.append(stats_file.read())
+        docker_settings.append('\n')
+
+    tika_services = render_tika_services(global_settings or global_settings_defaults, for_dev)
+    if tika_services:
+        docker_settings.append(tika_services)
+        docker_settings.append('\n')
+    if (global_settings or {}).get('tika_cache'):
+        docker_settings.append(render_template(tika_cache_file_name, image=tika_cache_image,
+                                               max_size=global_settings['tika_cache']))
+        docker_settings.append('\n\n')
+    if uses_shared_pg(collections, global_settings):
+        docker_settings.append(render_shared_pg_service(collections, global_settings))
+        docker_settings.append('\n\n')
+    pgbouncer = (global_settings or {}).get('pgbouncer')
+    if pgbouncer:
+        docker_settings.append(render_pgbouncer_service(collections))
+        docker_settings.append('\n\n')
+
+    template_file = docker_file_name if not for_dev else docker_dev_file_name
+    with open(os.path.join(templates_dir_name, template_file)) as docker_file:
+        docker_settings.append(docker_file.read())
+
+    search_depends = ['snoop--' + c for c in collections] + ([pgbouncer_service] if pgbouncer else [])
+    docker_settings.append('    depends_on:\n      - %s\n' % '\n      - '.join(search_depends))
+    if pgbouncer:
+        # read by settings/search-settings.py
+        docker_settings.append('    environment:\n      DOCKER_HOOVER_PGBOUNCER_HOST: %s\n'
+                               '      DOCKER_HOOVER_PGBOUNCER_PORT: "%d"\n' %
+                               (pgbouncer_service, pgbouncer_port))
+    snoop_aliases = ''.join(['\n      - "snoop--%s:snoop--%s"' % (c, c.lower()) if c != c.lower()
+                             else '' for c in collections])
+    if snoop_aliases:
+        docker_settings.append('    links:%s\n' % snoop_aliases)
+
+    for collection_name in collections:
+        docker_settings.append('\n')
+        collection_docker_file_path = os.path.join(settings_dir_name, collection_name,
+                                                   docker_collection_file_name)
+        with open(collection_docker_file_path) as collection_docker_file:
+            docker_settings.append(collection_docker_file.read())
+        docker_settings.append('\n')
+
+    if stats:
+        docker_settings.append(snoop_stats_volumes)
+
+    if not write_file_if_changed(docker_file_path, ''.join(docker_settings),
+                                 tmp_file_path=root_dir / new_docker_file_name):
+        return []
+    return diff_services(old_services, read_docker_services(docker_file_path))
+
 
-    with open(str(root_dir / new_docker_file_name), 'w') as new_docker_file:
-        new_docker_file.write('version: "3.3"\n\nservices:\n')
-
-        custom_services_file_path = os.path.join(templates_dir_name, custom_services_file_name)
-        if os.path.isfile(custom_services_file_path):
-            with open(custom_services_file_path) as custom_services_file:
-                new_docker_file.write(custom_services_file.read())
-            new_docker_file.write('\n')
-
-        template_file = docker_file_name if not for_dev else docker_dev_file_name
-        with open(os.path.join(templates_dir_name, template_file)) as docker_file:
-            new_docker_file.write(docker_file.read())
-
-        snoop_collections = '\n      - '.join(['snoop--' + c for c in collections])
-        new_docker_file.write('    depends_on:\n      - %s\n' % snoop_collections)
-        snoop_aliases = ''.join(['\n      - "snoop--%s:snoop--%s"' % (c, c.lower()) if c != c.lower()
-                                 else '' for c in collections])
-        if snoop_aliases:
-            new_docker_file.write('    links:%s\n' % snoop_aliases)
-
-        for collection_name in collections:
-            new_docker_file.write('\n')
-            collection_docker_file_path = os.path.join(settings_dir_name, collection_name,
-                                                       docker_collection_file_name)
-            with open(collection_docker_file_path) as collection_docker_file:
-                new_docker_file.write(collection_docker_file.read())
-            new_docker_file.write('\n')
-
-    if os.path.isfile(str(root_dir / docker_file_name)):
-        os.rename(str(root_dir / docker_file_name), str(root_dir / orig_docker_file_name))
-    os.rename(str(root_dir / new_docker_file_name), str(root_dir / docker_file_name))
+def mark_services_applied():
+    '''Save the override docker file as the orig docker file once its services are
+    running, see write_global_docker_file.
+    '''
+    docker_file_path = str(root_dir / docker_file_name)
+    orig_docker_file_path = str(root_dir / orig_docker_file_name)
+    if os.path.isfile(docker_file_path):
+        copyfile(docker_file_path, orig_docker_file_path)
+    elif os.path.isfile(orig_docker_file_path):
+        os.remove(orig_docker_file_path)
+
+
+def print_changed_services(changed_services):
+    '''Print the services changed by the last override docker file generation.
+
+    :param changed_services: list of service names
+    '''
+    if not changed_services:
+        print('No docker services changed.')
+        return
+    print('Changed docker services:')
+    for service in changed_services:
+        print('  - %s' % service)
@@ -2,25 +2,65 @@ import argparse
 from collections import OrderedDict
 import os.path
 
-from jinja2 import Template
+import yaml
 
 from src.common import get_collections_data, validate_collections, cleanup, \
-    write_global_docker_file, templates_dir_name, instructions_dir_name, \
+    write_global_docker_file, render_template, instructions_dir_name, \
     collection_allowed_chars, validate_collection_name, validate_collection_data_dir, \
-    create_settings_dir, write_collection_docker_file, volumes_dir_name, \
+    create_settings_dir, refresh_collections_docker_files, volumes_dir_name, \
     write_python_settings_file, default_snoop_image, write_env_file, \
     InvalidCollectionName, exit_msg, init_collection_settings,\
-    write_collections_settings
+    write_collections_settings, registry_locked, get_collection_data_dir, yaml_loader, start_trash_reaper, \
+    add_workers_arguments, validate_workers_settings, get_collection_database, \
+    compose_command
+from src.resources import pg_profiles
+from src.process import apply_changed_services, run_many
 
 steps_file_name = 'collection-%s-steps.txt'
 steps_script_name = 'init-%s.sh'
+default_jobs = 4
+manifest_options = {
+    'snoop_image': default_snoop_image,
+    'dev': False,
+    'profiling': False,
+    'tracing': False,
+    'manual_indexing': False,
+    'stats': False,
+    'workers': None,
+    'replicas': 1,
+    'cpuset': None,
+    'memory': None,
+    'pg_profile': None,
+    'shared_pg': False,
+}
+init_steps = [
+    compose_command + ' run --rm snoop--{collection_name} /wait',
+    '{create_database}',
+    compose_command + ' run --rm snoop--{collection_name} ./manage.py initcollection',
+    compose_command + ' run --rm search ./manage.py addcollection {collection_name} '
+    '--index {collection_index} http://snoop--{collection_name}/collection/json',
+]
+
+
+def get_create_database_command(collection, settings):
+    '''Return the command creating the database of a collection in the shared
+    postgres service, or an empty string if the collection has its own postgres.
+
+    :param collection: the collection name
+    :param settings: dictionary containing the collection settings
+    :return: str
+    '''
+    if not settings.get('shared_pg'):
+        return ''
+    return '%s exec -T %s createdb -U snoop %s' % \
+        ((compose_command,) + get_collection_database(collection, settings))
 
 
 def write_instructions(args):
-    with open(os.path.join(templates_dir_name, 'collection-steps.txt')) as steps_template:
-        template = Template(steps_template.read())
-        steps = template.render(collection_name=args.collection,
-                                collection_index=str.lower(args.collection))
+    create_database = get_create_database_command(args.collection, vars(args))
+    steps = render_template('collection-steps.txt', collection_name=args.collection,
+                            collection_index=str.lower(args.collection), create_database=create_database,
+                            compose_command=compose_command)
 
     collection_steps_file_name = os.path.join(instructions_dir_name, steps_file_name % '%s' % args.collection)
     with open(collection_steps_file_name, mode='w') as steps_file:
@@ -29,9 +69,9 @@ def write_instructions(args):
     print(open(collection_steps_file_name).read())
     print('\nThe steps above are described in "%s" OR' % collection_steps_file_name)
 
-    with open(os.path.join(templates_dir_name, 'collection-steps.sh')) as script_template:
-        template = Template(script_template.read())
-        script = template.render(collection_name=args.collection, collection_index=str.lower(args.collection))
+    script = render_template('collection-steps.sh', collection_name=args.collection,
+                             collection_index=str.lower(args.collection), create_database=create_database,
+                             compose_command=compose_command)
 
     collection_steps_script_name = os.path.join(instructions_dir_name,
                                                 steps_script_name % '%s' % args.collection)
@@ -44,8 +84,16 @@ def write_instructions(args):
 
 def get_args():
     parser = argparse.ArgumentParser(description='Create a collection.')
-    parser.add_argument('-c', '--collection', required=True,
-                        help='Collection name; allowed characters: ' + collection_allowed_chars)
+    collection = parser.add_mutually_exclusive_group(required=True)
+    collection.add_argument('-c', '--collection',
+                            help='Collection name; allowed characters: ' + collection_allowed_chars)
+    collection.add_argument('--manifest',
+                            help='YAML file listing the collections to create. Each entry has a ' +
+                                 '"name" and optionally: ' + ', '.join(manifest_options))
+    parser.add_argument('-j', '--jobs', type=int, default=default_jobs,
+                        help='Number of collections initialized in parallel when using a manifest.')
+    parser.add_argument('--skip-init', action='store_const', const=True, default=False,
+                        help='Do not initialize the collections created from a manifest.')
     parser.add_argument('-s', '--snoop-image', default=default_snoop_image,
                         help='Snoop docker image')
     parser.add_argument('-d', '--dev', action='store_const', const=True, default=False,
@@ -56,6 +104,18 @@ def get_args():
                         help='Add tracing settings for the new collection.')
     parser.add_argument('-m', '--manual-indexing', action='store_const', const=True, default=False,
                         help='Do not add the option to start indexing automatically.')
+    parser.add_argument('--stats', action='store_const', const=True, default=False,
+                        help='Send the task statistics of the new collection to the kibana stats.')
+    add_workers_arguments(parser)
+    parser.add_argument('--pg-profile', choices=pg_profiles,
+                        help='Tuning profile of the collection postgres, sized from the host memory; ' +
+                             'the postgres defaults if not given.')
+    parser.add_argument('--shared-pg', action='store_const', const=True, default=False,
+                        help='Keep the collection database in the shared postgres service instead ' +
+                             'of running a postgres service for the collection.')
+    parser.add_argument('--apply', action='store_const', const=True, default=False,
+                        help='Recreate only the changed collection services instead of ' +
+                             'restarting docker-compose.')
     args = parser.parse_args()
 
     return args
@@ -67,6 +127,7 @@ def create_pg_dir(collection):
         os.mkdir(pg_dir)
 
 
+@registry_locked
 def create_collection(args):
     data = get_collections_data()
     try:
@@ -76,6 +137,9 @@ def create_collection(args):
     if len(data['collections']):
         validate_collections(data['collections'])
     validate_collection_data_dir(args.collection)
+    errors = validate_workers_settings(vars(args))
+    if errors:
+        exit_msg('\n'.join(errors))
 
     try:
         init_collection_settings(data['collections'], args, data)
@@ -84,15 +148,155 @@ def create_collection(args):
 
         ordered_collections = OrderedDict(sorted(data['collections'].items(), key=lambda t: t[0]))
 
-        write_collection_docker_file(args.collection, settings_dir,
-                                     data['collections'][args.collection])
+        refresh_collections_docker_files(data['collections'], data['global_settings'])
         write_env_file(settings_dir, data['collections'][args.collection])
-        write_python_settings_file(args.collection, settings_dir, data['collections'][args.collection])
-        write_global_docker_file(ordered_collections, args.dev or bool(data['dev_instances']))
+        write_python_settings_file(args.collection, settings_dir, data['collections'][args.collection],
+                                   data['global_settings'])
+        write_global_docker_file(ordered_collections, args.dev or bool(data['dev_instances']),
+                                 data['global_settings'])
         write_collections_settings(data)
     except Exception as e:
         print('Error creating collection: %s' % e)
         cleanup(args.collection)
+        start_trash_reaper()
         raise
 
+    if args.apply:
+        apply_changed_services()
     write_instructions(args)
+
+
+def read_manifest(manifest_file_name):
+    '''Read the collections from the given manifest file. Returns a list of
+    arguments, one for each collection, in the format returned by get_args.
+
+    :param manifest_file_name: the manifest file path
+    :return: list
+    '''
+    with open(manifest_file_name) as manifest_file:
+        manifest = yaml.load(manifest_file, Loader=yaml_loader) or {}
+
+    collections_args = []
+    for entry in manifest.get('collections') or []:
+        if not isinstance(entry, dict) or 'name' not in entry:
+            exit_msg('Invalid manifest entry %s: each collection must have a name', entry)
+        unknown = set(entry) - set(manifest_options) - {'name'}
+        if unknown:
+            exit_msg('Invalid options for collection %s: %s', entry['name'], ', '.join(sorted(unknown)))
+        options = dict(manifest_options, **entry)
+        options['collection'] = str(options.pop('name'))
+        collections_args.append(argparse.Namespace(**options))
+    if not collections_args:
+        exit_msg('No collections found in %s', manifest_file_name)
+    return collections_args
+
+
+def validate_manifest_collections(collections_args, collections):
+    '''Validate all collections from a manifest. Returns the list of errors.
+
+    :param collections_args: list of collection arguments
+    :param collections: the existing collections
+    :return: list
+    '''
+    errors = []
+    names = list(collections)
+    for args in collections_args:
+        try:
+            validate_collection_name(args.collection, names)
+        except InvalidCollectionName as e:
+            errors.append(str(e))
+        if not os.path.isdir(get_collection_data_dir(args.collection)):
+            errors.append('Collection %s does not have a data directory (%s)' %
+                          (args.collection, get_collection_data_dir(args.collection)))
+        errors.extend('Collection %s: %s' % (args.collection, error)
+                      for error in validate_workers_settings(vars(args)))
+        pg_profile = vars(args).get('pg_profile')
+        if pg_profile and pg_profile not in pg_profiles:
+            errors.append('Collection %s: invalid postgres profile "%s", expected one of: %s' %
+                          (args.collection, pg_profile, ', '.join(pg_profiles)))
+        names.append(args.collection)
+    return errors
+
+
+@registry_locked
+def render_manifest_collections(collections_args):
+    '''Create the settings of all collections from a manifest and write the
+    override docker file once.
+
+    :param collections_args: list of collection arguments
+    '''
+    data = get_collections_data()
+    errors = validate_manifest_collections(collections_args, data['collections'])
+    if errors:
+        exit_msg('\n'.join(errors))
+    if len(data['collections']):
+        validate_collections(data['collections'])
+
+    created = []
+    try:
+        for args in collections_args:
+            init_collection_settings(data['collections'], args, data)
+            create_pg_dir(args.collection)
+            settings_dir = create_settings_dir(args.collection)
+            created.append(args.collection)
+
+            settings = data['collections'][args.collection]
+            write_env_file(settings_dir, settings)
+            write_python_settings_file(args.collection, settings_dir, settings, data['global_settings'])
+
+        refresh_collections_docker_files(data['collections'], data['global_settings'])
+        ordered_collections = OrderedDict(sorted(data['collections'].items(), key=lambda t: t[0]))
+        for_dev = any(args.dev for args in collections_args) or bool(data['dev_instances'])
+        write_global_docker_file(ordered_collections, for_dev, data['global_settings'])
+        write_collections_settings(data)
+    except Exception as e:
+        print('Error creating collections: %s' % e)
+        for collection in created:
+            cleanup(collection)
+        start_trash_reaper()
+        raise
+    print('Created %d collections.' % len(created))
+
+
+def init_collections(collections, jobs=default_jobs, settings=None):
+    '''Initialize the given collections running at most the given number of
+    collections in parallel. Returns the dictionary of failed collections and errors.
+
+    :param collections: list of collection names
+    :param jobs: maximum number of collections initialized in parallel
+    :param settings: dictionary of collection name to settings; None for the defaults
+    :return: dict
+    '''
+    apply_changed_services()
+
+    settings = settings or {}
+    commands = OrderedDict()
+    for collection in collections:
+        create_database = get_create_database_command(collection, settings.get(collection, {}))
+        steps = [step.format(collection_name=collection, collection_index=collection.lower(),
+                             create_database=create_database) for step in init_steps]
+        commands[collection] = [step for step in steps if step]
+    done = []
+
+    def report(collection, error):
+        done.append(collection)
+        status = 'initialized' if error is None else 'FAILED (%s)' % error.cmd
+        print('[%d/%d] %s: %s' % (len(done), len(collections), collection, status))
+
+    results = run_many(commands, concurrency=jobs, on_done=report)
+    return OrderedDict((collection, error) for collection, error in results.items() if error)
+
+
+def create_collections_from_manifest(args):
+    collections_args = read_manifest(args.manifest)
+    render_manifest_collections(collections_args)
+    if args.skip_init:
+        return
+
+    failed = init_collections([c.collection for c in collections_args], args.jobs,
+                              {c.collection: vars(c) for c in collections_args})
+    if failed:
+        print('\nFailed to initialize %d collections:' % len(failed))
+        for collection, error in failed.items():
+            print('  - %s: %s' % (collection, error))
+        exit(1)
@@ -0,0 +1,221 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import fcntl
+import hashlib
+import os
+import sqlite3
+
+from src.common import blobs_dir_name, exit_msg
+
+pool_dir_name = '.pool'
+index_file_name = 'index.db'
+skipped_dir_names = ['tmp']
+hash_chunk_size = 2 ** 20
+tmp_suffix = '.dedup'
+# ioctl request number for FICLONE, from linux/fs.h
+FICLONE = 0x40049409
+
+index_schema = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+'''
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Replace identical blobs of all collections with ' +
+                                                 'links into a shared pool.')
+    parser.add_argument('-m', '--mode', choices=['hardlink', 'reflink'], default='hardlink',
+                        help='Replace duplicates with hard links (default) or with reflinks ' +
+                             '(copy-on-write clones, needs btrfs or xfs).')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 4,
+                        help='Number of files scanned and hashed in parallel.')
+    parser.add_argument('-n', '--dry-run', action='store_const', const=True, default=False,
+                        help='Only report the duplicates and the space that would be reclaimed.')
+    args = parser.parse_args()
+
+    return args
+
+
+def get_collections_blobs_dirs(blobs_dir):
+    '''Return the blobs directories of the collections, skipping the pool and the trash.
+
+    :param blobs_dir: the snoop-blobs directory
+    :return: list
+    '''
+    if not os.path.isdir(blobs_dir):
+        return []
+    return sorted(entry.path for entry in os.scandir(blobs_dir)
+                  if entry.is_dir(follow_symlinks=False) and not entry.name.startswith('.'))
+
+
+def scan_blobs(collection_blobs_dir):
+    '''Return (path, stat) for the blobs of a collection. Files of the temporary
+    directory, where snoop writes blobs before moving them in place, are skipped.
+
+    :param collection_blobs_dir: the blobs directory of a collection
+    :return: list
+    '''
+    files = []
+    for dir_path, dir_names, file_names in os.walk(collection_blobs_dir):
+        if dir_path == collection_blobs_dir:
+            dir_names[:] = [d for d in dir_names if d not in skipped_dir_names and not d.startswith('.')]
+        for file_name in file_names:
+            if file_name.endswith(tmp_suffix):
+                continue
+            path = os.path.join(dir_path, file_name)
+            stat = os.lstat(path)
+            if stat.st_size and os.path.isfile(path) and not os.path.islink(path):
+                files.append((path, stat))
+    return files
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as blob:
+        for chunk in iter(lambda: blob.read(hash_chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_pool_path(pool_dir, digest):
+    return os.path.join(pool_dir, digest[:2], digest[2:])
+
+
+def reflink(src, dst):
+    '''Create dst as a copy-on-write clone of src.'''
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+
+
+def replace_with_pool_file(path, pool_path, mode):
+    '''Atomically replace the file at path with a link to the pool file.
+
+    :param path: the duplicate file path
+    :param pool_path: the pool file with the same content
+    :param mode: hardlink or reflink
+    '''
+    tmp_path = path + tmp_suffix
+    if mode == 'reflink':
+        reflink(pool_path, tmp_path)
+        stat = os.lstat(path)
+        os.chmod(tmp_path, stat.st_mode)
+        os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    else:
+        os.link(pool_path, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def collect_garbage(pool_dir):
+    '''Remove the pool files which are not linked from any collection anymore, and
+    the empty pool directories. Returns the number of bytes of the removed files.
+
+    :param pool_dir: the pool directory
+    :return: int
+    '''
+    freed = 0
+    for dir_path, _, file_names in os.walk(pool_dir, topdown=False):
+        if dir_path == pool_dir:
+            continue
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            stat = os.lstat(path)
+            if stat.st_nlink == 1:
+                os.unlink(path)
+                freed += stat.st_size
+        if not os.listdir(dir_path):
+            os.rmdir(dir_path)
+    return freed
+
+
+def dedup(blobs_dir, mode='hardlink', jobs=4, dry_run=False):
+    '''Replace identical blobs of all collections with hard links or reflinks to a
+    shared pool. The digests are kept in an index in the pool directory and files
+    whose inode, size and modification time did not change are not hashed again.
+    Returns a dictionary with the counts of scanned, hashed and replaced files and
+    the number of reclaimed bytes.
+
+    :param blobs_dir: the snoop-blobs directory
+    :param mode: hardlink or reflink
+    :param jobs: the number of threads scanning and hashing files
+    :param dry_run: only count the duplicates
+    :return: dict
+    '''
+    pool_dir = os.path.join(blobs_dir, pool_dir_name)
+    os.makedirs(pool_dir, exist_ok=True)
+    index = sqlite3.connect(os.path.join(pool_dir, index_file_name), isolation_level=None)
+    index.executescript(index_schema)
+    indexed = {path: (inode, size, mtime_ns, digest) for path, inode, size, mtime_ns, digest in
+               index.execute('SELECT path, inode, size, mtime_ns, digest FROM files')}
+    report = {'scanned': 0, 'hashed': 0, 'replaced': 0, 'reclaimed': 0}
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        files = [file for scanned in executor.map(scan_blobs, get_collections_blobs_dirs(blobs_dir))
+                 for file in scanned]
+        report['scanned'] = len(files)
+
+        def get_digest(file):
+            path, stat = file
+            saved = indexed.get(path)
+            if saved and saved[:3] == (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+                return saved[3], False
+            return hash_file(path), True
+
+        digests = list(executor.map(get_digest, files))
+
+    index.execute('BEGIN')
+    seen = set()
+    pool_inodes = {}
+    for (path, stat), (digest, hashed) in zip(files, digests):
+        seen.add(path)
+        report['hashed'] += hashed
+        pool_path = get_pool_path(pool_dir, digest)
+        if digest not in pool_inodes:
+            if not os.path.exists(pool_path) and not dry_run:
+                os.makedirs(os.path.dirname(pool_path), exist_ok=True)
+                os.link(path, pool_path)
+            pool_inodes[digest] = os.lstat(pool_path).st_ino if os.path.exists(pool_path) else stat.st_ino
+
+        # hard links share the pool inode; reflinks don't, so an unchanged indexed
+        # file was already cloned by a previous run
+        if mode == 'hardlink':
+            duplicate = stat.st_ino != pool_inodes[digest]
+        else:
+            duplicate = hashed and stat.st_ino != pool_inodes[digest]
+        if duplicate:
+            if mode == 'reflink' or os.lstat(path).st_nlink == 1:
+                report['reclaimed'] += stat.st_size
+            report['replaced'] += 1
+            if not dry_run:
+                replace_with_pool_file(path, pool_path, mode)
+                stat = os.lstat(path)
+        if not dry_run:
+            index.execute('INSERT OR REPLACE INTO files (path, inode, size, mtime_ns, digest) '
+                          'VALUES (?, ?, ?, ?, ?)',
+                          (path, stat.st_ino, stat.st_size, stat.st_mtime_ns, digest))
+    if not dry_run:
+        for path in set(indexed) - seen:
+            index.execute('DELETE FROM files WHERE path = ?', (path,))
+    index.execute('COMMIT')
+    index.close()
+
+    if not dry_run:
+        freed = collect_garbage(pool_dir)
+        if mode == 'hardlink':
+            report['reclaimed'] += freed
+    return report
+
+
+def dedup_blobs(args):
+    try:
+        report = dedup(blobs_dir_name, args.mode, args.jobs, args.dry_run)
+    except OSError as e:
+        exit_msg('Failed to deduplicate blobs: %s', e)
+    print('Scanned %d blobs, hashed %d, %s %d duplicates, %s %.1f MB.' %
+          (report['scanned'], report['hashed'], 'found' if args.dry_run else 'replaced',
+           report['replaced'], 'would reclaim' if args.dry_run else 'reclaimed',
+           report['reclaimed'] / 2 ** 20))
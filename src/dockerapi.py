@@ -0,0 +1,263 @@
+import http.client
+import json
+import os
+import re
+import socket
+import struct
+import time
+from urllib.parse import quote, urlencode
+
+default_socket_path = '/var/run/docker.sock'
+api_version = 'v1.25'
+compose_project_label = 'com.docker.compose.project'
+compose_service_label = 'com.docker.compose.service'
+
+
+class DockerAPIError(RuntimeError):
+    def __init__(self, status, message):
+        super().__init__('Docker API error %d: %s' % (status, message))
+        self.status = status
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    '''HTTP connection over a unix socket.'''
+
+    def __init__(self, socket_path, timeout=60):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+def get_socket_path():
+    '''Return the docker socket path from the DOCKER_HOST environment variable or the
+    default docker socket path.
+
+    :return: str
+    '''
+    docker_host = os.environ.get('DOCKER_HOST', '')
+    if docker_host.startswith('unix://'):
+        return docker_host[len('unix://'):]
+    return default_socket_path
+
+
+def get_compose_project_name(project_dir):
+    '''Return the docker-compose project name for the given directory.
+
+    :param project_dir: the directory containing docker-compose.yml
+    :return: str
+    '''
+    if os.environ.get('COMPOSE_PROJECT_NAME'):
+        return os.environ['COMPOSE_PROJECT_NAME']
+    return re.sub(r'[^-_a-z0-9]', '', os.path.basename(os.path.abspath(str(project_dir))).lower())
+
+
+def demultiplex(data):
+    '''Split a docker raw stream in stdout and stderr.
+
+    :param data: bytes read from an attached container stream
+    :return: (bytes, bytes)
+    '''
+    output = {1: [], 2: []}
+    while len(data) >= 8:
+        stream_type, size = struct.unpack('>BxxxL', data[:8])
+        output.setdefault(stream_type, []).append(data[8:8 + size])
+        data = data[8 + size:]
+    return b''.join(output[1]), b''.join(output[2])
+
+
+class DockerClient:
+    '''Docker Engine API client talking to the docker daemon over its unix socket.
+    The connection is kept open between requests and the containers state is cached
+    for the lifetime of the client, which is meant to be one command. The cache is
+    cleared when containers are started or stopped.
+    '''
+
+    def __init__(self, socket_path=None, timeout=60):
+        self.socket_path = socket_path or get_socket_path()
+        self.timeout = timeout
+        self.connection = None
+        self._cache = {}
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    def _request(self, method, path, params=None, body=None, raw=False):
+        url = '/%s%s' % (api_version, path)
+        if params:
+            url += '?' + urlencode(params)
+        headers = {'Host': 'docker'}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+
+        for retry in [True, False]:
+            if not self.connection:
+                self.connection = UnixHTTPConnection(self.socket_path, self.timeout)
+            try:
+                self.connection.request(method, url, body=payload, headers=headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if not retry:
+                    raise
+        if response.will_close:
+            self.close()
+
+        if response.status >= 400:
+            try:
+                message = json.loads(data.decode('utf-8')).get('message', '')
+            except ValueError:
+                message = data.decode('utf-8', 'replace')
+            raise DockerAPIError(response.status, message)
+        if raw:
+            return data
+        return json.loads(data.decode('utf-8')) if data else None
+
+    def clear_cache(self):
+        '''Forget the cached containers state, e.g. after running docker-compose.'''
+        self._cache.clear()
+
+    def ping(self):
+        return self._request('GET', '/_ping', raw=True) == b'OK'
+
+    def containers(self, all=False, labels=None, name=None):
+        '''List containers. The result is cached for the lifetime of the client.
+
+        :param all: if true list stopped containers too
+        :param labels: dictionary of labels the containers must have
+        :param name: filter containers by name
+        :return: list of dicts
+        '''
+        filters = {}
+        if labels:
+            filters['label'] = ['%s=%s' % (label, value) for label, value in sorted(labels.items())]
+        if name:
+            filters['name'] = [name]
+        key = ('containers', all, json.dumps(filters, sort_keys=True))
+        if key not in self._cache:
+            params = {'all': int(all)}
+            if filters:
+                params['filters'] = json.dumps(filters)
+            self._cache[key] = self._request('GET', '/containers/json', params)
+        return self._cache[key]
+
+    def service_containers(self, project, service, all=False):
+        '''List the containers of a docker-compose service.
+
+        :param project: the docker-compose project name
+        :param service: the service name
+        :param all: if true list stopped containers too
+        :return: list of dicts
+        '''
+        return self.containers(all=all, labels={compose_project_label: project,
+                                                compose_service_label: service})
+
+    def inspect(self, container):
+        '''Return the low-level information of a container. The result is cached for
+        the lifetime of the client.
+
+        :param container: the container id or name
+        :return: dict
+        '''
+        key = ('inspect', container)
+        if key not in self._cache:
+            self._cache[key] = self._request('GET', '/containers/%s/json' % quote(container))
+        return self._cache[key]
+
+    def service_address(self, project, service):
+        '''Return the IP address of the first running container of a docker-compose
+        service, or None if the service is not running.
+
+        :param project: the docker-compose project name
+        :param service: the service name
+        :return: str
+        '''
+        for container in self.service_containers(project, service):
+            networks = self.inspect(container['Id'])['NetworkSettings']['Networks']
+            for network in networks.values():
+                if network.get('IPAddress'):
+                    return network['IPAddress']
+        return None
+
+    def is_running(self, container):
+        return self.inspect(container)['State'].get('Running', False)
+
+    def health(self, container):
+        '''Return the health status of a container ("starting", "healthy",
+        "unhealthy") or None if the container has no health check.
+
+        :param container: the container id or name
+        :return: str
+        '''
+        health = self.inspect(container)['State'].get('Health')
+        return health['Status'] if health else None
+
+    def wait_healthy(self, container, timeout=60, interval=1):
+        '''Wait until a container is healthy or, if it has no health check, running.
+        Returns true if the container became healthy before the timeout.
+
+        :param container: the container id or name
+        :param timeout: timeout in seconds
+        :param interval: polling interval in seconds
+        :return: bool
+        '''
+        deadline = time.time() + timeout
+        while True:
+            self._cache.pop(('inspect', container), None)
+            health = self.health(container)
+            if health == 'healthy' or (health is None and self.is_running(container)):
+                return True
+            if time.time() >= deadline:
+                return False
+            time.sleep(interval)
+
+    def start(self, container):
+        self._request('POST', '/containers/%s/start' % quote(container), raw=True)
+        self.clear_cache()
+
+    def stop(self, container, timeout=10):
+        self._request('POST', '/containers/%s/stop' % quote(container), {'t': timeout}, raw=True)
+        self.clear_cache()
+
+    def exec(self, container, cmd, env=None):
+        '''Run a command in a running container and wait for it to finish. Returns the
+        exit code and the command stdout and stderr.
+
+        :param container: the container id or name
+        :param cmd: list of command arguments
+        :param env: dictionary of environment variables
+        :return: (int, bytes, bytes)
+        '''
+        body = {'Cmd': cmd, 'AttachStdout': True, 'AttachStderr': True}
+        if env:
+            body['Env'] = ['%s=%s' % item for item in env.items()]
+        exec_id = self._request('POST', '/containers/%s/exec' % quote(container), body=body)['Id']
+        data = self._request('POST', '/exec/%s/start' % exec_id, body={'Detach': False, 'Tty': False},
+                             raw=True)
+        stdout, stderr = demultiplex(data)
+        exit_code = self._request('GET', '/exec/%s/json' % exec_id)['ExitCode']
+        return exit_code, stdout, stderr
+
+
+_client = None
+
+
+def get_client():
+    '''Return the docker client shared by the current command.
+
+    :return: DockerClient
+    '''
+    global _client
+    if _client is None:
+        _client = DockerClient()
+    return _client
@@ -0,0 +1,28 @@
+import argparse
+import os
+
+from src.common import get_trash_roots, settings_dir_name, trash_lock_file_name
+from src.trash import empty_trash as empty_trash_dirs, list_trash, default_rate_limit, default_jobs
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Delete the collection data moved to the trash.')
+    parser.add_argument('-r', '--rate-limit', type=int, default=default_rate_limit,
+                        help='Maximum number of files deleted per second; 0 for no limit.')
+    parser.add_argument('-j', '--jobs', type=int, default=default_jobs,
+                        help='Number of directories deleted in parallel.')
+    parser.add_argument('-l', '--list', action='store_const', const=True, default=False,
+                        help='List the trash content and exit.')
+    args = parser.parse_args()
+
+    return args
+
+
+def empty_trash(args):
+    if args.list:
+        for entry in list_trash(get_trash_roots()):
+            print(entry)
+        return
+
+    empty_trash_dirs(get_trash_roots(), os.path.join(settings_dir_name, trash_lock_file_name),
+                     rate_limit=args.rate_limit, jobs=args.jobs)
@@ -0,0 +1,281 @@
+import json
+import os
+import re
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from src.dockerapi import get_client, get_compose_project_name
+
+es_service = 'search-es'
+es_port = 9200
+snapshot_repository = 'hoover-rename'
+snapshot_repository_location = 'rename'
+bulk_index_settings = {
+    'index.refresh_interval': '-1',
+    'index.number_of_replicas': '0',
+    'index.translog.durability': 'async',
+}
+warm_up_fields = ['filetype', 'lang', 'email-domains', 'from', 'to', 'path-parts', 'date', 'date-created']
+keyword_types = ['keyword']
+numeric_types = ['date', 'long', 'integer', 'short', 'byte', 'double', 'float']
+
+
+class ElasticsearchError(RuntimeError):
+    def __init__(self, status, message):
+        super().__init__('Elasticsearch error %d: %s' % (status, message))
+        self.status = status
+
+
+def get_es_url(project_dir):
+    '''Return the Elasticsearch URL from the HOOVER_ES_URL environment variable or,
+    if not set, the address of the search-es container.
+
+    :param project_dir: the directory containing docker-compose.yml
+    :return: str
+    '''
+    if os.environ.get('HOOVER_ES_URL'):
+        return os.environ['HOOVER_ES_URL'].rstrip('/')
+    address = get_client().service_address(get_compose_project_name(project_dir), es_service)
+    if not address:
+        raise RuntimeError('The %s service is not running.' % es_service)
+    return 'http://%s:%d' % (address, es_port)
+
+
+def request(es_url, method, path, body=None, params=None, timeout=None):
+    '''Send a request to Elasticsearch and return the decoded JSON response.
+
+    :param es_url: the Elasticsearch URL
+    :param method: the HTTP method
+    :param path: the request path
+    :param body: the request body, encoded as JSON
+    :param params: dictionary of query parameters
+    :param timeout: timeout in seconds; None waits forever
+    :return: dict
+    '''
+    url = es_url + path
+    if params:
+        url += '?' + urlencode(params)
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = Request(url, data=data, method=method, headers={'Content-Type': 'application/json'})
+    try:
+        with urlopen(req, timeout=timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except HTTPError as e:
+        raise ElasticsearchError(e.code, e.read().decode('utf-8', 'replace'))
+
+
+def index_exists(es_url, index):
+    try:
+        request(es_url, 'GET', '/' + index)
+    except ElasticsearchError as e:
+        if e.status == 404:
+            return False
+        raise
+    return True
+
+
+def count(es_url, index):
+    request(es_url, 'POST', '/%s/_refresh' % index)
+    return request(es_url, 'GET', '/%s/_count' % index)['count']
+
+
+def ensure_snapshot_repository(es_url):
+    '''Register the filesystem snapshot repository used for renaming indexes. Its
+    location is relative to the path.repo setting of search-es.
+    '''
+    request(es_url, 'PUT', '/_snapshot/' + snapshot_repository,
+            {'type': 'fs', 'settings': {'location': snapshot_repository_location, 'compress': False}})
+
+
+def snapshot_index(es_url, index, snapshot):
+    request(es_url, 'PUT', '/_snapshot/%s/%s' % (snapshot_repository, snapshot),
+            {'indices': index, 'include_global_state': False},
+            params={'wait_for_completion': 'true'})
+
+
+def restore_index(es_url, index, new_index, snapshot):
+    request(es_url, 'POST', '/_snapshot/%s/%s/_restore' % (snapshot_repository, snapshot),
+            {'indices': index, 'include_global_state': False, 'include_aliases': False,
+             'rename_pattern': '^%s$' % re.escape(index), 'rename_replacement': new_index},
+            params={'wait_for_completion': 'true'})
+
+
+def delete_snapshot(es_url, snapshot):
+    request(es_url, 'DELETE', '/_snapshot/%s/%s' % (snapshot_repository, snapshot))
+
+
+def delete_index(es_url, index):
+    request(es_url, 'DELETE', '/' + index)
+
+
+def add_alias(es_url, index, alias):
+    request(es_url, 'POST', '/_aliases', {'actions': [{'add': {'index': index, 'alias': alias}}]})
+
+
+def rename_index(es_url, index, new_index, alias=False):
+    '''Rename an index by restoring a snapshot of it under the new name, or by adding
+    an alias with the new name if alias is true. The old index is deleted only after
+    the restored index has the same number of documents, otherwise the restored
+    index is deleted.
+
+    :param es_url: the Elasticsearch URL
+    :param index: the index name
+    :param new_index: the new index name
+    :param alias: add an alias instead of copying the index
+    '''
+    if not index_exists(es_url, index):
+        raise RuntimeError(f'Index "{index}" does not exist.')
+    if index_exists(es_url, new_index):
+        raise RuntimeError(f'Index "{new_index}" already exists.')
+
+    if alias:
+        print(f'Adding alias "{new_index}" to index "{index}"...')
+        add_alias(es_url, index, new_index)
+        return
+
+    snapshot = 'rename-%s-to-%s' % (index, new_index)
+    ensure_snapshot_repository(es_url)
+    print(f'Creating snapshot of index "{index}"...')
+    snapshot_index(es_url, index, snapshot)
+    try:
+        print(f'Restoring index "{index}" as "{new_index}"...')
+        restore_index(es_url, index, new_index, snapshot)
+    finally:
+        delete_snapshot(es_url, snapshot)
+
+    old_count, new_count = count(es_url, index), count(es_url, new_index)
+    if old_count != new_count:
+        delete_index(es_url, new_index)
+        raise RuntimeError(f'Restored index "{new_index}" had {new_count} documents, ' +
+                           f'expected {old_count}; it was deleted and the index "{index}" was kept.')
+    delete_index(es_url, index)
+
+
+def get_index_settings(es_url, index, names):
+    '''Return the values of the given settings of an index. Settings left to their
+    default value are returned as None.
+
+    :param es_url: the Elasticsearch URL
+    :param index: the index name or alias
+    :param names: the flat setting names, e.g. "index.refresh_interval"
+    :return: dict
+    '''
+    response = request(es_url, 'GET', '/%s/_settings' % index, params={'flat_settings': 'true'})
+    index_settings = next(iter(response.values()))['settings']
+    return {name: index_settings.get(name) for name in names}
+
+
+def put_index_settings(es_url, index, settings):
+    '''Update the dynamic settings of an index. Settings set to None are reset to
+    their default value.
+
+    :param es_url: the Elasticsearch URL
+    :param index: the index name or alias
+    :param settings: dictionary of flat setting name to value
+    '''
+    request(es_url, 'PUT', '/%s/_settings' % index, settings)
+
+
+def set_bulk_mode(es_url, index):
+    '''Switch an index to settings favouring indexing throughput: no periodic
+    refresh, no replicas and an asynchronous translog. The write block set by
+    optimize is lifted and not restored by set_serve_mode. Returns the previous
+    values of the other settings, to be restored by set_serve_mode.
+
+    :param es_url: the Elasticsearch URL
+    :param index: the index name or alias
+    :return: dict
+    '''
+    previous = get_index_settings(es_url, index, bulk_index_settings)
+    put_index_settings(es_url, index, dict(bulk_index_settings, **{'index.blocks.write': None}))
+    return previous
+
+
+def set_serve_mode(es_url, index, previous=None):
+    '''Restore the settings changed by set_bulk_mode and refresh the index, making
+    the documents indexed in bulk mode searchable.
+
+    :param es_url: the Elasticsearch URL
+    :param index: the index name or alias
+    :param previous: the settings returned by set_bulk_mode; None for the defaults
+    '''
+    put_index_settings(es_url, index, {name: (previous or {}).get(name) for name in bulk_index_settings})
+    request(es_url, 'POST', '/%s/_refresh' % index)
+
+
+def force_merge(es_url, index, max_num_segments=1):
+    '''Merge the segments of an index, waiting for the merge to finish.
+
+    :param es_url: the Elasticsearch URL
+    :param index: the index name or alias
+    :param max_num_segments: the number of segments per shard to merge to
+    '''
+    request(es_url, 'POST', '/%s/_forcemerge' % index, params={'max_num_segments': max_num_segments})
+
+
+def set_read_only(es_url, index, read_only=True):
+    '''Block or allow writes to an index. Settings changes are still allowed.
+
+    :param es_url: the Elasticsearch URL
+    :param index: the index name or alias
+    :param read_only: true to block writes
+    '''
+    put_index_settings(es_url, index, {'index.blocks.write': 'true' if read_only else None})
+
+
+def get_field_types(es_url, index):
+    '''Return the types of the top level fields of an index.
+
+    :param es_url: the Elasticsearch URL
+    :param index: the index name or alias
+    :return: dict
+    '''
+    mappings = next(iter(request(es_url, 'GET', '/%s/_mapping' % index).values()))['mappings']
+    types = {}
+    for mapping in mappings.values():
+        for field, properties in mapping.get('properties', {}).items():
+            if 'type' in properties:
+                types[field] = properties['type']
+    return types
+
+
+def warm_up(es_url, index, fields=warm_up_fields):
+    '''Load the global ordinals and doc values of the given fields, which are used by
+    the search filters and aggregations, by running one aggregation on each of them.
+    Returns the fields that were warmed up.
+
+    :param es_url: the Elasticsearch URL
+    :param index: the index name or alias
+    :param fields: the field names; fields missing from the mapping are skipped
+    :return: list
+    '''
+    types = get_field_types(es_url, index)
+    aggregations = {}
+    for field in fields:
+        if types.get(field) in keyword_types:
+            aggregations[field] = {'terms': {'field': field, 'size': 1}}
+        elif types.get(field) in numeric_types:
+            aggregations[field] = {'stats': {'field': field}}
+    if aggregations:
+        request(es_url, 'POST', '/%s/_search' % index, {'size': 0, 'aggs': aggregations},
+                params={'request_cache': 'false'})
+    return list(aggregations)
+
+
+def optimize(es_url, index, max_num_segments=1, read_only=True):
+    '''Prepare the index of a collection which finished indexing for searching:
+    refresh it, merge its segments, block writes and warm up the fields used by the
+    search filters.
+
+    :param es_url: the Elasticsearch URL
+    :param index: the index name or alias
+    :param max_num_segments: the number of segments per shard to merge to
+    :param read_only: true to block writes to the index
+    :return: the warmed up fields
+    '''
+    request(es_url, 'POST', '/%s/_refresh' % index)
+    force_merge(es_url, index, max_num_segments)
+    if read_only:
+        set_read_only(es_url, index)
+    return warm_up(es_url, index)
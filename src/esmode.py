@@ -0,0 +1,143 @@
+import argparse
+import sys
+import time
+
+from src.autoscaler import RabbitMQClient, get_rabbitmq_url
+from src.common import get_collections_data, write_collections_settings, registry_locked, \
+    validate_collections, exit_msg, root_dir, get_collection_index
+from src import es
+from src.optimize import optimize_collection
+
+modes = ['bulk', 'serve']
+default_interval = 30
+default_grace = 120
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Switch the collections indexes between bulk ' +
+                                                 'indexing and serving settings.')
+    parser.add_argument('mode', choices=modes + ['auto'],
+                        help='bulk: disable refresh and replicas and make the translog asynchronous; ' +
+                             'serve: restore the index settings; auto: switch to bulk while the ' +
+                             'collection has queued tasks and back to serve once the queues drain.')
+    parser.add_argument('collections', nargs='*',
+                        help='The collections to switch; all collections by default.')
+    parser.add_argument('--interval', type=int, default=default_interval,
+                        help='Seconds between queue checks in auto mode.')
+    parser.add_argument('--grace', type=int, default=default_grace,
+                        help='Seconds the queues must stay empty before switching back to serve ' +
+                             'in auto mode.')
+    parser.add_argument('--optimize', action='store_const', const=True, default=False,
+                        help='Optimize the indexes switched back to serve in auto mode, see ./optimize.')
+    return parser.parse_args()
+
+
+@registry_locked
+def switch_mode(es_url, collection, mode):
+    '''Switch the index of a collection to the given mode. The index settings
+    replaced by the bulk mode are saved in the collection settings and restored by
+    the serve mode.
+
+    :param es_url: the Elasticsearch URL
+    :param collection: the collection name
+    :param mode: bulk or serve
+    '''
+    data = get_collections_data()
+    settings = data['collections'][collection]
+    index = get_collection_index(collection)
+    if mode == 'bulk':
+        previous = es.set_bulk_mode(es_url, index)
+        if settings.get('es_mode') != 'bulk':
+            settings['es_serve_settings'] = previous
+    else:
+        es.set_serve_mode(es_url, index, settings.pop('es_serve_settings', None))
+    settings['es_mode'] = mode
+    write_collections_settings(data)
+
+
+class ModeSwitcher:
+    '''Switches the collections to bulk mode when tasks are queued for them and back
+    to serve mode when their queues stayed empty for the grace period.
+
+    :param queues: object with a queue_depths(collections) method, e.g. RabbitMQClient
+    :param set_mode: callable receiving the collection name and the mode
+    '''
+
+    def __init__(self, queues, set_mode, grace=default_grace, clock=time.monotonic, output=sys.stdout):
+        self.queues = queues
+        self.set_mode = set_mode
+        self.grace = grace
+        self.clock = clock
+        self.output = output
+        self.drained_since = {}
+
+    def step(self, collections_modes):
+        '''Check the queues once and switch the collections which need it. Returns the
+        new modes.
+
+        :param collections_modes: dictionary of collection name to current mode
+        :return: dict
+        '''
+        depths = self.queues.queue_depths(list(collections_modes))
+        now = self.clock()
+        new_modes = dict(collections_modes)
+        for collection, mode in collections_modes.items():
+            if depths.get(collection):
+                self.drained_since.pop(collection, None)
+                new_mode = 'bulk'
+            elif mode == 'bulk':
+                drained_since = self.drained_since.setdefault(collection, now)
+                new_mode = 'serve' if now - drained_since >= self.grace else 'bulk'
+            else:
+                new_mode = mode
+            if new_mode != mode:
+                self.output.write('%s: %d queued tasks, switching to %s mode\n' %
+                                  (collection, depths.get(collection, 0), new_mode))
+                self.output.flush()
+                self.set_mode(collection, new_mode)
+                self.drained_since.pop(collection, None)
+            new_modes[collection] = new_mode
+        return new_modes
+
+
+def get_collections_modes(names=None):
+    collections = get_collections_data()['collections']
+    return {collection: settings.get('es_mode', 'serve') for collection, settings in collections.items()
+            if not names or collection in names}
+
+
+def esmode(args):
+    collections = get_collections_data()['collections']
+    if args.collections:
+        validate_collections(args.collections)
+        missing = [collection for collection in args.collections if collection not in collections]
+        if missing:
+            exit_msg('Invalid collections: %s', ', '.join(missing))
+    try:
+        es_url = es.get_es_url(root_dir)
+    except (OSError, RuntimeError) as e:
+        exit_msg('Unable to find Elasticsearch: %s', e)
+
+    try:
+        if args.mode in modes:
+            for collection in args.collections or collections:
+                print('Switching %s to %s mode...' % (collection, args.mode))
+                switch_mode(es_url, collection, args.mode)
+            return
+
+        def set_mode(collection, mode):
+            switch_mode(es_url, collection, mode)
+            if mode == 'serve' and args.optimize:
+                optimize_collection(es_url, collection)
+
+        switcher = ModeSwitcher(RabbitMQClient(get_rabbitmq_url(root_dir)), set_mode, grace=args.grace)
+        while True:
+            try:
+                switcher.step(get_collections_modes(args.collections))
+            except (OSError, ValueError, RuntimeError) as e:
+                print('Switching modes failed: %s' % e, flush=True)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    except (OSError, RuntimeError) as e:
+        exit_msg('%s', e)
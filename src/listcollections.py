@@ -1,14 +1,34 @@
 import argparse
+from collections import OrderedDict
 from copy import deepcopy
 import json
+import os
 
-from src.common import get_collections_data
+from src.common import get_collections_data, get_registry, exit_msg, blobs_dir_name, \
+    volumes_dir_name, settings_dir_name
+from src import registry
+from src.usage import get_usage, format_size, default_jobs
+from src import status
+
+usage_cache_file_name = 'usage.db'
+usage_categories = ['blobs', 'pg', 'exports']
 
 
 def get_args():
     parser = argparse.ArgumentParser(description='List collections.')
     parser.add_argument('-j', '--json', action='store_const', const=True, default=False,
                         help='Output in json format.')
+    parser.add_argument('--port', type=int,
+                        help='Print the collection using the given port.')
+    parser.add_argument('-u', '--usage', action='store_const', const=True, default=False,
+                        help='Print the disk usage of the collections blobs, postgresql ' +
+                             'volumes and exports.')
+    parser.add_argument('--jobs', type=int, default=default_jobs,
+                        help='Number of directories scanned in parallel for --usage.')
+    parser.add_argument('-l', '--live', action='store_const', const=True, default=False,
+                        help='Show the indexing progress of all collections, refreshed periodically.')
+    parser.add_argument('--interval', type=int, default=status.default_interval,
+                        help='Seconds between refreshes for --live.')
     return parser.parse_args()
 
 
@@ -24,6 +44,15 @@ def print_collections(collections):
         print('  - profiling: %s' % settings.get('profiling', False))
         print('  - tracing: %s' % settings.get('tracing', False))
         print('  - development: %s' % settings.get('for_dev', False))
+        print('  - stats: %s' % ('enabled' if settings.get('stats') else 'disabled'))
+        print('  - index mode: %s' % settings.get('es_mode', 'serve'))
+        print('  - workers: %s x %s, CPUs: %s, memory: %s' % (
+            settings.get('replicas') or 1, settings.get('workers') or 'default',
+            settings.get('cpuset') or 'all', settings.get('memory') or 'unlimited'))
+        if settings.get('shared_pg'):
+            print('  - postgres: shared')
+        else:
+            print('  - postgres profile: %s' % (settings.get('pg_profile') or 'default'))
         index += 1
 
 
@@ -38,7 +67,80 @@ def prepare_data(collections):
     return data
 
 
+def print_port_owner(port):
+    owner = registry.find_collection_by_port(get_registry(), port)
+    if not owner:
+        exit_msg('Port %d is not used by any collection', port)
+    print('%s (%s)' % owner)
+
+
+def get_collection_dirs(collection):
+    '''Return the data directories of a collection by usage category and whether
+    their files are never modified in place, which allows caching their usage.
+
+    :param collection: the collection name
+    :return: OrderedDict of category to (path, cacheable)
+    '''
+    return OrderedDict((
+        ('blobs', (os.path.join(blobs_dir_name, collection), True)),
+        ('pg', (os.path.join(volumes_dir_name, 'snoop-pg--%s' % collection), False)),
+        ('exports', (os.path.join(volumes_dir_name, 'exports', collection), True)),
+    ))
+
+
+def get_collections_usage(collections, jobs=default_jobs):
+    '''Return the disk usage of each collection by category and in total, and the
+    totals of all collections.
+
+    :param collections: the collections names
+    :param jobs: number of directories scanned in parallel
+    :return: OrderedDict
+    '''
+    dirs = OrderedDict((collection, get_collection_dirs(collection)) for collection in collections)
+    roots = {path: cacheable for collection_dirs in dirs.values()
+             for path, cacheable in collection_dirs.values()}
+    usage = get_usage(roots, os.path.join(settings_dir_name, usage_cache_file_name), jobs)
+
+    result = OrderedDict((('collections', OrderedDict()),
+                          ('total', OrderedDict((category, 0) for category in usage_categories + ['total']))))
+    for collection, collection_dirs in dirs.items():
+        collection_usage = OrderedDict((category, usage[path]['size'])
+                                       for category, (path, _) in collection_dirs.items())
+        collection_usage['total'] = sum(collection_usage.values())
+        collection_usage['errors'] = sum(usage[path]['errors'] for path, _ in collection_dirs.values())
+        result['collections'][collection] = collection_usage
+        for category in usage_categories + ['total']:
+            result['total'][category] += collection_usage[category]
+    return result
+
+
+def print_usage(usage):
+    row_format = '%-30s' + ' %12s' * (len(usage_categories) + 1)
+    print(row_format % tuple(['collection'] + usage_categories + ['total']))
+    for collection, collection_usage in usage['collections'].items():
+        print(row_format % tuple([collection] + [format_size(collection_usage[category])
+                                                 for category in usage_categories + ['total']]))
+        if collection_usage['errors']:
+            print('  %d directories could not be read, the usage is incomplete' %
+                  collection_usage['errors'])
+    print(row_format % tuple(['TOTAL'] + [format_size(usage['total'][category])
+                                          for category in usage_categories + ['total']]))
+
+
 def list_collections(args):
+    if args.port:
+        print_port_owner(args.port)
+        return
+    if args.live:
+        status.watch(get_collections_data()['collections'], args.interval)
+        return
+    if args.usage:
+        usage = get_collections_usage(get_collections_data()['collections'], args.jobs)
+        if args.json:
+            print(json.dumps(usage, indent=4))
+        else:
+            print_usage(usage)
+        return
     collections = prepare_data(get_collections_data()['collections'])
     if args.json:
         print(json.dumps(collections, indent=4))
@@ -0,0 +1,105 @@
+import argparse
+import os
+from subprocess import CalledProcessError
+
+from src.common import get_collections_data, validate_collections, exit_msg, registry_locked, \
+    write_global_docker_file, write_collections_docker_files, write_python_settings_files, \
+    write_collections_settings, write_global_settings, get_collection_database, get_worker_services, \
+    shared_pg_service, volumes_dir_name, compose_command
+from src import pg
+from src.process import stream, ensure_docker_running, exit_on_exception, apply_changed_services
+from src.trash import move_to_trash
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Move the collections databases from their own ' +
+                                                 'postgres services to the shared postgres service.')
+    parser.add_argument('collections', nargs='*',
+                        help='The collections to migrate; all collections with their own postgres ' +
+                             'by default.')
+    parser.add_argument('--remove-volumes', action='store_const', const=True, default=False,
+                        help='Move the postgres volumes of the migrated collections to the trash.')
+    return parser.parse_args()
+
+
+def write_settings(data):
+    '''Write the settings and docker files of all collections and recreate the
+    changed services.
+
+    :param data: the collections data returned by get_collections_data
+    '''
+    collections = data['collections']
+    write_python_settings_files(collections, data['global_settings'])
+    dev_instances = write_collections_docker_files(collections, data['ports'], data['global_settings'])
+    write_global_docker_file(collections, bool(dev_instances), data['global_settings'])
+    write_collections_settings(data)
+    apply_changed_services()
+
+
+@exit_on_exception
+def copy_collection_database(collection, settings):
+    '''Stop the collection services and copy its database into the shared postgres
+    service. The database created in the shared service is dropped if the copy
+    fails.
+
+    :param collection: the collection name
+    :param settings: dictionary containing the collection settings
+    '''
+    source = get_collection_database(collection, settings)
+    target = get_collection_database(collection, dict(settings, shared_pg=True))
+
+    services = ['snoop--' + collection] + get_worker_services(collection, settings)
+    print('Stopping collection "%s" services...' % collection)
+    stream(compose_command + ' stop ' + ' '.join(services), prefix=collection)
+    stream(compose_command + ' up -d --no-deps ' + source[0], prefix=collection)
+    pg.wait_ready(source[0])
+
+    print('Copying database of collection "%s" to %s/%s...' % (collection, target[0], target[1]))
+    pg.create_database(*target)
+    try:
+        pg.copy_database(source, target)
+    except CalledProcessError:
+        pg.drop_database(*target)
+        raise
+
+
+@registry_locked
+def migrate_pg(args):
+    data = get_collections_data()
+    collections = data['collections']
+    validate_collections(collections)
+    if args.collections:
+        missing = [collection for collection in args.collections if collection not in collections]
+        if missing:
+            exit_msg('Invalid collections: %s', ', '.join(missing))
+        shared = [collection for collection in args.collections if collections[collection].get('shared_pg')]
+        if shared:
+            exit_msg('Collections already using the shared postgres: %s', ', '.join(shared))
+        names = args.collections
+    else:
+        names = [collection for collection, settings in collections.items() if not settings.get('shared_pg')]
+    if not names:
+        print('No collections to migrate.')
+        return
+
+    ensure_docker_running()
+    if not data['global_settings'].get('shared_pg'):
+        data['global_settings']['shared_pg'] = True
+        write_global_settings({'shared_pg': True})
+        write_settings(data)
+    stream(compose_command + ' up -d --no-deps ' + shared_pg_service, prefix=shared_pg_service)
+    try:
+        pg.wait_ready(shared_pg_service)
+    except TimeoutError as e:
+        exit_msg('%s', e)
+
+    for index, collection in enumerate(names, 1):
+        copy_collection_database(collection, collections[collection])
+        collections[collection]['shared_pg'] = True
+        # the collection postgres service is removed from the docker file and stopped
+        write_settings(data)
+        pg_dir = os.path.join(volumes_dir_name, 'snoop-pg--%s' % collection)
+        if args.remove_volumes:
+            move_to_trash(pg_dir)
+        print('[%d/%d] Migrated collection "%s"; its previous postgres data is %s' %
+              (index, len(names), collection, 'in the trash' if args.remove_volumes else 'kept in ' + pg_dir))
@@ -0,0 +1,256 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+
+from src.common import get_collections_data, validate_collections, exit_msg, get_collection_data_dir, \
+    validate_collection_name, InvalidCollectionName, ocr_path, get_settings_dir, compose_command
+from src.process import stream, exit_on_exception
+
+engines = ['ocrmypdf', 'tesseract']
+default_engine = 'ocrmypdf'
+default_language = 'eng'
+manifest_file_name = 'ocr-%s.db'
+tmp_dir_name = '.tmp'
+hash_chunk_size = 2 ** 20
+tmp_suffix = '.tmp'
+snoop_ocr_dir = '/opt/hoover/snoop/ocr'
+
+manifest_schema = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    md5 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='OCR the documents of a collection into the ocr folder ' +
+                                                 'and register the folder as a snoop OCR source.')
+    parser.add_argument('-c', '--collection', required=True, help='The collection to OCR.')
+    parser.add_argument('-s', '--source',
+                        help='Name of the OCR source, also the ocr/<source> folder; the collection ' +
+                             'name by default.')
+    parser.add_argument('-e', '--engine', choices=engines, default=default_engine,
+                        help='OCR engine: ocrmypdf handles PDFs and images, tesseract only images.')
+    parser.add_argument('-l', '--language', default=default_language,
+                        help='Tesseract languages of the documents, e.g. "eng+deu".')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 4,
+                        help='Number of documents processed in parallel.')
+    parser.add_argument('--skip-register', action='store_const', const=True, default=False,
+                        help='Do not register the OCR source with the collection.')
+    return parser.parse_args()
+
+
+class OcrmypdfEngine:
+    '''Adds a text layer to PDFs and images with ocrmypdf. Pages which already
+    have text are kept.'''
+
+    extensions = ('.pdf', '.png', '.jpg', '.jpeg', '.tif', '.tiff')
+
+    def __init__(self, language=default_language):
+        self.language = language
+
+    def __call__(self, source_path, output_path):
+        subprocess.run(['ocrmypdf', '-q', '-l', self.language, '--skip-text', '--output-type', 'pdf',
+                        source_path, output_path], check=True, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.PIPE)
+
+
+class TesseractEngine:
+    '''Converts images to searchable PDFs with tesseract.'''
+
+    extensions = ('.png', '.jpg', '.jpeg', '.tif', '.tiff')
+
+    def __init__(self, language=default_language):
+        self.language = language
+
+    def __call__(self, source_path, output_path):
+        # tesseract adds the .pdf extension to the output base name
+        output_base, _ = os.path.splitext(output_path)
+        subprocess.run(['tesseract', source_path, output_base, '-l', self.language, 'pdf'], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if output_base + '.pdf' != output_path:
+            os.replace(output_base + '.pdf', output_path)
+
+
+def get_engine(name, language=default_language):
+    '''Return the OCR engine with the given name. An engine is a callable writing
+    the searchable PDF of a document, with the extensions it handles.
+
+    :param name: one of the engines
+    :param language: the languages of the documents
+    :return: callable
+    '''
+    return {'ocrmypdf': OcrmypdfEngine, 'tesseract': TesseractEngine}[name](language)
+
+
+def md5_file(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as document:
+        for chunk in iter(lambda: document.read(hash_chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scan_documents(root, extensions):
+    '''Return (path, stat) of the documents under root with the given extensions,
+    skipping hidden files and directories.
+
+    :param root: the collection data directory
+    :param extensions: tuple of lowercase file extensions
+    :return: list
+    '''
+    documents = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = sorted(d for d in dir_names if not d.startswith('.'))
+        for file_name in sorted(file_names):
+            if file_name.startswith('.') or not file_name.lower().endswith(extensions):
+                continue
+            path = os.path.join(dir_path, file_name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                documents.append((path, os.stat(path)))
+    return documents
+
+
+def ocr_document(engine, path, output_dir, tmp_dir):
+    '''OCR a document into output_dir/<md5>.pdf, unless a document with the same
+    content was already processed. The output is written to a temporary file in
+    tmp_dir, outside the OCR source, and moved in place when complete. Returns the
+    MD5 of the document and whether it was processed.
+
+    :param engine: the OCR engine
+    :param path: the document path
+    :param output_dir: the OCR source directory
+    :param tmp_dir: directory for the partial results, on the same filesystem
+    :return: (str, bool)
+    '''
+    md5 = md5_file(path)
+    output_path = os.path.join(output_dir, md5 + '.pdf')
+    if os.path.exists(output_path):
+        return md5, False
+    tmp_path = os.path.join(tmp_dir, '%s.%d.%d.pdf%s' % (md5, os.getpid(), threading.get_ident(), tmp_suffix))
+    try:
+        engine(path, tmp_path)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return md5, True
+
+
+def ocr_collection(data_dir, output_dir, engine, manifest_path, tmp_dir, jobs=4, output=sys.stdout):
+    '''OCR the documents of a collection in parallel. The documents OCR'ed before,
+    whose size and modification time did not change, are skipped using the
+    manifest. Returns a dictionary with the counts of scanned, skipped, processed
+    and failed documents.
+
+    :param data_dir: the collection data directory
+    :param output_dir: the OCR source directory
+    :param engine: the OCR engine, see get_engine
+    :param manifest_path: the manifest of the collection and OCR source
+    :param tmp_dir: directory for the partial results, outside the OCR source
+    :param jobs: the number of documents processed in parallel
+    :param output: the stream the progress and errors are written to
+    :return: dict
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(tmp_dir, exist_ok=True)
+    manifest = sqlite3.connect(manifest_path, isolation_level=None)
+    manifest.executescript(manifest_schema)
+    done = {path: (size, mtime_ns) for path, size, mtime_ns in
+            manifest.execute('SELECT path, size, mtime_ns FROM files')}
+
+    documents = scan_documents(data_dir, engine.extensions)
+    pending = [(path, stat) for path, stat in documents
+               if done.get(os.path.relpath(path, data_dir)) != (stat.st_size, stat.st_mtime_ns)]
+    report = {'scanned': len(documents), 'skipped': len(documents) - len(pending), 'processed': 0,
+              'failed': 0}
+
+    # the engines run in subprocesses, so threads are enough to use all CPUs
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(ocr_document, engine, path, output_dir, tmp_dir): (path, stat)
+                   for path, stat in pending}
+        for index, future in enumerate(as_completed(futures), 1):
+            path, stat = futures[future]
+            relative_path = os.path.relpath(path, data_dir)
+            try:
+                md5, processed = future.result()
+            except (OSError, subprocess.CalledProcessError) as e:
+                report['failed'] += 1
+                output.write('[%d/%d] FAILED %s: %s\n' % (index, len(pending), relative_path, e))
+                continue
+            report['processed'] += processed
+            manifest.execute('INSERT OR REPLACE INTO files (path, size, mtime_ns, md5) VALUES (?, ?, ?, ?)',
+                             (relative_path, stat.st_size, stat.st_mtime_ns, md5))
+            output.write('[%d/%d] %s -> %s.pdf\n' % (index, len(pending), relative_path, md5))
+            output.flush()
+    manifest.close()
+    return report
+
+
+def get_manifest_path(collection, source):
+    '''Return the manifest path of a collection and OCR source. It is kept in the
+    collection settings, since OCR sources are registered per collection.
+
+    :param collection: the collection name
+    :param source: the OCR source name
+    :return: str
+    '''
+    return os.path.join(get_settings_dir(collection), manifest_file_name % source)
+
+
+def is_registered(manifest_path):
+    with sqlite3.connect(manifest_path) as manifest:
+        return manifest.execute("SELECT value FROM meta WHERE key = 'registered'").fetchone() is not None
+
+
+def set_registered(manifest_path):
+    with sqlite3.connect(manifest_path) as manifest:
+        manifest.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('registered', '1')")
+
+
+@exit_on_exception
+def register_source(collection, source):
+    print('Registering OCR source "%s" with collection "%s"...' % (source, collection))
+    stream('%s run --rm snoop--%s ./manage.py createocrsource %s %s/%s' %
+           (compose_command, collection, source, snoop_ocr_dir, source), prefix=collection)
+
+
+def ocr(args):
+    collections = get_collections_data()['collections']
+    if args.collection not in collections:
+        exit_msg('Invalid collection: %s', args.collection)
+    validate_collections([args.collection])
+    source = args.source or args.collection
+    try:
+        # OCR sources follow the collection naming rules
+        validate_collection_name(source)
+    except InvalidCollectionName as e:
+        exit_msg('Invalid OCR source: %s', e)
+
+    manifest_path = get_manifest_path(args.collection, source)
+    try:
+        report = ocr_collection(get_collection_data_dir(args.collection), str(ocr_path / source),
+                                get_engine(args.engine, args.language), manifest_path,
+                                str(ocr_path / tmp_dir_name), args.jobs)
+    except OSError as e:
+        exit_msg('Failed to OCR the collection: %s', e)
+    print('Scanned %d documents, skipped %d done before, OCR\'ed %d, %d failed.' %
+          (report['scanned'], report['skipped'], report['processed'], report['failed']))
+
+    if not args.skip_register and not is_registered(manifest_path):
+        register_source(args.collection, source)
+        set_registered(manifest_path)
+    if report['failed']:
+        exit(1)
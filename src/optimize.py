@@ -0,0 +1,55 @@
+import argparse
+import time
+from urllib.error import URLError
+
+from src.common import get_collections_data, validate_collections, exit_msg, root_dir, get_collection_index
+from src import es
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Optimize the indexes of collections which finished ' +
+                                                 'indexing: merge their segments, block writes and ' +
+                                                 'warm up the fields used by the search filters.')
+    parser.add_argument('collections', nargs='+', help='The collections to optimize.')
+    parser.add_argument('--max-segments', type=int, default=1,
+                        help='Number of segments per shard to merge to.')
+    parser.add_argument('--no-read-only', action='store_const', const=True, default=False,
+                        help='Do not block writes to the optimized indexes.')
+    parser.add_argument('--allow-writes', action='store_const', const=True, default=False,
+                        help='Only allow writes to indexes optimized before, e.g. to index new data.')
+    return parser.parse_args()
+
+
+def optimize_collection(es_url, collection, max_segments=1, read_only=True):
+    '''Optimize the index of a collection and print the time it took.
+
+    :param es_url: the Elasticsearch URL
+    :param collection: the collection name
+    :param max_segments: the number of segments per shard to merge to
+    :param read_only: true to block writes to the index
+    '''
+    index = get_collection_index(collection)
+    print('Optimizing index "%s"...' % index)
+    start = time.time()
+    fields = es.optimize(es_url, index, max_segments, read_only)
+    print('Optimized index "%s" in %ds, warmed up fields: %s' %
+          (index, time.time() - start, ', '.join(fields) or 'none'))
+
+
+def optimize(args):
+    collections = get_collections_data()['collections']
+    validate_collections(args.collections)
+    missing = [collection for collection in args.collections if collection not in collections]
+    if missing:
+        exit_msg('Invalid collections: %s', ', '.join(missing))
+
+    try:
+        es_url = es.get_es_url(root_dir)
+        for collection in args.collections:
+            if args.allow_writes:
+                es.set_read_only(es_url, get_collection_index(collection), False)
+                print('Allowed writes to index "%s"' % get_collection_index(collection))
+            else:
+                optimize_collection(es_url, collection, args.max_segments, not args.no_read_only)
+    except (RuntimeError, URLError) as e:
+        exit_msg('Failed to optimize the collection index: %s', e)
@@ -0,0 +1,84 @@
+import shlex
+import subprocess
+from subprocess import CalledProcessError
+import time
+
+from src.common import compose_command
+from src.process import stream
+
+pg_user = 'snoop'
+default_wait_timeout = 60
+
+
+def get_exec_command(service, command):
+    '''Return the docker-compose command running the given command in the running
+    container of a postgres service.
+
+    :param service: the postgres service name
+    :param command: the command to run
+    :return: str
+    '''
+    return '%s exec -T %s %s' % (compose_command, service, command)
+
+
+def wait_ready(service, timeout=default_wait_timeout):
+    '''Wait until the postgres service accepts connections.
+
+    :param service: the postgres service name
+    :param timeout: seconds to wait before raising TimeoutError
+    '''
+    deadline = time.monotonic() + timeout
+    command = shlex.split(get_exec_command(service, 'pg_isready -q -U %s' % pg_user))
+    while subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode != 0:
+        if time.monotonic() > deadline:
+            raise TimeoutError('The %s service did not start in %d seconds.' % (service, timeout))
+        time.sleep(1)
+
+
+def create_database(service, database):
+    '''Create an empty database owned by the snoop user.'''
+    stream(get_exec_command(service, 'createdb -U %s %s' % (pg_user, database)), prefix=service)
+
+
+def terminate_connections(service, database):
+    '''Close the connections to a database, e.g. the idle server connections kept by
+    pgbouncer after the collection services stopped.'''
+    sql = "SELECT count(pg_terminate_backend(pid)) FROM pg_stat_activity " \
+          "WHERE datname = '%s' AND pid <> pg_backend_pid()" % database
+    stream(get_exec_command(service, 'psql -U %s -q -At -c "%s" postgres' % (pg_user, sql)), prefix=service)
+
+
+def drop_database(service, database):
+    '''Drop a database if it exists, closing its connections first.'''
+    terminate_connections(service, database)
+    stream(get_exec_command(service, 'dropdb -U %s --if-exists %s' % (pg_user, database)), prefix=service)
+
+
+def rename_database(service, database, new_database):
+    '''Rename a database, closing its connections first. The clients must be
+    stopped, otherwise they reconnect.'''
+    terminate_connections(service, database)
+    sql = 'ALTER DATABASE %s RENAME TO %s' % (database, new_database)
+    stream(get_exec_command(service, "psql -U %s -q -c '%s' postgres" % (pg_user, sql)), prefix=service)
+
+
+def copy_database(source, target):
+    '''Copy a database to another postgres service, piping pg_dump into psql. The
+    target database must exist and be empty.
+
+    :param source: (service, database) to copy from
+    :param target: (service, database) to copy to
+    '''
+    dump_command = get_exec_command(source[0], 'pg_dump -U %s --no-owner %s' % (pg_user, source[1]))
+    restore_command = get_exec_command(target[0], 'psql -U %s -q -v ON_ERROR_STOP=1 %s' %
+                                       (pg_user, target[1]))
+    dump = subprocess.Popen(shlex.split(dump_command), stdout=subprocess.PIPE)
+    try:
+        restore = subprocess.run(shlex.split(restore_command), stdin=dump.stdout, stdout=subprocess.DEVNULL)
+    finally:
+        dump.stdout.close()
+        dump.wait()
+    if dump.returncode != 0:
+        raise CalledProcessError(dump.returncode, dump_command, output=b'')
+    if restore.returncode != 0:
+        raise CalledProcessError(restore.returncode, restore_command, output=b'')
@@ -0,0 +1,121 @@
+import heapq
+import socket
+
+
+def port_in_use(port, host='0.0.0.0'):
+    '''Return true if the given port is already bound on the host.
+
+    :param port: the port number
+    :param host: the address to check
+    :return: bool
+    '''
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind((host, port))
+        except OSError:
+            return True
+    return False
+
+
+class PortAllocator:
+    '''Hands out ports from a range starting at the given port. Released ports are
+    kept in a heap and reused before the range grows, so allocating and releasing
+    a port take O(log n).
+    '''
+
+    def __init__(self, start, next_port=None, free=()):
+        self.start = start
+        self.next_port = max(next_port or start, start)
+        self.used = set()
+        self.free = set()
+        self._heap = []
+        for port in free:
+            self._push_free(port)
+
+    def _push_free(self, port):
+        if self.start <= port < self.next_port and port not in self.used and port not in self.free:
+            self.free.add(port)
+            heapq.heappush(self._heap, port)
+
+    def _pop_free(self):
+        while self._heap:
+            port = heapq.heappop(self._heap)
+            if port in self.free:
+                self.free.remove(port)
+                return port
+        return None
+
+    def peek(self):
+        '''Return the port that would be allocated next, without checking the host.
+
+        :return: int
+        '''
+        while self._heap and self._heap[0] not in self.free:
+            heapq.heappop(self._heap)
+        return self._heap[0] if self._heap else self.next_port
+
+    def reserve(self, port):
+        '''Mark the given port as used. Ports skipped when the range grows past it
+        become free.
+
+        :param port: the port number
+        '''
+        if port >= self.next_port:
+            skipped = range(self.next_port, port)
+            self.next_port = port + 1
+            for skipped_port in skipped:
+                self._push_free(skipped_port)
+        self.free.discard(port)
+        self.used.add(port)
+
+    def allocate(self, check_host=True):
+        '''Return the lowest free port, growing the range if no released port is
+        available. If check_host is true ports already bound on the host are skipped
+        and kept free for later.
+
+        :param check_host: skip ports bound on the host
+        :return: int
+        '''
+        skipped = []
+        while True:
+            port = self._pop_free()
+            if port is None:
+                port = self.next_port
+                self.next_port += 1
+            if not check_host or not port_in_use(port):
+                break
+            skipped.append(port)
+        self.used.add(port)
+        for skipped_port in skipped:
+            self._push_free(skipped_port)
+        return port
+
+    def release(self, port):
+        '''Return the given port to the free list.
+
+        :param port: the port number
+        '''
+        if port in self.used:
+            self.used.remove(port)
+            self._push_free(port)
+
+    def to_dict(self):
+        return {'next': self.next_port, 'free': sorted(self.free)}
+
+    @classmethod
+    def from_dict(cls, start, data, used=()):
+        '''Create an allocator from saved state. The given used ports are reserved
+        and ports below the range end which are neither used nor free are reclaimed.
+
+        :param start: the first port of the range
+        :param data: dictionary saved using to_dict
+        :param used: ports currently assigned
+        :return: PortAllocator
+        '''
+        allocator = cls(start, next_port=data.get('next'))
+        for port in used:
+            allocator.reserve(port)
+        for port in range(allocator.start, allocator.next_port):
+            allocator._push_free(port)
+        return allocator
@@ -1,5 +1,23 @@
+import asyncio
+from collections import OrderedDict, deque
+import os
+import signal
 import subprocess
-from subprocess import CalledProcessError
+from subprocess import CalledProcessError, TimeoutExpired
+import sys
+import time
+
+from src.dockerapi import get_client, get_compose_project_name
+from src.common import root_dir, docker_file_name, orig_docker_file_name, get_changed_services, \
+    read_docker_services, get_collection_services_levels, snoop_stats_services, tika_service, \
+    tika_replica_prefix, tika_cache_service, shared_pg_service, pgbouncer_service, compose_command, \
+    exit_msg, mark_services_applied
+
+default_concurrency = 4
+default_wait_timeout = 60
+stream_limit = 2 ** 20
+# lines of output kept for the return value and the errors, the rest is only printed
+output_tail_lines = 100
 
 
 def run(cmd, **kwargs):
@@ -10,23 +28,155 @@ def run(cmd, **kwargs):
     return subprocess.check_output(cmd, **kwargs).decode('latin1')
 
 
+async def _print_lines(reader, output_file, prefix, captured):
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        captured.append(line)
+        text = line.decode('latin1').rstrip('\n')
+        print('[%s] %s' % (prefix, text) if prefix else text, file=output_file, flush=True)
+
+
+async def stream_async(cmd, prefix=None, timeout=None):
+    """Run the given shell command printing its stdout and stderr line by line as
+    they are produced, each line preceded by the given prefix. The process and its
+    children are killed when the timeout expires or the task is cancelled. Returns
+    the last output_tail_lines lines of the output, which are also the output of
+    the raised errors.
+
+    Raises CalledProcessError if the command fails and TimeoutExpired on timeout."""
+
+    process = await asyncio.create_subprocess_shell(cmd, stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.PIPE,
+                                                    limit=stream_limit, start_new_session=True)
+    captured = deque(maxlen=output_tail_lines)
+    readers = asyncio.gather(_print_lines(process.stdout, sys.stdout, prefix, captured),
+                             _print_lines(process.stderr, sys.stderr, prefix, captured),
+                             process.wait())
+    try:
+        await asyncio.wait_for(readers, timeout)
+    except asyncio.TimeoutError:
+        _kill(process)
+        await process.wait()
+        raise TimeoutExpired(cmd, timeout, output=b''.join(captured))
+    except asyncio.CancelledError:
+        _kill(process)
+        await process.wait()
+        raise
+
+    output = b''.join(captured)
+    if process.returncode != 0:
+        raise CalledProcessError(process.returncode, cmd, output=output)
+    return output.decode('latin1')
+
+
+def _kill(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def stream(cmd, prefix=None, timeout=None):
+    """Run the given shell command streaming its output. See stream_async."""
+
+    return asyncio.run(stream_async(cmd, prefix, timeout))
+
+
+async def run_many_async(commands, concurrency=default_concurrency, timeout=None, on_done=None):
+    """Run the given commands streaming their output, with at most `concurrency`
+    running at the same time. See run_many."""
+
+    semaphore = asyncio.Semaphore(concurrency)
+    results = OrderedDict()
+
+    async def run_commands(prefix, cmds):
+        async with semaphore:
+            try:
+                for cmd in ([cmds] if isinstance(cmds, str) else cmds):
+                    await stream_async(cmd, prefix, timeout)
+                results[prefix] = None
+            except (CalledProcessError, TimeoutExpired) as e:
+                results[prefix] = e
+        if on_done:
+            on_done(prefix, results[prefix])
+
+    await asyncio.gather(*[run_commands(prefix, cmds) for prefix, cmds in commands.items()])
+    return OrderedDict((prefix, results[prefix]) for prefix in commands)
+
+
+def run_many(commands, concurrency=default_concurrency, timeout=None, on_done=None):
+    """Run the commands concurrently, streaming the output of each one with its key as
+    prefix. Each value is a shell command or a list of shell commands run in sequence,
+    stopping at the first failure.
+
+    :param commands: dictionary of prefix to a command or a list of commands
+    :param concurrency: the maximum number of commands running at the same time
+    :param timeout: timeout in seconds for each command
+    :param on_done: function called with the prefix and the error (or None) when the
+    commands for a prefix finished
+    :return: OrderedDict of prefix to None or the CalledProcessError/TimeoutExpired
+    """
+
+    return asyncio.run(run_many_async(commands, concurrency, timeout, on_done))
+
+
+def get_service_containers(service):
+    '''Return the running containers of the given docker-compose service, using the
+    Docker Engine API.
+
+    :param service: the service name
+    :return: list of dicts
+    '''
+    return get_client().service_containers(get_compose_project_name(root_dir), service)
+
+
+def wait_service(service, timeout=default_wait_timeout):
+    '''Run the /wait script inside the running container of the given service. A
+    service without a running container, e.g. restarting after docker-compose up,
+    is checked again every second until the timeout expires.
+
+    :param service: the service name
+    :param timeout: seconds to wait for a running container before raising RuntimeError
+    '''
+    deadline = time.monotonic() + timeout
+    containers = get_service_containers(service)
+    while not containers:
+        if time.monotonic() > deadline:
+            raise RuntimeError('The %s service has no running container after %d seconds.' %
+                               (service, timeout))
+        time.sleep(1)
+        get_client().clear_cache()
+        containers = get_service_containers(service)
+    container = containers[0]['Id']
+    exit_code, output, _ = get_client().exec(container, ['/wait'])
+    if exit_code != 0:
+        raise CalledProcessError(exit_code, 'docker exec %s /wait' % service, output=output)
+
+
 def ensure_docker_setup_stopped():
-    output = run('docker ps --filter "name=docker-setup_search"')
-    if 'docker-setup_search' in output:
+    if get_service_containers('search'):
         print('Stopping docker-compose...')
-        print(run('docker-compose down'))
+        stream(compose_command + ' down')
+        get_client().clear_cache()
 
 
 def ensure_docker_running(*args, collection=None):
-    output = run('docker ps --filter "name=docker-setup_search"')
-    if 'docker-setup_search' not in output:
+    if not get_service_containers('search'):
         print('Starting docker-compose...')
-        print(run('docker-compose up -d' + ' '.join(args)))
-        print('Waiting for search service...')
-        print(run('docker-compose run --rm search /wait'))
-        if collection:
-            print(f'Waiting for collection "{collection}" service')
-            print(run(f'docker-compose run --rm snoop--{collection} /wait'))
+        stream(' '.join((compose_command + ' up -d',) + args))
+        if not args:
+            mark_services_applied()
+        get_client().clear_cache()
+        try:
+            print('Waiting for search service...')
+            wait_service('search')
+            if collection:
+                print(f'Waiting for collection "{collection}" service')
+                wait_service(f'snoop--{collection}')
+        except RuntimeError as e:
+            exit_msg('%s', e)
 
 
 def exit_on_exception(f):
@@ -34,7 +184,73 @@ def exit_on_exception(f):
         try:
             return f(*args, **kwargs)
         except CalledProcessError as e:
-            print(e.output.decode('latin1'))
+            # the output was already printed while the command ran
+            print('Command "%s" failed with exit code %d' % (e.cmd, e.returncode))
             exit(e.returncode)
+        except TimeoutExpired as e:
+            print('Command "%s" timed out after %s seconds' % (e.cmd, e.timeout))
+            exit(1)
 
     return decorator
+
+
+@exit_on_exception
+def apply_changed_services(services=()):
+    '''Diff the orig override docker file, holding the services last applied, against
+    the current one and recreate only the changed collection, shared postgres,
+    pgbouncer, snoop stats and Tika services, in dependency order. Containers of
+    removed services are stopped and removed. Other services are left running. The
+    current override file becomes the orig one once all services were recreated.
+
+    :param services: services to recreate even if their docker settings did not
+    change, e.g. because their settings files changed
+    '''
+    changed_services = get_changed_services(root_dir / orig_docker_file_name, root_dir / docker_file_name)
+    current_services = read_docker_services(root_dir / docker_file_name)
+    changed_services = sorted(set(changed_services) | {s for s in services if s in current_services})
+    levels = get_collection_services_levels([s for s in changed_services if s in current_services])
+    removed = get_collection_services_levels([s for s in changed_services if s not in current_services])
+    stats = [s for s in snoop_stats_services if s in changed_services and s in current_services]
+    removed_stats = [s for s in snoop_stats_services if s in changed_services and s not in current_services]
+    tika_replicas = sorted(s for s in changed_services
+                           if s.startswith(tika_replica_prefix) and s[len(tika_replica_prefix):].isdigit())
+    tika = [[s for s in tika_replicas if s in current_services],
+            [s for s in [tika_service] if s in changed_services],
+            [s for s in [tika_cache_service] if s in changed_services and s in current_services]]
+    removed_tika = [s for s in tika_replicas + [tika_cache_service]
+                    if s in changed_services and s not in current_services]
+    shared_pg = [s for s in [shared_pg_service] if s in changed_services]
+    levels = [level for level in tika if level] + levels
+    if pgbouncer_service in changed_services:
+        if pgbouncer_service in current_services:
+            levels.insert(0, [pgbouncer_service])
+        else:
+            removed.append([pgbouncer_service])
+        # the search database settings change only when pgbouncer is enabled or disabled
+        if pgbouncer_service not in read_docker_services(root_dir / orig_docker_file_name) or \
+                pgbouncer_service not in current_services:
+            levels.append(['search'])
+    if shared_pg and shared_pg_service in current_services:
+        levels.insert(0, shared_pg)
+    elif shared_pg:
+        removed.append(shared_pg)
+    if stats:
+        levels.insert(0, stats)
+    if removed_stats:
+        removed.append(removed_stats)
+    if removed_tika:
+        removed.append(removed_tika)
+
+    if not levels and not removed:
+        print('No collection services to restart.')
+        mark_services_applied()
+        return
+
+    if removed:
+        print('Removing services: %s' % ', '.join(sum(removed, [])))
+        stream(compose_command + ' up -d --no-deps --no-recreate --remove-orphans search')
+
+    for level in levels:
+        print('Recreating services: %s' % ', '.join(level))
+        stream(compose_command + ' up -d --no-deps ' + ' '.join(level))
+    mark_services_applied()
@@ -0,0 +1,229 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import fcntl
+import json
+import os
+import sqlite3
+
+registry_file_name = 'collections.db'
+lock_file_name = 'collections.lock'
+schema_version = 1
+indexed_ports = ['snoop_port', 'flower_port', 'pg_port']
+
+schema = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS collections (
+    name TEXT PRIMARY KEY,
+    settings TEXT NOT NULL,
+    snoop_port INTEGER,
+    flower_port INTEGER,
+    pg_port INTEGER
+);
+CREATE UNIQUE INDEX IF NOT EXISTS collections_lower_name ON collections (lower(name));
+CREATE INDEX IF NOT EXISTS collections_snoop_port ON collections (snoop_port);
+CREATE INDEX IF NOT EXISTS collections_flower_port ON collections (flower_port);
+CREATE INDEX IF NOT EXISTS collections_pg_port ON collections (pg_port);
+CREATE TABLE IF NOT EXISTS ports (
+    port_setting TEXT PRIMARY KEY,
+    state TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+
+_connections = {}
+
+
+def connect(settings_dir):
+    '''Return the connection to the collections registry stored in the given
+    settings directory. Connections are opened once per process.
+
+    :param settings_dir: the settings directory
+    :return: sqlite3.Connection
+    '''
+    registry_path = os.path.abspath(os.path.join(settings_dir, registry_file_name))
+    if registry_path not in _connections:
+        connection = sqlite3.connect(registry_path, isolation_level=None, timeout=60)
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.executescript(schema)
+        _connections[registry_path] = connection
+    return _connections[registry_path]
+
+
+def close_all():
+    '''Close all open registry connections.'''
+    for connection in _connections.values():
+        connection.close()
+    _connections.clear()
+
+
+@contextmanager
+def transaction(connection):
+    '''Run the enclosed statements in a write transaction. The transaction is rolled
+    back if an exception is raised.
+
+    :param connection: the registry connection
+    '''
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        yield connection
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    connection.execute('COMMIT')
+
+
+@contextmanager
+def lock(settings_dir):
+    '''Hold an exclusive lock on the registry of the given settings directory. Used
+    to serialize concurrent commands which read and then update the registry.
+
+    :param settings_dir: the settings directory
+    '''
+    with open(os.path.join(settings_dir, lock_file_name), 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print('Waiting for another command to release the collections registry...')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def is_initialized(connection):
+    '''Return true if the registry was initialized, either empty or from migrated
+    settings.
+
+    :param connection: the registry connection
+    :return: bool
+    '''
+    row = connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    return row is not None
+
+
+def initialize(connection, collections, ports=None):
+    '''Initialize the registry with the given collections and port allocators state.
+
+    :param connection: the registry connection
+    :param collections: the dictionary containing the collections settings
+    :param ports: dictionary of port setting name to saved allocator state
+    '''
+    with transaction(connection):
+        _write_collections(connection, collections)
+        _write_ports(connection, ports or {})
+        connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)",
+                           (str(schema_version),))
+
+
+def read_collections(connection):
+    '''Return the collections settings ordered by name.
+
+    :param connection: the registry connection
+    :return: OrderedDict
+    '''
+    return OrderedDict((name, json.loads(settings, object_pairs_hook=OrderedDict))
+                       for name, settings in
+                       connection.execute('SELECT name, settings FROM collections ORDER BY name'))
+
+
+def read_ports(connection):
+    '''Return the saved port allocators state.
+
+    :param connection: the registry connection
+    :return: dict
+    '''
+    return {port_setting: json.loads(state) for port_setting, state in
+            connection.execute('SELECT port_setting, state FROM ports')}
+
+
+def read_settings(connection):
+    '''Return the global settings, shared by all collections.
+
+    :param connection: the registry connection
+    :return: dict
+    '''
+    return {key: json.loads(value) for key, value in connection.execute('SELECT key, value FROM settings')}
+
+
+def write_settings(connection, settings):
+    '''Save the given global settings. Settings set to None are removed.
+
+    :param connection: the registry connection
+    :param settings: dictionary of setting name to value
+    '''
+    with transaction(connection):
+        for key, value in settings.items():
+            if value is None:
+                connection.execute('DELETE FROM settings WHERE key = ?', (key,))
+            else:
+                connection.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
+                                   (key, json.dumps(value)))
+
+
+def get_collection(connection, name):
+    '''Return the settings of the collection with the given name, ignoring case, or
+    None if the collection does not exist.
+
+    :param connection: the registry connection
+    :param name: the collection name
+    :return: dict
+    '''
+    row = connection.execute('SELECT settings FROM collections WHERE lower(name) = lower(?)',
+                             (name,)).fetchone()
+    return json.loads(row[0], object_pairs_hook=OrderedDict) if row else None
+
+
+def find_collection_by_port(connection, port):
+    '''Return the name and the port setting of the collection using the given port,
+    or None if no collection uses it.
+
+    :param connection: the registry connection
+    :param port: the port number
+    :return: (str, str)
+    '''
+    for port_setting in indexed_ports:
+        row = connection.execute('SELECT name FROM collections WHERE %s = ?' % port_setting,
+                                 (port,)).fetchone()
+        if row:
+            return row[0], port_setting
+    return None
+
+
+def _write_collections(connection, collections):
+    names = set(collections)
+    for (name,) in connection.execute('SELECT name FROM collections').fetchall():
+        if name not in names:
+            connection.execute('DELETE FROM collections WHERE name = ?', (name,))
+    for name, settings in collections.items():
+        connection.execute(
+            'INSERT OR REPLACE INTO collections (name, settings, snoop_port, flower_port, pg_port) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (name, json.dumps(settings), settings.get('snoop_port'), settings.get('flower_port'),
+             settings.get('pg_port')))
+
+
+def _write_ports(connection, ports):
+    for port_setting, state in ports.items():
+        connection.execute('INSERT OR REPLACE INTO ports (port_setting, state) VALUES (?, ?)',
+                           (port_setting, json.dumps(state)))
+
+
+def write(connection, collections, ports=None):
+    '''Replace the registry content with the given collections and port allocators
+    state in a single transaction.
+
+    :param connection: the registry connection
+    :param collections: the dictionary containing the collections settings
+    :param ports: dictionary of port setting name to saved allocator state
+    '''
+    with transaction(connection):
+        _write_collections(connection, collections)
+        if ports is not None:
+            _write_ports(connection, ports)
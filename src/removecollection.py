@@ -1,13 +1,16 @@
 import argparse
 import os
-from shutil import rmtree
-from subprocess import run
-import sys
+from subprocess import CalledProcessError
 
 from src.common import get_collections_data, validate_collections, cleanup, \
     write_global_docker_file, collection_allowed_chars, validate_collection_name, \
     volumes_dir_name, blobs_dir_name, InvalidCollectionName, exit_msg,\
-    write_collections_settings
+    write_collections_settings, release_collection_ports, registry_locked, start_trash_reaper, \
+    settings_dir_name, trash_log_file_name, get_collection_database, get_worker_services, compose_command, \
+    refresh_collections_docker_files
+from src import pg
+from src.process import apply_changed_services, stream
+from src.trash import move_to_trash, default_rate_limit
 
 
 def get_args():
@@ -20,22 +23,37 @@ def get_args():
                         help='Remove blobs')
     parser.add_argument('-y', '--yes', action='store_const', const=True, default=False,
                         help='Force yes answer to all interactive user inputs.')
+    parser.add_argument('--apply', action='store_const', const=True, default=False,
+                        help='Recreate only the changed collection services instead of ' +
+                             'restarting docker-compose.')
+    parser.add_argument('--rate-limit', type=int, default=default_rate_limit,
+                        help='Maximum number of files deleted per second by the background ' +
+                             'reaper; 0 for no limit.')
     args = parser.parse_args()
 
     return args
 
 
 def remove_pg_dir(collection):
-    pg_dir = os.path.join(volumes_dir_name, 'snoop-pg--%s' % collection)
-    if os.path.isdir(pg_dir):
-        rmtree(pg_dir)
+    move_to_trash(os.path.join(volumes_dir_name, 'snoop-pg--%s' % collection))
+
+
+def remove_database(collection_name, settings):
+    services = ['snoop--' + collection_name] + get_worker_services(collection_name, settings)
+    try:
+        # the database can be dropped only after the collection services disconnect
+        stream(compose_command + ' stop ' + ' '.join(services), prefix=collection_name)
+        pg.drop_database(*get_collection_database(collection_name, settings))
+    except CalledProcessError:
+        print('Error removing %s database' % collection_name)
+        exit(1)
 
 
 def remove_index(collection_name):
-    docker_args = ['docker-compose', 'run', '--rm', 'snoop--%s' % collection_name, './manage.py',
-                   'deleteindex']
-    process = run(docker_args, stdout=sys.stdout, stderr=sys.stderr)
-    if process.returncode != 0:
+    try:
+        stream('%s run --rm snoop--%s ./manage.py deleteindex' % (compose_command, collection_name),
+               prefix=collection_name)
+    except CalledProcessError:
         print('Error removing %s index' % collection_name)
         print('Use --skip-index if you only want to remove collection settings')
         exit(1)
@@ -53,9 +71,10 @@ def remove_blobs(collection_name, force_yes=False):
                 break
             if option.lower() == 'no':
                 return
-        rmtree(blobs_dir)
+        move_to_trash(blobs_dir)
 
 
+@registry_locked
 def remove_collection(args):
     data = get_collections_data()
     try:
@@ -73,14 +92,24 @@ def remove_collection(args):
 
     if not args.skip_index:
         remove_index(args.collection)
+    if data['collections'][args.collection].get('shared_pg'):
+        remove_database(args.collection, data['collections'][args.collection])
+    release_collection_ports(data['ports'], data['collections'][args.collection])
     del data['collections'][args.collection]
-    write_global_docker_file(data['collections'], bool(data['dev_instances']))
-    write_collections_settings(data['collections'])
+    refresh_collections_docker_files(data['collections'], data['global_settings'])
+    write_global_docker_file(data['collections'], bool(data['dev_instances']), data['global_settings'])
+    write_collections_settings(data)
+    if args.apply:
+        apply_changed_services()
 
     cleanup(args.collection)
     remove_pg_dir(args.collection)
     if args.remove_blobs:
         remove_blobs(args.collection, args.yes)
+    start_trash_reaper(args.rate_limit)
+    print('The collection data is deleted in the background, see %s.' %
+          os.path.join(settings_dir_name, trash_log_file_name))
 
-    print('Restart docker-compose:')
-    print('  $ docker-compose down --remove-orphans && docker-compose up -d')
+    if not args.apply:
+        print('Restart docker-compose:')
+        print('  $ %s down --remove-orphans && %s up -d' % (compose_command, compose_command))
@@ -0,0 +1,216 @@
+from collections import OrderedDict
+import os
+import re
+
+cpuset_pattern = re.compile(r'^\d+(-\d+)?(,\d+(-\d+)?)*$')
+memory_pattern = re.compile(r'^\d+[bkmg]?$')
+memory_units = {'b': 1, 'k': 2 ** 10, 'm': 2 ** 20, 'g': 2 ** 30}
+cpus_per_tika_replica = 4
+tika_memory_fraction = 0.25
+min_tika_heap = 2 ** 30
+max_tika_heap = 8 * 2 ** 30
+default_memory_bytes = 8 * 2 ** 30
+pg_profiles = ['ingest', 'serve', 'archived']
+pg_profile_weights = {'ingest': 4, 'serve': 2, 'archived': 1}
+pg_profile_settings = {
+    'ingest': OrderedDict((
+        ('synchronous_commit', 'off'),
+        ('wal_buffers', '16MB'),
+        ('checkpoint_timeout', '15min'),
+        ('min_wal_size', '1GB'),
+        ('max_wal_size', '4GB'),
+    )),
+    'serve': OrderedDict((
+        ('checkpoint_timeout', '10min'),
+        ('min_wal_size', '256MB'),
+        ('max_wal_size', '1GB'),
+    )),
+    'archived': OrderedDict((
+        ('checkpoint_timeout', '30min'),
+        ('min_wal_size', '80MB'),
+        ('max_wal_size', '256MB'),
+    )),
+}
+pg_memory_fraction = 0.25
+min_pg_memory = 128 * 2 ** 20
+pg_max_connections = 100
+reserved_pg_connections = 10
+
+
+def get_cpu_count():
+    '''Return the number of CPUs the current process may run on.
+
+    :return: int
+    '''
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def get_memory_bytes(meminfo_path='/proc/meminfo'):
+    '''Return the total memory of the host in bytes, or None if unknown.
+
+    :param meminfo_path: the meminfo file path
+    :return: int
+    '''
+    try:
+        with open(meminfo_path) as meminfo:
+            for line in meminfo:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if hasattr(os, 'sysconf') and 'SC_PHYS_PAGES' in os.sysconf_names:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    return None
+
+
+def parse_cpuset(cpuset):
+    '''Return the sorted list of CPUs in a cpuset string like "0-3,6".
+
+    :param cpuset: the cpuset string
+    :return: list
+    '''
+    cpus = set()
+    for part in cpuset.split(','):
+        start, _, end = part.partition('-')
+        cpus.update(range(int(start), int(end or start) + 1))
+    return sorted(cpus)
+
+
+def format_cpuset(cpus):
+    '''Return the cpuset string for the given CPUs, merging consecutive CPUs in
+    ranges.
+
+    :param cpus: list of CPU numbers
+    :return: str
+    '''
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(start) if start == end else '%d-%d' % (start, end) for start, end in ranges)
+
+
+def split_cores(backlogs, cores):
+    '''Split the given cores between collections proportionally to their backlog,
+    each collection getting at least one core. If there are more collections than
+    cores the cores are shared round-robin, one per collection. Unknown backlogs
+    count as one pending task.
+
+    :param backlogs: dictionary of collection name to number of pending tasks
+    :param cores: list of CPU numbers
+    :return: dictionary of collection name to list of CPU numbers
+    '''
+    names = sorted(backlogs, key=lambda name: (-(backlogs[name] or 1), name))
+    if not names:
+        return {}
+    if len(names) >= len(cores):
+        return {name: [cores[index % len(cores)]] for index, name in enumerate(names)}
+
+    weights = {name: max(backlogs[name] or 1, 1) for name in names}
+    total = sum(weights.values())
+    extra = len(cores) - len(names)
+    shares = {name: 1 + int(extra * weights[name] / total) for name in names}
+    remainders = sorted(names, key=lambda name: -(extra * weights[name] / total % 1))
+    for name in remainders[:len(cores) - sum(shares.values())]:
+        shares[name] += 1
+
+    allocation, start = {}, 0
+    for name in names:
+        allocation[name] = cores[start:start + shares[name]]
+        start += shares[name]
+    return allocation
+
+
+def parse_memory(memory):
+    '''Return the number of bytes of a memory size like "512m" or "4g".
+
+    :param memory: the memory size
+    :return: int
+    '''
+    memory = memory.lower()
+    if memory[-1] in memory_units:
+        return int(memory[:-1]) * memory_units[memory[-1]]
+    return int(memory)
+
+
+def size_tika(cpu_count, memory_bytes, replicas=None):
+    '''Return the number of Tika replicas and the JVM heap of each replica for the
+    given host. One replica is run for every few CPUs and the replicas share a
+    fraction of the host memory, each getting a heap between the minimum and the
+    maximum heap.
+
+    :param cpu_count: the number of CPUs of the host
+    :param memory_bytes: the host memory in bytes; None if unknown
+    :param replicas: the number of replicas; None to size it from the host CPUs
+    :return: (int, str)
+    '''
+    if memory_bytes is None:
+        memory_bytes = (replicas or 1) * min_tika_heap / tika_memory_fraction
+    tika_memory = int(memory_bytes * tika_memory_fraction)
+    if replicas is None:
+        replicas = max(1, min(cpu_count // cpus_per_tika_replica, tika_memory // min_tika_heap))
+    heap = max(min_tika_heap, min(max_tika_heap, tika_memory // replicas))
+    return replicas, '%dm' % (heap // 2 ** 20)
+
+
+def split_postgres_memory(profiles, memory_bytes):
+    '''Split the memory given to postgres between the instances with a tuning
+    profile, proportionally to the profile weights. Instances without a profile
+    keep the postgres defaults and get no share.
+
+    :param profiles: dictionary of collection name to profile name or None
+    :param memory_bytes: the host memory in bytes; None if unknown
+    :return: dictionary of collection name to memory in bytes
+    '''
+    weights = {name: pg_profile_weights[profile] for name, profile in profiles.items() if profile}
+    if not weights:
+        return {}
+    pg_memory = int((memory_bytes or default_memory_bytes) * pg_memory_fraction)
+    total = sum(weights.values())
+    return {name: max(min_pg_memory, pg_memory * weight // total) for name, weight in weights.items()}
+
+
+def size_postgres(profile, memory_bytes):
+    '''Return the postgres settings of a tuning profile for an instance using the
+    given memory. The shared buffers take a quarter of the memory and the rest is
+    left to the OS page cache. The ingest profile trades durability of the last
+    commits for write throughput and spaces out the checkpoints, the serve profile
+    gives more memory to each query and the archived profile keeps the WAL small.
+
+    :param profile: one of the pg_profiles
+    :param memory_bytes: the memory of the instance in bytes
+    :return: OrderedDict of setting name to value
+    '''
+    megabytes = memory_bytes // 2 ** 20
+    queries = pg_max_connections * (2 if profile == 'serve' else 4)
+    settings = OrderedDict((
+        ('listen_addresses', '*'),
+        ('max_connections', pg_max_connections),
+        ('shared_buffers', '%dMB' % (megabytes // 4)),
+        ('effective_cache_size', '%dMB' % (megabytes * 3 // 4)),
+        ('maintenance_work_mem', '%dMB' % max(64, min(2048, megabytes // 16))),
+        ('work_mem', '%dMB' % max(4, megabytes // queries)),
+        ('checkpoint_completion_target', 0.9),
+    ))
+    settings.update(pg_profile_settings[profile])
+    return settings
+
+
+def size_pools(needs, max_connections=pg_max_connections):
+    '''Return the pool size of each database of a postgres server: the connections
+    it needs, scaled down proportionally when they exceed the server connections
+    left after the reserved ones. Every database keeps at least one connection.
+
+    :param needs: dictionary of database name to number of connections needed
+    :param max_connections: the max_connections of the postgres server
+    :return: dictionary of database name to pool size
+    '''
+    available = max(len(needs), max_connections - reserved_pg_connections)
+    total = sum(needs.values())
+    if total <= available:
+        return dict(needs)
+    return {name: max(1, need * available // total) for name, need in needs.items()}
@@ -0,0 +1,205 @@
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+import sys
+import time
+from urllib.request import urlopen
+
+default_interval = 5
+default_timeout = 3
+throughput_window = 300
+snoop_pending_statuses = ['pending', 'deferred']
+snoop_failed_statuses = ['error', 'broken']
+flower_pending_states = ['PENDING', 'RECEIVED', 'RETRY']
+flower_failed_states = ['FAILURE', 'REVOKED']
+
+
+def fetch_json(url, timeout=default_timeout):
+    with urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def count_snoop_tasks(task_matrix):
+    '''Count the snoop tasks by status from the task matrix of the collection stats,
+    a dictionary of task function to dictionary of status to count.
+
+    :param task_matrix: the snoop task matrix
+    :return: dict
+    '''
+    counts = {'pending': 0, 'succeeded': 0, 'failed': 0}
+    for statuses in task_matrix.values():
+        for status, count in statuses.items():
+            if not isinstance(count, int):
+                continue
+            if status in snoop_pending_statuses:
+                counts['pending'] += count
+            elif status == 'success':
+                counts['succeeded'] += count
+            elif status in snoop_failed_statuses:
+                counts['failed'] += count
+    return counts
+
+
+def count_flower_tasks(tasks):
+    '''Count the celery tasks known to flower by state.
+
+    :param tasks: dictionary of task id to task info returned by the flower API
+    :return: dict
+    '''
+    counts = {'pending': 0, 'active': 0, 'succeeded': 0, 'failed': 0}
+    for task in tasks.values():
+        state = task.get('state')
+        if state == 'STARTED':
+            counts['active'] += 1
+        elif state in flower_pending_states:
+            counts['pending'] += 1
+        elif state == 'SUCCESS':
+            counts['succeeded'] += 1
+        elif state in flower_failed_states:
+            counts['failed'] += 1
+    return counts
+
+
+def poll_collection(snoop_url, flower_url=None, timeout=default_timeout):
+    '''Return the task counts of a collection. The pending, succeeded and failed
+    counts come from the snoop collection stats and the active tasks from flower.
+    If snoop does not report its task matrix the flower counts are used.
+
+    :param snoop_url: the snoop base URL
+    :param flower_url: the flower base URL; None if the collection is not indexed
+    :param timeout: the requests timeout in seconds
+    :return: dict with pending, active, succeeded, failed and error
+    '''
+    status = {'pending': None, 'active': None, 'succeeded': None, 'failed': None, 'error': None}
+    errors = []
+    try:
+        task_matrix = (fetch_json(snoop_url + '/collection/json', timeout).get('stats') or {}) \
+            .get('task_matrix')
+        if task_matrix:
+            status.update(count_snoop_tasks(task_matrix))
+    except (OSError, ValueError) as e:
+        errors.append('snoop: %s' % e)
+    if flower_url:
+        try:
+            counts = count_flower_tasks(fetch_json(flower_url + '/api/tasks', timeout))
+            status['active'] = counts['active']
+            for key in ['pending', 'succeeded', 'failed']:
+                if status[key] is None:
+                    status[key] = counts[key]
+        except (OSError, ValueError) as e:
+            errors.append('flower: %s' % e)
+    status['error'] = '; '.join(errors) or None
+    return status
+
+
+class ProgressTracker:
+    '''Keeps the succeeded tasks counts of the last polls to compute the throughput
+    and the ETA of each collection.'''
+
+    def __init__(self, window=throughput_window, clock=time.monotonic):
+        self.window = window
+        self.clock = clock
+        self.history = {}
+
+    def update(self, collection, status):
+        '''Record the status of a collection and return its throughput in tasks per
+        minute and its ETA in seconds, or None when unknown.
+
+        :param collection: the collection name
+        :param status: the collection status returned by poll_collection
+        :return: (float, float)
+        '''
+        history = self.history.setdefault(collection, deque())
+        now = self.clock()
+        if status['succeeded'] is not None:
+            history.append((now, status['succeeded']))
+        while history and now - history[0][0] > self.window:
+            history.popleft()
+        if len(history) < 2 or history[-1][0] == history[0][0]:
+            return None, None
+        throughput = max(history[-1][1] - history[0][1], 0) * 60 / (history[-1][0] - history[0][0])
+        pending = status['pending']
+        if pending == 0:
+            return throughput, 0
+        return throughput, pending * 60 / throughput if pending and throughput else None
+
+
+def poll_collections(collections, timeout=default_timeout, host='localhost'):
+    '''Poll the snoop and flower endpoints of the given collections concurrently.
+
+    :param collections: dictionary of collection name to settings
+    :param timeout: the requests timeout in seconds
+    :param host: the host publishing the collections ports
+    :return: OrderedDict of collection name to status
+    '''
+    def poll(settings):
+        flower_url = None
+        if settings.get('autoindex') and settings.get('flower_port'):
+            flower_url = 'http://%s:%d' % (host, settings['flower_port'])
+        return poll_collection('http://%s:%d' % (host, settings['snoop_port']), flower_url, timeout)
+
+    with ThreadPoolExecutor(max_workers=max(len(collections), 1)) as executor:
+        return OrderedDict(zip(collections, executor.map(poll, collections.values())))
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return '-'
+    seconds = int(seconds)
+    if seconds >= 86400:
+        return '%dd%02dh' % (seconds // 86400, seconds % 86400 // 3600)
+    return '%d:%02d:%02d' % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def format_table(statuses, tracker):
+    '''Return the lines of the status table.
+
+    :param statuses: OrderedDict of collection name to status
+    :param tracker: the ProgressTracker
+    :return: list of str
+    '''
+    row_format = '%-24s %10s %8s %10s %8s %10s %10s'
+    lines = [row_format % ('collection', 'pending', 'active', 'succeeded', 'failed', 'tasks/min', 'ETA')]
+    for collection, status in statuses.items():
+        throughput, eta = tracker.update(collection, status)
+        lines.append(row_format % (
+            collection[:24],
+            *['-' if status[key] is None else status[key]
+              for key in ['pending', 'active', 'succeeded', 'failed']],
+            '-' if throughput is None else '%.1f' % throughput,
+            format_duration(eta)))
+        if status['error']:
+            lines.append('  ' + status['error'])
+    return lines
+
+
+def watch(collections, interval=default_interval, iterations=None, output=sys.stdout,
+          timeout=default_timeout):
+    '''Poll the collections every interval seconds and print the status table,
+    redrawing it in place when the output is a terminal.
+
+    :param collections: dictionary of collection name to settings
+    :param interval: seconds between polls
+    :param iterations: number of polls; None to poll until interrupted
+    :param output: the output file
+    :param timeout: the requests timeout in seconds
+    '''
+    tracker = ProgressTracker()
+    printed_lines = 0
+    iteration = 0
+    try:
+        while iterations is None or iteration < iterations:
+            lines = format_table(poll_collections(collections, timeout), tracker)
+            lines.append('Updated %s, refreshing every %ds. Press Ctrl+C to exit.' %
+                         (time.strftime('%H:%M:%S'), interval))
+            if printed_lines and output.isatty():
+                # move the cursor to the start of the previous table and clear it
+                output.write('\x1b[%dF\x1b[J' % printed_lines)
+            output.write('\n'.join(lines) + '\n')
+            output.flush()
+            printed_lines = len(lines)
+            iteration += 1
+            if iterations is None or iteration < iterations:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
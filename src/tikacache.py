@@ -0,0 +1,372 @@
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import http.client
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+default_port = 9998
+default_max_size = 10 * 2 ** 30
+default_timeout = 1800
+chunk_size = 2 ** 20
+tmp_prefix = '.tmp-'
+key_headers = ['Content-Type', 'Accept', 'X-Tika-OCRLanguage', 'X-Tika-PDFOcrStrategy',
+               'X-Tika-Skip-Embedded']
+hop_headers = ['connection', 'keep-alive', 'transfer-encoding', 'te', 'trailer', 'upgrade',
+               'proxy-authorization', 'proxy-authenticate']
+memory_units = {'k': 2 ** 10, 'm': 2 ** 20, 'g': 2 ** 30, 't': 2 ** 40}
+
+index_schema = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    content_type TEXT,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+'''
+
+
+def parse_size(size):
+    '''Return the number of bytes of a size like "512m" or "20g".
+
+    :param size: the size
+    :return: int
+    '''
+    match = re.match(r'^(\d+)([kmgt]?)b?$', size.lower())
+    if not match:
+        raise ValueError('Invalid size: %s' % size)
+    return int(match.group(1)) * memory_units.get(match.group(2), 1)
+
+
+def get_cache_key(method, path, headers, content_hash):
+    '''Return the cache key of a request: the content hash combined with the request
+    type, which is given by the method, the path and the headers changing the
+    extraction result.
+
+    :param method: the HTTP method
+    :param path: the request path with the query
+    :param headers: the request headers
+    :param content_hash: the hex SHA-256 of the request body
+    :return: str
+    '''
+    request_type = json.dumps([method, path] + [headers.get(header) or '' for header in key_headers])
+    return hashlib.sha256((request_type + content_hash).encode('utf-8')).hexdigest()
+
+
+class Store:
+    '''Size-bounded on-disk store of the extraction results with least recently used
+    eviction. The results are files named after their key and the index is kept in
+    an SQLite database in the same directory.
+
+    :param cache_dir: the cache directory
+    :param max_size: the maximum total size of the results in bytes
+    '''
+
+    def __init__(self, cache_dir, max_size=default_max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        for name in os.listdir(cache_dir):
+            if name.startswith(tmp_prefix):
+                os.remove(os.path.join(cache_dir, name))
+        self.connection = sqlite3.connect(os.path.join(cache_dir, 'index.db'), isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.executescript(index_schema)
+        self.size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def count(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def get(self, key):
+        '''Return the content type and the opened file of a cached result and mark it
+        as recently used, or None if the result is not cached. The file is opened
+        while holding the lock, and stays readable if the result is evicted
+        before it is closed.
+
+        :param key: the cache key
+        :return: (str, file)
+        '''
+        with self.lock:
+            row = self.connection.execute('SELECT content_type FROM entries WHERE key = ?',
+                                          (key,)).fetchone()
+            if row is None:
+                return None
+            try:
+                result_file = open(self.path(key), 'rb')
+            except FileNotFoundError:
+                self._remove(key)
+                return None
+            self.connection.execute('UPDATE entries SET accessed = ? WHERE key = ?', (time.time(), key))
+            return row[0], result_file
+
+    def put(self, key, content_type, tmp_path):
+        '''Move a result file into the store, evicting the least recently used results
+        to stay within the maximum size. Results larger than the store are left in place.
+
+        :param key: the cache key
+        :param content_type: the result content type
+        :param tmp_path: the path of the result file, in the cache directory
+        '''
+        size = os.path.getsize(tmp_path)
+        if size > self.max_size:
+            return
+        os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+        with self.lock:
+            self._remove(key)
+            os.replace(tmp_path, self.path(key))
+            self.connection.execute('INSERT INTO entries (key, size, content_type, accessed) '
+                                    'VALUES (?, ?, ?, ?)', (key, size, content_type, time.time()))
+            self.size += size
+            while self.size > self.max_size:
+                oldest = self.connection.execute('SELECT key FROM entries ORDER BY accessed LIMIT 1')
+                self._remove(oldest.fetchone()[0])
+                self.evictions += 1
+
+    def _remove(self, key):
+        row = self.connection.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return
+        self.connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+        self.size -= row[0]
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def tmp_file(self):
+        return tempfile.NamedTemporaryFile(dir=self.cache_dir, prefix=tmp_prefix, delete=False)
+
+
+class Metrics:
+    '''Counters of the proxy requests.'''
+
+    names = ['hits', 'misses', 'errors', 'passthrough']
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {name: 0 for name in self.names}
+
+    def increment(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def render(self, store):
+        '''Return the metrics in the Prometheus text format.
+
+        :param store: the Store
+        :return: str
+        '''
+        with self.lock:
+            counters = dict(self.counters)
+        lines = []
+        for name in self.names:
+            lines.append('# TYPE tikacache_%s_total counter' % name)
+            lines.append('tikacache_%s_total %d' % (name, counters[name]))
+        lines.append('# TYPE tikacache_evictions_total counter')
+        lines.append('tikacache_evictions_total %d' % store.evictions)
+        lines.append('# TYPE tikacache_size_bytes gauge')
+        lines.append('tikacache_size_bytes %d' % store.size)
+        lines.append('# TYPE tikacache_max_size_bytes gauge')
+        lines.append('tikacache_max_size_bytes %d' % store.max_size)
+        lines.append('# TYPE tikacache_entries gauge')
+        lines.append('tikacache_entries %d' % store.count())
+        return '\n'.join(lines) + '\n'
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    '''Forwards the requests to Tika. The bodies of PUT and POST requests are spooled
+    to a temporary file while being hashed, and the response is served from the
+    store if the same document was already extracted the same way.'''
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = self.server.metrics.render(self.server.store).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.forward(None)
+
+    def do_HEAD(self):
+        self.forward(None)
+
+    def do_PUT(self):
+        self.handle_cached()
+
+    def do_POST(self):
+        self.handle_cached()
+
+    def read_body(self, output):
+        '''Copy the request body to the output file and return its hex SHA-256.'''
+        content_hash = hashlib.sha256()
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    while self.rfile.readline() not in [b'\r\n', b'\n', b'']:
+                        pass
+                    break
+                chunk = self.rfile.read(size)
+                self.rfile.readline()
+                content_hash.update(chunk)
+                output.write(chunk)
+        else:
+            remaining = int(self.headers.get('Content-Length') or 0)
+            while remaining:
+                chunk = self.rfile.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                content_hash.update(chunk)
+                output.write(chunk)
+        return content_hash.hexdigest()
+
+    def handle_cached(self):
+        store = self.server.store
+        with store.tmp_file() as body_file:
+            body_path = body_file.name
+            key = get_cache_key(self.command, self.path, self.headers, self.read_body(body_file))
+        try:
+            cached = store.get(key)
+            if cached:
+                self.server.metrics.increment('hits')
+                content_type, result_file = cached
+                with result_file:
+                    self.send_file(200, content_type, result_file)
+                return
+            self.server.metrics.increment('misses')
+            self.forward(body_path, key)
+        finally:
+            os.remove(body_path)
+
+    def send_file(self, status, content_type, result_file, headers=()):
+        self.send_response(status)
+        for header, value in headers:
+            self.send_header(header, value)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(os.fstat(result_file.fileno()).st_size))
+        self.end_headers()
+        while self.command != 'HEAD':
+            chunk = result_file.read(chunk_size)
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+
+    def forward(self, body_path, key=None):
+        '''Send the request to Tika and relay its response, storing successful
+        responses under the given key.
+
+        :param body_path: the file containing the request body; None for no body
+        :param key: the cache key; None to not cache the response
+        '''
+        if key is None:
+            self.server.metrics.increment('passthrough')
+        headers = {header: value for header, value in self.headers.items()
+                   if header.lower() not in hop_headers + ['content-length', 'host']}
+        upstream = http.client.HTTPConnection(self.server.upstream.hostname, self.server.upstream.port or 80,
+                                              timeout=self.server.timeout)
+        try:
+            if body_path:
+                headers['Content-Length'] = str(os.path.getsize(body_path))
+                with open(body_path, 'rb') as body_file:
+                    upstream.request(self.command, self.path, body=body_file, headers=headers)
+            else:
+                upstream.request(self.command, self.path, headers=headers)
+            response = upstream.getresponse()
+            with self.server.store.tmp_file() as result_file:
+                result_path = result_file.name
+                while True:
+                    chunk = response.read(chunk_size)
+                    if not chunk:
+                        break
+                    result_file.write(chunk)
+        except (OSError, http.client.HTTPException) as e:
+            upstream.close()
+            self.server.metrics.increment('errors')
+            self.send_error(502, 'Tika request failed: %s' % e)
+            return
+        upstream.close()
+
+        try:
+            response_headers = [(header, value) for header, value in response.getheaders()
+                                if header.lower() not in hop_headers + ['content-length', 'content-type']]
+            content_type = response.getheader('Content-Type')
+            with open(result_path, 'rb') as result_file:
+                # store the result before responding, so a repeated request is a hit
+                if response.status == 200 and key:
+                    self.server.store.put(key, content_type, result_path)
+                self.send_file(response.status, content_type, result_file, response_headers)
+        finally:
+            if os.path.exists(result_path):
+                os.remove(result_path)
+
+
+class ProxyServer(ThreadingHTTPServer):
+    '''Caching proxy in front of the Tika server. Extraction results are stored on
+    disk keyed by the hash of the document and the request type, so documents
+    indexed again, in the same or in other collections, are not parsed again. The
+    proxy only uses the standard library because it runs in its own container.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, address, upstream, store, timeout=default_timeout, verbose=False):
+        super().__init__(address, ProxyHandler)
+        self.upstream = urlparse(upstream)
+        self.store = store
+        self.metrics = Metrics()
+        self.timeout = timeout
+        self.verbose = verbose
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Caching proxy for the Tika server.')
+    parser.add_argument('--upstream', default='http://snoop-tika:9998', help='The Tika server URL.')
+    parser.add_argument('--cache-dir', default='/cache', help='The directory storing the results.')
+    parser.add_argument('--max-size', default=str(default_max_size),
+                        help='Maximum size of the stored results, e.g. "20g".')
+    parser.add_argument('--port', type=int, default=default_port, help='The port to listen on.')
+    parser.add_argument('--timeout', type=int, default=default_timeout,
+                        help='Timeout of the Tika requests in seconds.')
+    parser.add_argument('-v', '--verbose', action='store_const', const=True, default=False,
+                        help='Log every request.')
+    return parser.parse_args()
+
+
+def main(args):
+    store = Store(args.cache_dir, parse_size(args.max_size))
+    server = ProxyServer(('', args.port), args.upstream, store, args.timeout, args.verbose)
+    print('Caching %s in %s, up to %d bytes' % (args.upstream, args.cache_dir, store.max_size))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main(get_args())
@@ -0,0 +1,194 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import fcntl
+import os
+import threading
+import time
+import uuid
+
+trash_dir_name = '.trash'
+default_rate_limit = 2000
+default_jobs = 4
+
+
+def get_trash_dir(path):
+    '''Return the trash directory for the given path. It is placed next to the path
+    so moving to the trash is a rename on the same filesystem.
+
+    :param path: the path of a file or directory
+    :return: str
+    '''
+    return os.path.join(os.path.dirname(os.path.abspath(path)), trash_dir_name)
+
+
+def move_to_trash(path):
+    '''Atomically move the given directory to the trash. Returns the new path or None
+    if the path does not exist.
+
+    :param path: the directory path
+    :return: str
+    '''
+    if not os.path.lexists(path):
+        return None
+    trash_dir = get_trash_dir(path)
+    os.makedirs(trash_dir, exist_ok=True)
+    trashed_path = os.path.join(trash_dir, '%s-%s' % (os.path.basename(path), uuid.uuid4().hex[:8]))
+    os.rename(path, trashed_path)
+    return trashed_path
+
+
+def list_trash(roots):
+    '''Return the paths in the trash directories of the given roots.
+
+    :param roots: list of directories containing a trash directory
+    :return: list
+    '''
+    entries = []
+    for root in roots:
+        trash_dir = os.path.join(root, trash_dir_name)
+        if os.path.isdir(trash_dir):
+            entries.extend(sorted(entry.path for entry in os.scandir(trash_dir)))
+    return entries
+
+
+class RateLimiter:
+    '''Limits the rate of operations shared by several threads.'''
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, count=1):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(self.next_time, now) + count * self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Progress:
+    '''Counts the deleted files and bytes and prints them periodically.'''
+
+    def __init__(self, interval=5):
+        self.files = 0
+        self.bytes = 0
+        self.interval = interval
+        self.start = self.last_report = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, files, size):
+        with self.lock:
+            self.files += files
+            self.bytes += size
+            now = time.monotonic()
+            if self.interval is not None and now - self.last_report >= self.interval:
+                self.last_report = now
+                self.report()
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.start, 0.001)
+        print('Deleted %d files (%.1f MB) at %d files/s' %
+              (self.files, self.bytes / 2 ** 20, self.files / elapsed), flush=True)
+
+
+def _delete_tree(path, limiter, progress, batch_size=100):
+    files, size = 0, 0
+    for dir_path, dir_names, file_names in os.walk(path, topdown=False):
+        for file_name in file_names + [d for d in dir_names if os.path.islink(os.path.join(dir_path, d))]:
+            file_path = os.path.join(dir_path, file_name)
+            limiter.acquire()
+            try:
+                size += os.lstat(file_path).st_size
+                os.unlink(file_path)
+            except FileNotFoundError:
+                continue
+            files += 1
+            if files == batch_size:
+                progress.add(files, size)
+                files, size = 0, 0
+        for dir_name in dir_names:
+            dir_name_path = os.path.join(dir_path, dir_name)
+            if not os.path.islink(dir_name_path):
+                os.rmdir(dir_name_path)
+    os.rmdir(path)
+    progress.add(files, size)
+
+
+def delete_path(path, limiter, progress, executor):
+    '''Delete the given path, deleting its subdirectories in parallel.
+
+    :param path: the path to delete
+    :param limiter: the RateLimiter for unlink operations
+    :param progress: the Progress counter
+    :param executor: the executor running the deletions
+    '''
+    if os.path.islink(path) or not os.path.isdir(path):
+        limiter.acquire()
+        size = os.lstat(path).st_size
+        os.unlink(path)
+        progress.add(1, size)
+        return
+
+    subdirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            else:
+                limiter.acquire()
+                size = entry.stat(follow_symlinks=False).st_size
+                os.unlink(entry.path)
+                progress.add(1, size)
+    for future in [executor.submit(_delete_tree, subdir, limiter, progress) for subdir in subdirs]:
+        future.result()
+    os.rmdir(path)
+
+
+@contextmanager
+def reaper_lock(lock_path):
+    '''Try to take the reaper lock. Yields false if another reaper holds it.'''
+    with open(lock_path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def empty_trash(roots, lock_path, rate_limit=default_rate_limit, jobs=default_jobs, report_interval=5):
+    '''Delete everything in the trash directories of the given roots. Only one reaper
+    runs at a time; if another one holds the lock this returns immediately, and the
+    running reaper picks up the new entries. Returns the Progress counter.
+
+    :param roots: list of directories containing a trash directory
+    :param lock_path: the reaper lock file path
+    :param rate_limit: the maximum number of files deleted per second; 0 for no limit
+    :param jobs: the number of deletion threads
+    :param report_interval: seconds between progress reports; None to disable
+    :return: Progress
+    '''
+    limiter = RateLimiter(rate_limit)
+    progress = Progress(report_interval)
+    while list_trash(roots):
+        with reaper_lock(lock_path) as locked:
+            if not locked:
+                print('Another reaper is emptying the trash.')
+                break
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                entries = list_trash(roots)
+                while entries:
+                    for entry in entries:
+                        print('Deleting %s' % entry, flush=True)
+                        delete_path(entry, limiter, progress, executor)
+                    entries = list_trash(roots)
+    if report_interval is not None:
+        progress.report()
+    return progress
@@ -2,13 +2,23 @@ import argparse
 
 from src.common import validate_collections, get_collections_data, write_global_docker_file, \
     write_collections_docker_files, write_python_settings_files, write_env_files,\
-    update_collections_settings, write_collections_settings, default_snoop_image
+    update_collections_settings, write_collections_settings, default_snoop_image, \
+    print_changed_services, registry_locked, add_workers_arguments, validate_workers_settings, \
+    exit_msg, write_global_settings, get_tika_resources, compose_command, get_worker_services
+from src.process import apply_changed_services
+from src.resources import get_cpu_count, split_cores, format_cpuset, memory_pattern, pg_profiles
+from src import status
+from src.tikacache import parse_size
 
 
 def get_args():
     parser = argparse.ArgumentParser(description='Update the collections settings with given options.')
     parser.add_argument('-s', '--snoop-image', help='Snoop docker image', nargs='?',
                         const=default_snoop_image)
+    parser.add_argument('--apply', action='store_const', const=True, default=False,
+                        help='Recreate only the changed collection services instead of ' +
+                             'restarting docker-compose, including the changes of previous runs ' +
+                             'to the docker files.')
 
     for_dev = parser.add_mutually_exclusive_group()
     for_dev.add_argument('-d', '--dev', action='append', nargs='*',
@@ -42,6 +52,40 @@ def get_args():
                            help='Enable automatic indexing for the given collections. ' +
                                 'If no collections were specified auto-indexing will be disabled for all.')
 
+    stats = parser.add_mutually_exclusive_group()
+    stats.add_argument('--stats', '--enable-stats', dest='stats', action='append', nargs='*',
+                       help='Enable the kibana stats for the given collections. ' +
+                            'If no collections were specified the stats will be enabled for all.')
+    stats.add_argument('--disable-stats', action='append', nargs='*',
+                       help='Disable the kibana stats for the given collections. ' +
+                            'If no collections were specified the stats will be disabled for all.')
+
+    parser.add_argument('-c', '--collections', nargs='+',
+                        help='Collections to apply the workers and postgres options to; all by default.')
+    add_workers_arguments(parser, replicas_default=None)
+    parser.add_argument('--auto', action='store_const', const=True, default=False,
+                        help='Split the host CPUs between the auto-indexing collections ' +
+                             'proportionally to their pending tasks, setting their cpuset and workers.')
+    parser.add_argument('--pg-profile', choices=pg_profiles + [''],
+                        help='Tuning profile of the collections postgres; empty for the postgres ' +
+                             'defaults. The memory is split between all profiled collections.')
+
+    parser.add_argument('--tika-replicas',
+                        help='Number of Tika services behind a load balancer shared by all ' +
+                             'collections, or "auto" to size it from the host CPUs and memory.')
+    parser.add_argument('--tika-heap',
+                        help='JVM heap of each Tika service, e.g. "4g"; empty to size it from ' +
+                             'the host memory.')
+    parser.add_argument('--tika-cache',
+                        help='Cache the Tika extraction results by content hash, up to the given ' +
+                             'size, e.g. "20g"; empty to disable the cache.')
+    pgbouncer = parser.add_mutually_exclusive_group()
+    pgbouncer.add_argument('--pgbouncer', dest='pgbouncer', action='store_const', const=True,
+                           help='Connect snoop and search to their databases through pgbouncer, ' +
+                                'pooling the connections in transaction mode.')
+    pgbouncer.add_argument('--no-pgbouncer', dest='pgbouncer', action='store_const', const=False,
+                           help='Connect snoop and search directly to their databases.')
+
     return parser.parse_args()
 
 
@@ -60,6 +104,77 @@ def read_collections_arg(add_list, remove_list, all_collections):
     return collections, remove
 
 
+def read_workers_args(args):
+    '''Return the workers settings given in the arguments. Empty values reset the
+    setting to its default.
+
+    :param args: the parsed arguments
+    :return: dict
+    '''
+    attributes = {}
+    if args.workers is not None:
+        attributes['workers'] = args.workers or None
+    if args.replicas is not None:
+        attributes['replicas'] = args.replicas
+    if args.cpuset is not None:
+        attributes['cpuset'] = args.cpuset or None
+    if args.memory is not None:
+        attributes['memory'] = args.memory.lower() or None
+    errors = validate_workers_settings(attributes)
+    if errors:
+        exit_msg('\n'.join(errors))
+    return attributes
+
+
+def auto_split_cores(data, collections_names):
+    '''Split the host CPUs between the given auto-indexing collections based on
+    their number of pending tasks.
+
+    :param data: the collections data
+    :param collections_names: the names of the collections to consider
+    '''
+    collections = {name: settings for name, settings in data['collections'].items()
+                   if name in collections_names and settings.get('autoindex')}
+    if not collections:
+        exit_msg('No auto-indexing collections to split the CPUs between')
+    backlogs = {name: collection_status['pending']
+                for name, collection_status in status.poll_collections(collections).items()}
+    allocation = split_cores(backlogs, list(range(get_cpu_count())))
+    for name, cores in allocation.items():
+        print('%s: %d pending tasks, CPUs %s' % (name, backlogs[name] or 0, format_cpuset(cores)))
+        update_collections_settings(data, {'cpuset': format_cpuset(cores), 'workers': len(cores)}, [name])
+
+
+def read_tika_args(args):
+    '''Return the Tika global settings given in the arguments.
+
+    :param args: the parsed arguments
+    :return: dict
+    '''
+    settings = {}
+    if args.tika_replicas is not None:
+        if args.tika_replicas == 'auto':
+            settings['tika_replicas'] = 'auto'
+        elif args.tika_replicas.isdigit() and int(args.tika_replicas) > 0:
+            settings['tika_replicas'] = int(args.tika_replicas)
+        else:
+            exit_msg('Invalid number of Tika replicas: %s', args.tika_replicas)
+    if args.tika_heap is not None:
+        if args.tika_heap and not memory_pattern.match(args.tika_heap.lower()):
+            exit_msg('Invalid Tika heap "%s", expected e.g. "512m" or "4g"', args.tika_heap)
+        settings['tika_heap'] = args.tika_heap.lower() or None
+    if args.tika_cache is not None:
+        try:
+            # validated like the cache proxy parses it
+            if args.tika_cache:
+                parse_size(args.tika_cache)
+        except ValueError:
+            exit_msg('Invalid Tika cache size "%s", expected e.g. "20g"', args.tika_cache)
+        settings['tika_cache'] = args.tika_cache.lower() or None
+    return settings
+
+
+@registry_locked
 def update_settings(args):
     data = get_collections_data()
 
@@ -81,19 +196,49 @@ def update_settings(args):
                                                     collections_names)
     update_collections_settings(data, {'tracing': not disable_tracing}, tracing)
 
+    stats, disable_stats = read_collections_arg(args.stats, args.disable_stats, collections_names)
+    update_collections_settings(data, {'stats': not disable_stats}, stats)
+
     for_dev, remove_dev = read_collections_arg(args.dev, args.remove_dev, collections_names)
     update_collections_settings(data, {'for_dev': not remove_dev}, for_dev)
 
+    workers_collections = args.collections or collections_names
+    if args.collections:
+        validate_collections(args.collections)
+    update_collections_settings(data, read_workers_args(args), workers_collections)
+    if args.auto:
+        auto_split_cores(data, workers_collections)
+    if args.pg_profile is not None:
+        update_collections_settings(data, {'pg_profile': args.pg_profile or None}, workers_collections)
+
+    global_settings = read_tika_args(args)
+    if global_settings:
+        data['global_settings'].update(global_settings)
+        tika_replicas, tika_heap = get_tika_resources(data['global_settings'])
+        print('Tika: %d replicas, heap %s, cache %s' % (tika_replicas, tika_heap or 'JVM default',
+                                                        data['global_settings']['tika_cache'] or 'disabled'))
+    if args.pgbouncer is not None:
+        global_settings['pgbouncer'] = data['global_settings']['pgbouncer'] = args.pgbouncer
+        print('pgbouncer: %s' % ('enabled' if args.pgbouncer else 'disabled'))
+
     if args.snoop_image:
         for settings in data['collections'].values():
             settings['image'] = args.snoop_image
 
-    write_env_files(collections)
-
-    write_python_settings_files(collections)
-    dev_instances = write_collections_docker_files(collections)
-    write_global_docker_file(collections, bool(dev_instances))
-    write_collections_settings(collections)
-
-    print('Restart docker-compose:')
-    print('  $ docker-compose down && docker-compose up -d')
+    changed_settings = set(write_env_files(collections)) | \
+        set(write_python_settings_files(collections, data['global_settings']))
+    dev_instances = write_collections_docker_files(collections, data['ports'], data['global_settings'])
+    changed_services = write_global_docker_file(collections, bool(dev_instances), data['global_settings'])
+    # the snoop services read the env and settings files only when they start
+    changed_services = sorted(set(changed_services).union(*(
+        ['snoop--' + collection] + get_worker_services(collection, collections[collection])
+        for collection in changed_settings)))
+    write_collections_settings(data)
+    write_global_settings(global_settings)
+
+    print_changed_services(changed_services)
+    if args.apply:
+        apply_changed_services(changed_services)
+    elif changed_services:
+        print('Restart docker-compose:')
+        print('  $ %s down && %s up -d' % (compose_command, compose_command))
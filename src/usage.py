@@ -0,0 +1,117 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import json
+import os
+import sqlite3
+
+default_jobs = 16
+
+cache_schema = '''
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    files INTEGER NOT NULL,
+    subdirs TEXT NOT NULL
+);
+'''
+
+
+def scan_dir(path, cache, cacheable):
+    '''Return the disk usage and number of the files directly in the given directory
+    and its subdirectory names. If the directory is cacheable and its modification
+    time did not change the cached values are returned.
+
+    :param path: the directory path
+    :param cache: dictionary of path to (mtime_ns, size, files, subdirs)
+    :param cacheable: true if the files in the directory are never modified in place
+    :return: (size, files, subdirs, mtime_ns, scanned, errors)
+    '''
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+        cached = cache.get(path)
+        if cacheable and cached and cached[0] == mtime_ns:
+            return cached[1], cached[2], cached[3], mtime_ns, False, 0
+
+        size, files, subdirs = 0, 0, []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                else:
+                    size += entry.stat(follow_symlinks=False).st_blocks * 512
+                    files += 1
+        return size, files, subdirs, mtime_ns, True, 0
+    except (PermissionError, FileNotFoundError):
+        return 0, 0, [], None, False, 1
+
+
+def load_cache(cache_path):
+    connection = sqlite3.connect(cache_path, isolation_level=None)
+    connection.executescript(cache_schema)
+    cache = {path: (mtime_ns, size, files, json.loads(subdirs)) for path, mtime_ns, size, files, subdirs in
+             connection.execute('SELECT path, mtime_ns, size, files, subdirs FROM dirs')}
+    return connection, cache
+
+
+def get_usage(roots, cache_path=None, jobs=default_jobs):
+    '''Compute the disk usage of the given directory trees, scanning directories in
+    parallel. The totals of each directory are saved in the cache database and
+    reused while the directory modification time does not change. Only roots marked
+    as cacheable use the cache, because modifying a file in place does not change
+    the modification time of its directory. Cached directories which were not
+    visited are removed from the cache.
+
+    :param roots: dictionary of root directory path to true if cacheable
+    :param cache_path: the cache database path; None to disable caching
+    :param jobs: number of directories scanned in parallel
+    :return: dictionary of root to dict with size, files, scanned and errors
+    '''
+    connection, cache = load_cache(cache_path) if cache_path else (None, {})
+    usage = {root: {'size': 0, 'files': 0, 'scanned': 0, 'errors': 0} for root in roots}
+    updated = {}
+    visited = set()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = {executor.submit(scan_dir, root, cache, cacheable): (root, root)
+                   for root, cacheable in roots.items() if os.path.isdir(root)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, root = pending.pop(future)
+                visited.add(path)
+                size, files, subdirs, mtime_ns, scanned, errors = future.result()
+                totals = usage[root]
+                totals['size'] += size
+                totals['files'] += files
+                totals['scanned'] += scanned
+                totals['errors'] += errors
+                if scanned and roots[root]:
+                    updated[path] = (mtime_ns, size, files, subdirs)
+                for subdir in subdirs:
+                    subdir_path = os.path.join(path, subdir)
+                    pending[executor.submit(scan_dir, subdir_path, cache, roots[root])] = (subdir_path, root)
+
+    if connection:
+        connection.execute('BEGIN')
+        connection.executemany('INSERT OR REPLACE INTO dirs (path, mtime_ns, size, files, subdirs) '
+                               'VALUES (?, ?, ?, ?, ?)',
+                               [(path, mtime_ns, size, files, json.dumps(subdirs))
+                                for path, (mtime_ns, size, files, subdirs) in updated.items()])
+        connection.executemany('DELETE FROM dirs WHERE path = ?',
+                               [(path,) for path in set(cache) - visited])
+        connection.execute('COMMIT')
+        connection.close()
+    return usage
+
+
+def format_size(size):
+    '''Return the size in bytes in human readable format.
+
+    :param size: the size in bytes
+    :return: str
+    '''
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size < 1024 or unit == 'TB':
+            break
+        size /= 1024
+    return ('%d %s' if unit == 'B' else '%.1f %s') % (size, unit)
@@ -2,11 +2,13 @@
 
 # Follow the steps below to finish the collection creation:
 echo "Starting with added containers using docker-compose..."
-docker-compose up -d
+{{ compose_command }} up -d
 echo "Waiting for PostgreSQL to start..."
-docker-compose run --rm snoop--{{ collection_name }} /wait
-echo "Initializing the collection database, index, running dispatcher..."
-docker-compose run --rm snoop--{{ collection_name }} ./manage.py initcollection
+{{ compose_command }} run --rm snoop--{{ collection_name }} /wait
+{% if create_database %}echo "Creating the collection database..."
+{{ create_database }}
+{% endif %}echo "Initializing the collection database, index, running dispatcher..."
+{{ compose_command }} run --rm snoop--{{ collection_name }} ./manage.py initcollection
 echo "Adding the collection to search..."
-docker-compose run --rm search ./manage.py addcollection {{ collection_name }} --index {{ collection_index }} http://snoop--{{ collection_name }}/collection/json
+{{ compose_command }} run --rm search ./manage.py addcollection {{ collection_name }} --index {{ collection_index }} http://snoop--{{ collection_name }}/collection/json
 echo "Done."
@@ -0,0 +1,7 @@
+
+DATABASES['default'].update({
+    'HOST': '{{ host }}',
+    'PORT': {{ port }},
+    'NAME': '{{ database }}',
+    'DISABLE_SERVER_SIDE_CURSORS': True,
+})
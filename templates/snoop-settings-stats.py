@@ -0,0 +1,2 @@
+
+SNOOP_STATS_ELASTICSEARCH_URL = 'http://snoop-stats-es:9200'
@@ -0,0 +1,2 @@
+
+SNOOP_TIKA_URL = '{{ tika_url }}'
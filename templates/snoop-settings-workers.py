@@ -0,0 +1,2 @@
+
+CELERY_WORKER_CONCURRENCY = {{ workers }}
@@ -16,9 +16,9 @@ DEBUG = bool(strtobool(os.environ.get('DOCKER_HOOVER_SNOOP_DEBUG')))
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'snoop',
+        'NAME': '{{ pg_database }}',
         'USER': 'snoop',
-        'HOST': 'snoop-pg--{{ collection_name }}',
+        'HOST': '{{ pg_host }}',
         'PORT': 5432,
     },
 }
@@ -0,0 +1,222 @@
+'''Benchmarks for the collection management code paths.
+
+Run from the repository root:
+  $ python -m tests.benchmark --sizes 100 1000 --output benchmark.json
+  $ python -m tests.benchmark --baseline benchmark.json
+
+Write benchmarks are timed twice: "cold" when the files do not exist yet and
+"warm" when the rendered content is unchanged.
+'''
+import argparse
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import platform
+import sys
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from jinja2 import Template
+
+import src.common as c
+from src import registry
+
+repo_dir = Path(__file__).absolute().parent.parent
+default_sizes = [10, 100, 1000, 5000]
+default_tolerance = 1.5
+
+
+def timed(function, *args, **kwargs):
+    '''Return the wall clock time in seconds spent running the given function.'''
+    start = perf_counter()
+    function(*args, **kwargs)
+    return perf_counter() - start
+
+
+def synthetic_collections(count):
+    '''Return settings for the given number of synthetic collections.
+
+    :param count: number of collections
+    :return: OrderedDict
+    '''
+    collections = OrderedDict()
+    for index in range(count):
+        collections['collection%d' % index] = {
+            'autoindex': index % 3 != 0,
+            'image': c.default_snoop_image,
+            'profiling': index % 5 == 0,
+            'tracing': index % 7 == 0,
+            'for_dev': False,
+            'snoop_port': c.start_snoop_port + index,
+            'flower_port': c.start_flower_port + index if index % 3 != 0 else None,
+            'pg_port': None,
+            'env': {
+                c.DOCKER_HOOVER_SNOOP_SECRET_KEY: 'secret-key-%d' % index,
+                c.DOCKER_HOOVER_SNOOP_BASE_URL: 'http://localhost',
+                c.DOCKER_HOOVER_SNOOP_DEBUG: False
+            }
+        }
+    return collections
+
+
+@contextmanager
+def synthetic_deployment(count):
+    '''Create a temporary deployment directory with the given number of collections
+    and run the benchmarked code inside it.
+
+    :param count: number of collections
+    '''
+    currdir = os.getcwd()
+    root_dir = c.root_dir
+    with TemporaryDirectory() as deployment_dir:
+        deployment_path = Path(deployment_dir)
+        os.symlink(str(repo_dir / c.templates_dir_name), str(deployment_path / c.templates_dir_name))
+        os.mkdir(str(deployment_path / c.settings_dir_name))
+        os.mkdir(str(deployment_path / c.collections_dir_name))
+        collections = synthetic_collections(count)
+        for collection in collections:
+            os.mkdir(str(deployment_path / c.collections_dir_name / collection))
+        os.chdir(deployment_dir)
+        c.root_dir = deployment_path
+        try:
+            yield collections
+        finally:
+            registry.close_all()
+            c.root_dir = root_dir
+            os.chdir(currdir)
+
+
+def render_settings_uncached(collections):
+    '''Render the snoop settings compiling the templates for every collection, the
+    way they were rendered before the shared templates environment.'''
+    for collection, settings in collections.items():
+        with open(os.path.join(c.templates_dir_name, c.snoop_settings_file_name)) as template_file:
+            Template(template_file.read()).render(collection_name=collection,
+                                                  collection_index=collection.lower(),
+                                                  collection_root=c.get_collection_data_dir(collection))
+        if settings.get('profiling'):
+            with open(os.path.join(c.templates_dir_name, c.snoop_settings_profiling_file_name)) as \
+                    template_file:
+                Template(template_file.read()).render()
+
+
+def render_settings_cached(collections):
+    '''Render the snoop settings using the shared templates environment.'''
+    for collection, settings in collections.items():
+        c.render_template(c.snoop_settings_file_name, collection_name=collection,
+                          collection_index=collection.lower(),
+                          collection_root=c.get_collection_data_dir(collection))
+        if settings.get('profiling'):
+            c.render_template(c.snoop_settings_profiling_file_name)
+
+
+def bench_templates(count):
+    '''Compare template compilation per collection with the shared environment and
+    with the full settings files generation (rendering and I/O).
+
+    :param count: number of collections
+    :return: dict
+    '''
+    with synthetic_deployment(count) as collections:
+        return OrderedDict((
+            ('render_uncached', timed(render_settings_uncached, collections)),
+            ('render_cached', timed(render_settings_cached, collections)),
+            ('write_python_settings_files', timed(c.write_python_settings_files, collections)),
+        ))
+
+
+def bench_collections(count):
+    '''Time the collection management functions on a synthetic deployment.
+
+    :param count: number of collections
+    :return: dict
+    '''
+    timings = OrderedDict()
+    with synthetic_deployment(count) as collections:
+        for run in ['cold', 'warm']:
+            timings['write_env_files_' + run] = timed(c.write_env_files, collections)
+            timings['write_python_settings_files_' + run] = \
+                timed(c.write_python_settings_files, collections)
+            timings['write_collections_docker_files_' + run] = \
+                timed(c.write_collections_docker_files, collections)
+            timings['write_global_docker_file_' + run] = \
+                timed(c.write_global_docker_file, collections)
+
+        timings['get_collections_data_old'] = timed(c.get_collections_data_old)
+        c.write_collections_settings(collections)
+        timings['get_collections_data'] = timed(c.get_collections_data)
+        timings['validate_collections'] = timed(c.validate_collections, collections)
+    return timings
+
+
+def run_benchmarks(sizes):
+    '''Run the benchmarks for deployments of the given sizes.
+
+    :param sizes: list of collections counts
+    :return: dict
+    '''
+    runs = []
+    for size in sizes:
+        timings = bench_collections(size)
+        timings.update(bench_templates(size))
+        runs.append(OrderedDict((('collections', size), ('timings', timings))))
+    return OrderedDict((
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('runs', runs),
+    ))
+
+
+def find_regressions(results, baseline, tolerance=default_tolerance):
+    '''Compare the results with a baseline. Returns a list of (collections count,
+    benchmark name, baseline time, current time) for the benchmarks slower than the
+    baseline by more than the given factor.
+
+    :param results: benchmark results
+    :param baseline: baseline benchmark results
+    :param tolerance: accepted slowdown factor
+    :return: list
+    '''
+    baseline_runs = {run['collections']: run['timings'] for run in baseline['runs']}
+    regressions = []
+    for run in results['runs']:
+        baseline_timings = baseline_runs.get(run['collections'], {})
+        for name, duration in run['timings'].items():
+            if name in baseline_timings and duration > baseline_timings[name] * tolerance:
+                regressions.append((run['collections'], name, baseline_timings[name], duration))
+    return regressions
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Benchmark the collection management code.')
+    parser.add_argument('-s', '--sizes', nargs='+', type=int, default=default_sizes,
+                        help='Number of synthetic collections for each run.')
+    parser.add_argument('-o', '--output', help='Write the JSON results to this file.')
+    parser.add_argument('-b', '--baseline',
+                        help='Compare the results with a JSON results file and exit with an ' +
+                             'error if any benchmark regressed.')
+    parser.add_argument('-t', '--tolerance', type=float, default=default_tolerance,
+                        help='Accepted slowdown factor when comparing with the baseline.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    results = run_benchmarks(args.sizes)
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        sys.stdout.write(output + '\n')
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.tolerance)
+        for size, name, baseline_duration, duration in regressions:
+            print('%d collections: %s regressed from %.4fs to %.4fs' %
+                  (size, name, baseline_duration, duration), file=sys.stderr)
+        if regressions:
+            exit(1)
@@ -0,0 +1,21 @@
+'''In-memory stand-ins for the RabbitMQ client and the worker scaler used by the autoscaling tests.'''
+
+
+class FakeQueues:
+    def __init__(self, depths):
+        self.depths = depths
+
+    def queue_depths(self, collections):
+        return {collection: self.depths.get(collection, 0) for collection in collections}
+
+
+class FakeWorkers:
+    def __init__(self):
+        self.running_services = set()
+
+    def running(self, services):
+        return len(self.running_services.intersection(services))
+
+    def scale(self, services, count):
+        self.running_services.difference_update(services)
+        self.running_services.update(services[:count])
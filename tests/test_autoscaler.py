@@ -0,0 +1,75 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import io
+import json
+import threading
+
+from src.autoscaler import RabbitMQClient, Autoscaler, compute_targets
+from tests.stubs import FakeQueues, FakeWorkers
+
+
+def worker_services(collection, replicas):
+    return ['snoop-worker--%s' % collection] + \
+        ['snoop-worker--%s--%d' % (collection, replica) for replica in range(2, replicas + 1)]
+
+
+def test_rabbitmq_queue_depths():
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            assert self.path.startswith('/api/queues/%2F')
+            assert self.headers['Authorization'] == 'Basic Z3Vlc3Q6Z3Vlc3Q='
+            body = json.dumps([{'name': 'testdata.filesystem.walk', 'messages': 10},
+                               {'name': 'testdata.digests.gather', 'messages': 5},
+                               {'name': 'other.filesystem.walk', 'messages': 1},
+                               {'name': 'celery', 'messages': 100}]).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = RabbitMQClient('http://127.0.0.1:%d/' % server.server_address[1])
+        assert client.queue_depths(['testdata', 'idle']) == {'testdata': 15, 'idle': 0}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_compute_targets():
+    bounds = {'big': (1, 4), 'small': (1, 4), 'idle': (0, 4)}
+    depths = {'big': 1000, 'small': 150, 'idle': 0}
+    assert compute_targets(depths, bounds, tasks_per_worker=100) == {'big': 4, 'small': 2, 'idle': 0}
+    assert compute_targets(depths, bounds, budget=4, tasks_per_worker=100) == \
+        {'big': 3, 'small': 1, 'idle': 0}
+    assert compute_targets(depths, bounds, budget=1, tasks_per_worker=100) == \
+        {'big': 1, 'small': 1, 'idle': 0}
+
+
+def test_autoscaler():
+    now = [0]
+    queues = FakeQueues({'a': 500, 'b': 0})
+    workers = FakeWorkers()
+    workers.scale(worker_services('b', 3), 1)
+    collections = {'a': (worker_services('a', 3), 1), 'b': (worker_services('b', 3), 0)}
+    output = io.StringIO()
+    autoscaler = Autoscaler(queues, workers, budget=4, tasks_per_worker=100, cooldown=60,
+                            clock=lambda: now[0], output=output)
+
+    assert autoscaler.step(collections) == {'a': 3, 'b': 1}
+    assert 'snoop-worker--a--3' in workers.running_services
+    assert 'a: 500 queued tasks, scaling workers 0 -> 3' in output.getvalue()
+
+    now[0] = 30
+    queues.depths = {'a': 0, 'b': 0}
+    assert autoscaler.step(collections) == {'a': 3, 'b': 1}
+    now[0] = 90
+    assert autoscaler.step(collections) == {'a': 1, 'b': 0}
+    assert workers.running_services == {'snoop-worker--a'}
+
+    queues.depths = {'a': 1000, 'b': 1000}
+    assert autoscaler.step(collections) == {'a': 2, 'b': 2}
+    assert sum(autoscaler.step(collections).values()) == 4
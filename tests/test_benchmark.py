@@ -0,0 +1,18 @@
+from tests.benchmark import run_benchmarks, find_regressions
+
+
+def test_run_benchmarks():
+    results = run_benchmarks([3])
+    assert [run['collections'] for run in results['runs']] == [3]
+    timings = results['runs'][0]['timings']
+    for name in ['get_collections_data', 'get_collections_data_old', 'validate_collections',
+                 'write_collections_docker_files_cold', 'write_python_settings_files_warm',
+                 'write_env_files_cold', 'write_global_docker_file_warm']:
+        assert timings[name] >= 0
+
+
+def test_find_regressions():
+    baseline = {'runs': [{'collections': 10, 'timings': {'a': 1.0, 'b': 1.0}}]}
+    results = {'runs': [{'collections': 10, 'timings': {'a': 1.2, 'b': 2.0, 'c': 5.0}},
+                        {'collections': 100, 'timings': {'a': 9.0}}]}
+    assert find_regressions(results, baseline, 1.5) == [(10, 'b', 1.0, 2.0)]
@@ -3,7 +3,7 @@ from contextlib import contextmanager
 import os
 from pathlib import Path
 import re
-from shutil import copytree
+from shutil import copyfile, copytree
 
 import pytest
 import yaml
@@ -13,7 +13,8 @@ from src.common import get_collections_data, write_python_settings_file, \
     write_global_docker_file, read_env_file, write_env_file, \
     InvalidCollectionName, validate_collection_name, \
     write_collections_docker_files, read_collection_docker_file, \
-    settings_dir_name, get_collections_data_old
+    settings_dir_name, get_collections_data_old, write_file_if_changed, \
+    get_changed_services, get_collection_services, validate_workers_settings
 import src.common as c
 
 
@@ -92,14 +93,15 @@ def test_get_collections_data_old(monkeypatch, data_dir_path):
     assert data['dev_instances'] == 2
 
 
-def test_get_collections_data(monkeypatch, data_dir_path):
+def test_get_collections_data(monkeypatch, data_dir_path, tmpdir):
     env = {
         c.DOCKER_HOOVER_SNOOP_SECRET_KEY: 'secret-key===',
         c.DOCKER_HOOVER_SNOOP_DEBUG: False,
         c.DOCKER_HOOVER_SNOOP_BASE_URL: 'http://localhost'
     }
 
-    monkeypatch.setattr(c, 'settings_dir_name', str(data_dir_path))
+    copyfile(str(data_dir_path / 'collections.json'), str(tmpdir / 'collections.json'))
+    monkeypatch.setattr(c, 'settings_dir_name', str(tmpdir))
     monkeypatch.setattr(c, 'get_settings_dir', lambda _: c.settings_dir_name)
     data = get_collections_data()
     assert data['collections'] == OrderedDict((
@@ -114,6 +116,31 @@ def test_get_collections_data(monkeypatch, data_dir_path):
     assert data['pg_port'] == 5433
     assert data['dev_instances'] == 0
 
+    assert not (tmpdir / 'collections.json').exists()
+    assert (tmpdir / 'collections.json.migrated').exists()
+    assert get_collections_data()['collections'] == data['collections']
+
+
+def test_write_collections_settings(monkeypatch, data_dir_path, tmpdir):
+    copyfile(str(data_dir_path / 'collections.json'), str(tmpdir / 'collections.json'))
+    monkeypatch.setattr(c, 'settings_dir_name', str(tmpdir))
+    data = get_collections_data()
+
+    c.release_collection_ports(data['ports'], data['collections']['testdata1'])
+    del data['collections']['testdata1']
+    data['collections']['testdata3'] = {'image': 'snoop2', 'autoindex': False,
+                                        'snoop_port': data['ports']['snoop_port'].allocate(False)}
+    c.write_collections_settings(data)
+
+    data = get_collections_data()
+    assert list(data['collections']) == ['testdata2', 'testdata3']
+    assert data['collections']['testdata3']['snoop_port'] == 45025
+    assert data['flower_port'] == 15555
+    connection = c.get_registry()
+    assert c.registry.get_collection(connection, 'TESTDATA2')['snoop_port'] == 45026
+    assert c.registry.find_collection_by_port(connection, 15556) == ('testdata2', 'flower_port')
+    assert c.registry.find_collection_by_port(connection, 15555) is None
+
 
 def test_write_python_settings_file(tmpdir):
     collection = 'testdata'
@@ -264,11 +291,9 @@ def test_write_collections_docker_files(monkeypatch, data_dir_path, tmpdir):
                       'flower_port': 15555},
     }
 
-    with chdir(str(data_dir_path / 'collections')):
-        data = get_collections_data()
-
     copytree(str(data_dir_path / 'collections'), str(tmpdir / 'collections'))
     with chdir(str(tmpdir / 'collections')):
+        data = get_collections_data()
         write_collections_docker_files(data['collections'])
         for collection in data['collections']:
             settings_dir = str(tmpdir / 'collections' / settings_dir_name / collection)
@@ -276,3 +301,301 @@ def test_write_collections_docker_files(monkeypatch, data_dir_path, tmpdir):
             assert image == collections_settings[collection]['image']
             assert snoop_port == collections_settings[collection]['snoop_port']
             assert flower_port == collections_settings[collection]['flower_port']
+
+
+def test_write_file_if_changed(tmpdir):
+    file_path = str(tmpdir / 'file.txt')
+    assert write_file_if_changed(file_path, 'content')
+    mtime = os.stat(file_path).st_mtime_ns
+    assert not write_file_if_changed(file_path, 'content')
+    assert os.stat(file_path).st_mtime_ns == mtime
+    assert write_file_if_changed(file_path, 'new content')
+    with open(file_path) as file:
+        assert file.read() == 'new content'
+    assert not os.path.exists(file_path + '.tmp')
+
+
+def test_write_global_docker_file_changed_services(monkeypatch, tmpdir):
+    monkeypatch.setattr(c, 'docker_file_name', 'docker-compose.override.yml')
+    monkeypatch.setattr(c, 'settings_dir_name', str(tmpdir / 'settings'))
+    monkeypatch.setattr(c, 'root_dir', tmpdir)
+
+    collections = OrderedDict()
+    for collection in ['fl1', 'fl2']:
+        collections[collection] = {'image': 'snoop2', 'snoop_port': 45025, 'autoindex': True}
+        settings_dir = os.path.join(c.settings_dir_name, collection)
+        os.makedirs(settings_dir)
+        write_collection_docker_file(collection, settings_dir, collections[collection])
+
+    changed = write_global_docker_file(collections)
+    assert 'snoop--fl1' in changed and 'snoop-worker--fl2' in changed and 'search' in changed
+
+    assert write_global_docker_file(collections) == []
+
+    collections['fl2']['autoindex'] = False
+    write_collection_docker_file('fl2', os.path.join(c.settings_dir_name, 'fl2'), collections['fl2'])
+    assert write_global_docker_file(collections) == ['snoop-worker--fl2']
+    assert get_changed_services(str(tmpdir / c.orig_docker_file_name),
+                                str(tmpdir / c.docker_file_name)) == ['snoop-worker--fl2']
+
+    del collections['fl1']
+    assert write_global_docker_file(collections) == ['search', 'snoop--fl1', 'snoop-pg--fl1',
+                                                     'snoop-worker--fl1']
+    # the orig docker file keeps the services last applied
+    assert get_changed_services(str(tmpdir / c.orig_docker_file_name), str(tmpdir / c.docker_file_name)) == \
+        ['search', 'snoop--fl1', 'snoop-pg--fl1', 'snoop-worker--fl1', 'snoop-worker--fl2']
+
+
+def test_write_global_docker_file_stats(monkeypatch, tmpdir):
+    monkeypatch.setattr(c, 'docker_file_name', 'docker-compose.override.yml')
+    monkeypatch.setattr(c, 'settings_dir_name', str(tmpdir / 'settings'))
+    monkeypatch.setattr(c, 'root_dir', tmpdir)
+
+    collections = OrderedDict()
+    for collection, stats in [('fl1', True), ('fl2', False)]:
+        collections[collection] = {'image': 'snoop2', 'snoop_port': 45025, 'autoindex': True, 'stats': stats}
+        settings_dir = os.path.join(c.settings_dir_name, collection)
+        os.makedirs(settings_dir)
+        write_collection_docker_file(collection, settings_dir, collections[collection])
+        write_python_settings_file(collection, settings_dir, collections[collection])
+
+    with open(os.path.join(c.settings_dir_name, 'fl1', c.snoop_settings_file_name)) as settings_file:
+        assert 'SNOOP_STATS_ELASTICSEARCH_URL' in settings_file.read()
+    with open(os.path.join(c.settings_dir_name, 'fl2', c.snoop_settings_file_name)) as settings_file:
+        assert 'SNOOP_STATS_ELASTICSEARCH_URL' not in settings_file.read()
+
+    write_global_docker_file(collections)
+    with open(str(tmpdir / c.docker_file_name)) as docker_file:
+        settings = yaml.load(docker_file, Loader=yaml.FullLoader)
+    assert set(c.snoop_stats_services) < set(settings['services'])
+    assert 'snoop-stats-es-data' in settings['volumes']
+    assert 'snoop-stats-es' in settings['services']['snoop-worker--fl1']['depends_on']
+    assert 'snoop-stats-es' not in settings['services']['snoop-worker--fl2']['depends_on']
+
+    collections['fl1']['stats'] = False
+    write_collection_docker_file('fl1', os.path.join(c.settings_dir_name, 'fl1'), collections['fl1'])
+    assert write_global_docker_file(collections) == sorted(c.snoop_stats_services + ['snoop-worker--fl1'])
+    with open(str(tmpdir / c.docker_file_name)) as docker_file:
+        assert 'volumes' not in yaml.load(docker_file, Loader=yaml.FullLoader)
+
+
+def test_get_collection_services_levels():
+    services = ['search', 'snoop-worker--b', 'snoop--a', 'snoop-pg--b', 'snoop-worker--a', 'snoop--b']
+    assert c.get_collection_services_levels(services) == [
+        ['snoop-pg--b'], ['snoop--a', 'snoop--b'], ['snoop-worker--a', 'snoop-worker--b']]
+    assert c.get_collection_services_levels(['search']) == []
+
+
+def test_get_collection_services():
+    services = ['search', 'snoop-worker--b', 'snoop--a', 'snoop-pg--b', 'snoop--ab', 'snoop--b']
+    assert c.get_collection_services('b', services) == ['snoop--b', 'snoop-pg--b', 'snoop-worker--b']
+    assert c.get_collection_services('c', services) == []
+
+
+def test_write_collection_docker_file_workers(tmpdir):
+    tmpdir_path = str(tmpdir)
+    write_collection_docker_file('testdata', tmpdir_path,
+                                 {'image': 'snoop_image', 'autoindex': True, 'snoop_port': 45025,
+                                  'flower_port': 15555, 'replicas': 3, 'cpuset': '0-3,6',
+                                  'memory': '4g'})
+    with open(os.path.join(tmpdir_path, docker_collection_file_name)) as collection_file:
+        services = yaml.load(collection_file, Loader=yaml.FullLoader)
+    workers = ['snoop-worker--testdata', 'snoop-worker--testdata--2', 'snoop-worker--testdata--3']
+    assert sorted(service for service in services if service.startswith('snoop-worker--')) == workers
+    assert services[workers[0]]['ports'] == ['15555:5555']
+    for worker in workers:
+        assert services[worker]['command'] == 'taskset -c 0-3,6 ./manage.py runworkers'
+        assert services[worker]['deploy']['resources']['limits']['memory'] == '4g'
+    assert 'ports' not in services[workers[1]]
+    assert get_collection_services('testdata', services) == \
+        ['snoop--testdata', 'snoop-pg--testdata'] + workers
+
+
+def test_write_collection_docker_file_pg_profile(tmpdir):
+    tmpdir_path = str(tmpdir)
+    settings = {'image': 'snoop_image', 'autoindex': True, 'snoop_port': 45025, 'pg_profile': 'serve'}
+    write_collection_docker_file('testdata', tmpdir_path, settings, pg_memory=2 ** 30)
+    with open(os.path.join(tmpdir_path, docker_collection_file_name)) as collection_file:
+        service = yaml.load(collection_file, Loader=yaml.FullLoader)['snoop-pg--testdata']
+    assert service['command'] == 'postgres -c config_file=/etc/postgresql/postgresql.conf'
+    assert service['volumes'][1] == \
+        './settings/testdata/postgresql.conf:/etc/postgresql/postgresql.conf:ro'
+    with open(os.path.join(tmpdir_path, 'postgresql.conf')) as config_file:
+        config = config_file.read()
+    assert "listen_addresses = '*'\n" in config
+    assert "shared_buffers = '256MB'\n" in config
+
+    write_collection_docker_file('testdata', tmpdir_path, settings, pg_memory=2 * 2 ** 30)
+    with open(os.path.join(tmpdir_path, docker_collection_file_name)) as collection_file:
+        label = yaml.load(collection_file, Loader=yaml.FullLoader)['snoop-pg--testdata']['labels']
+    assert label != service['labels']
+
+    settings['pg_profile'] = None
+    write_collection_docker_file('testdata', tmpdir_path, settings)
+    with open(os.path.join(tmpdir_path, docker_collection_file_name)) as collection_file:
+        service = yaml.load(collection_file, Loader=yaml.FullLoader)['snoop-pg--testdata']
+    assert 'command' not in service
+    assert not os.path.exists(os.path.join(tmpdir_path, 'postgresql.conf'))
+
+
+def test_refresh_collections_docker_files(monkeypatch, tmpdir):
+    monkeypatch.setattr(c, 'settings_dir_name', str(tmpdir / 'settings'))
+    monkeypatch.setattr(c, 'get_memory_bytes', lambda: 4 * 2 ** 30)
+
+    def read_shared_buffers(collection):
+        with open(os.path.join(c.settings_dir_name, collection, 'postgresql.conf')) as config_file:
+            return re.search("shared_buffers = '(.*)'", config_file.read()).group(1)
+
+    collections = OrderedDict((
+        ('first', {'image': 'snoop2', 'snoop_port': 45025, 'pg_profile': 'serve'}),
+    ))
+    os.makedirs(os.path.join(c.settings_dir_name, 'first'))
+    c.refresh_collections_docker_files(collections)
+    assert read_shared_buffers('first') == '256MB'
+
+    collections['second'] = {'image': 'snoop2', 'snoop_port': 45026, 'pg_profile': 'serve'}
+    collections['missing'] = {'image': 'snoop2', 'snoop_port': 45027, 'pg_profile': 'serve'}
+    os.makedirs(os.path.join(c.settings_dir_name, 'second'))
+    c.refresh_collections_docker_files(collections)
+    assert read_shared_buffers('first') == read_shared_buffers('second') == '85MB'
+    assert not os.path.exists(os.path.join(c.settings_dir_name, 'missing'))
+
+
+def test_validate_workers_settings():
+    assert validate_workers_settings({'workers': 4, 'replicas': 2, 'cpuset': '0-3,6', 'memory': '4g'}) == []
+    assert validate_workers_settings({'workers': None, 'replicas': 1, 'cpuset': None, 'memory': None}) == []
+    errors = validate_workers_settings({'workers': -1, 'replicas': 0, 'cpuset': '0-', 'memory': 'lots'})
+    assert len(errors) == 4
+
+
+def test_write_global_docker_file_tika(monkeypatch, tmpdir):
+    monkeypatch.setattr(c, 'docker_file_name', 'docker-compose.override.yml')
+    monkeypatch.setattr(c, 'settings_dir_name', str(tmpdir / 'settings'))
+    monkeypatch.setattr(c, 'root_dir', tmpdir)
+    monkeypatch.setattr(c, 'get_cpu_count', lambda: 32)
+    monkeypatch.setattr(c, 'get_memory_bytes', lambda: 128 * 2 ** 30)
+
+    collections = OrderedDict((('fl1', {'image': 'snoop2', 'snoop_port': 45025, 'autoindex': True}),))
+    os.makedirs(os.path.join(c.settings_dir_name, 'fl1'))
+    write_collection_docker_file('fl1', os.path.join(c.settings_dir_name, 'fl1'), collections['fl1'])
+
+    write_global_docker_file(collections, global_settings={'tika_replicas': 'auto', 'tika_heap': None})
+    with open(str(tmpdir / c.docker_file_name)) as docker_file:
+        services = yaml.load(docker_file, Loader=yaml.FullLoader)['services']
+    replicas = ['snoop-tika-%d' % replica for replica in range(1, 9)]
+    assert services['snoop-tika']['image'] == c.tika_proxy_image
+    assert services['snoop-tika']['depends_on'] == replicas
+    assert services['snoop-tika-8']['environment'] == {'JAVA_TOOL_OPTIONS': '-Xmx4096m'}
+    with open(os.path.join(c.settings_dir_name, c.tika_proxy_file_name)) as proxy_file:
+        proxy_config = proxy_file.read()
+    assert 'balance leastconn' in proxy_config
+    assert all('server %s %s:9998' % (replica, replica) in proxy_config for replica in replicas)
+
+    changed = write_global_docker_file(collections, for_dev=True,
+                                       global_settings={'tika_replicas': 1, 'tika_heap': '2g'})
+    assert 'snoop-tika' in changed and set(replicas) < set(changed)
+    with open(str(tmpdir / c.docker_file_name)) as docker_file:
+        services = yaml.load(docker_file, Loader=yaml.FullLoader)['services']
+    assert services['snoop-tika'] == {'environment': {'JAVA_TOOL_OPTIONS': '-Xmx2g'}, 'ports': ['9998:9998']}
+    assert 'snoop-tika-1' not in services
+
+
+def test_tika_cache_settings(monkeypatch, tmpdir):
+    monkeypatch.setattr(c, 'docker_file_name', 'docker-compose.override.yml')
+    monkeypatch.setattr(c, 'settings_dir_name', str(tmpdir / 'settings'))
+    monkeypatch.setattr(c, 'root_dir', tmpdir)
+
+    global_settings = dict(c.global_settings_defaults, tika_cache='20g')
+    collections = OrderedDict((('fl1', {'image': 'snoop2', 'snoop_port': 45025, 'autoindex': True}),))
+    settings_dir = os.path.join(c.settings_dir_name, 'fl1')
+    os.makedirs(settings_dir)
+    write_collection_docker_file('fl1', settings_dir, collections['fl1'], global_settings)
+    write_python_settings_file('fl1', settings_dir, collections['fl1'], global_settings)
+    write_global_docker_file(collections, global_settings=global_settings)
+
+    with open(os.path.join(settings_dir, c.snoop_settings_file_name)) as settings_file:
+        assert "SNOOP_TIKA_URL = 'http://snoop-tika-cache:9998'" in settings_file.read()
+    with open(str(tmpdir / c.docker_file_name)) as docker_file:
+        services = yaml.load(docker_file, Loader=yaml.FullLoader)['services']
+    assert services['snoop-tika-cache']['command'].endswith('--max-size 20g')
+    assert 'snoop-tika-cache' in services['snoop-worker--fl1']['depends_on']
+
+
+def test_shared_pg(monkeypatch, tmpdir):
+    monkeypatch.setattr(c, 'docker_file_name', 'docker-compose.override.yml')
+    monkeypatch.setattr(c, 'settings_dir_name', str(tmpdir / 'settings'))
+    monkeypatch.setattr(c, 'root_dir', tmpdir)
+    monkeypatch.setattr(c, 'get_memory_bytes', lambda: 32 * 2 ** 30)
+
+    collections = OrderedDict((
+        ('Shared', {'image': 'snoop2', 'snoop_port': 45025, 'autoindex': True, 'shared_pg': True,
+                    'pg_profile': 'ingest'}),
+        ('own', {'image': 'snoop2', 'snoop_port': 45026, 'autoindex': True, 'pg_profile': 'ingest'}),
+    ))
+    pg_memory = c.get_pg_memory(collections)
+    assert pg_memory == {'own': 8 * 2 ** 30 * 4 // 6, 'snoop-pg': 8 * 2 ** 30 * 2 // 6}
+    for collection, settings in collections.items():
+        settings_dir = os.path.join(c.settings_dir_name, collection)
+        os.makedirs(settings_dir)
+        write_collection_docker_file(collection, settings_dir, settings, pg_memory=pg_memory.get(collection))
+        write_python_settings_file(collection, settings_dir, settings)
+    with open(os.path.join(c.settings_dir_name, 'Shared', 'snoop-settings.py')) as settings_file:
+        settings = settings_file.read()
+    assert "'NAME': 'snoop_shared'" in settings and "'HOST': 'snoop-pg'" in settings
+    assert not os.path.exists(os.path.join(c.settings_dir_name, 'Shared', 'postgresql.conf'))
+
+    write_global_docker_file(collections)
+    with open(str(tmpdir / c.docker_file_name)) as docker_file:
+        services = yaml.load(docker_file, Loader=yaml.FullLoader)['services']
+    assert 'snoop-pg--Shared' not in services and 'snoop-pg--own' in services
+    assert services['snoop--Shared']['depends_on'][-1] == 'snoop-pg'
+    assert services['snoop--Shared']['environment']['WAIT_HOSTS'] == 'search-es:9200, snoop-pg:5432'
+    assert services['snoop-pg']['volumes'] == ['./volumes/snoop-pg/data:/var/lib/postgresql/data',
+                                               './settings/snoop-pg.conf:/etc/postgresql/postgresql.conf:ro']
+    assert os.path.isfile(os.path.join(c.settings_dir_name, 'snoop-pg.conf'))
+
+    collections['Shared']['shared_pg'] = False
+    assert 'snoop-pg' not in c.get_pg_memory(collections)
+    assert 'snoop-pg' in c.get_pg_memory(collections, {'shared_pg': True})
+
+
+def test_pgbouncer(monkeypatch, tmpdir):
+    monkeypatch.setattr(c, 'docker_file_name', 'docker-compose.override.yml')
+    monkeypatch.setattr(c, 'settings_dir_name', str(tmpdir / 'settings'))
+    monkeypatch.setattr(c, 'root_dir', tmpdir)
+    monkeypatch.setattr(c, 'get_cpu_count', lambda: 8)
+
+    collections = OrderedDict((
+        ('big', {'image': 'snoop2', 'snoop_port': 45025, 'autoindex': True, 'workers': 30, 'replicas': 4,
+                 'shared_pg': True}),
+        ('small', {'image': 'snoop2', 'snoop_port': 45026, 'autoindex': True, 'shared_pg': True}),
+        ('own', {'image': 'snoop2', 'snoop_port': 45027, 'autoindex': True}),
+    ))
+    assert c.get_pgbouncer_databases(collections) == [
+        ('search', 'search-pg', 'search', 'search', 20),
+        ('snoop_big', 'snoop-pg', 'snoop_big', 'snoop', 82),
+        ('snoop_own', 'snoop-pg--own', 'snoop', 'snoop', 12),
+        ('snoop_small', 'snoop-pg', 'snoop_small', 'snoop', 7),
+    ]
+
+    global_settings = {'pgbouncer': True}
+    for collection, settings in collections.items():
+        settings_dir = os.path.join(c.settings_dir_name, collection)
+        os.makedirs(settings_dir)
+        write_collection_docker_file(collection, settings_dir, settings, global_settings)
+        write_python_settings_file(collection, settings_dir, settings, global_settings)
+    with open(os.path.join(c.settings_dir_name, 'own', 'snoop-settings.py')) as settings_file:
+        settings = settings_file.read()
+    assert "'HOST': 'pgbouncer'" in settings and "'NAME': 'snoop_own'" in settings
+
+    write_global_docker_file(collections, global_settings=global_settings)
+    with open(str(tmpdir / c.docker_file_name)) as docker_file:
+        services = yaml.load(docker_file, Loader=yaml.FullLoader)['services']
+    assert services['pgbouncer']['depends_on'] == ['search-pg', 'snoop-pg', 'snoop-pg--own']
+    assert services['search']['environment']['DOCKER_HOOVER_PGBOUNCER_HOST'] == 'pgbouncer'
+    assert 'pgbouncer' in services['search']['depends_on']
+    assert 'pgbouncer' in services['snoop-worker--own']['depends_on']
+    with open(os.path.join(c.settings_dir_name, 'pgbouncer.ini')) as config_file:
+        config = config_file.read()
+    assert 'snoop_own = host=snoop-pg--own port=5432 dbname=snoop user=snoop pool_size=12\n' in config
+    assert 'pool_mode = transaction\n' in config
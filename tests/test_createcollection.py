@@ -0,0 +1,61 @@
+import pytest
+
+import src.createcollection as cc
+
+
+def test_read_manifest(tmpdir):
+    manifest = tmpdir / 'manifest.yml'
+    manifest.write('collections:\n  - name: first\n'
+                   '  - name: second\n    dev: true\n    snoop_image: snoop2\n')
+    first, second = cc.read_manifest(str(manifest))
+    assert first.collection == 'first' and not first.dev and first.snoop_image == cc.default_snoop_image
+    assert second.collection == 'second' and second.dev and second.snoop_image == 'snoop2'
+
+    manifest.write('collections:\n  - name: first\n    unknown: 1\n')
+    with pytest.raises(SystemExit):
+        cc.read_manifest(str(manifest))
+
+
+def test_validate_manifest_collections(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    for collection in ['first', 'second']:
+        (tmpdir / 'collections' / collection).ensure(dir=True)
+    collections_args = [
+        cc.argparse.Namespace(collection=name) for name in ['first', 'FIRST', 'second', 'third', 'ex']]
+    errors = cc.validate_manifest_collections(collections_args, {'ex': {}})
+    assert errors == ['Collection FIRST already exists',
+                      'Collection FIRST does not have a data directory (collections/FIRST)',
+                      'Collection third does not have a data directory (collections/third)',
+                      'Collection ex already exists',
+                      'Collection ex does not have a data directory (collections/ex)']
+
+
+def test_init_collections(monkeypatch, capsys):
+    monkeypatch.setattr(cc, 'apply_changed_services', lambda: None)
+    monkeypatch.setattr(cc, 'init_steps', [
+        'echo wait {collection_name}',
+        'test {collection_name} != broken',
+        'echo add {collection_name} {collection_index}',
+    ])
+    failed = cc.init_collections(['first', 'broken', 'Third'], jobs=2)
+    assert list(failed) == ['broken']
+    assert failed['broken'].cmd == 'test broken != broken'
+    output = capsys.readouterr().out
+    assert '[Third] add Third third' in output
+    assert '[broken] add' not in output
+    assert 'broken: FAILED (test broken != broken)' in output
+
+
+def test_init_collections_shared_pg(monkeypatch, capsys):
+    assert cc.get_create_database_command('Shared', {'shared_pg': True}) == \
+        'docker-compose --compatibility exec -T snoop-pg createdb -U snoop snoop_shared'
+    assert cc.get_create_database_command('own', {}) == ''
+
+    monkeypatch.setattr(cc, 'apply_changed_services', lambda: None)
+    monkeypatch.setattr(cc, 'init_steps', ['echo wait {collection_name}', '{create_database}'])
+    monkeypatch.setattr(cc, 'get_create_database_command',
+                        lambda collection, settings: 'echo create ' + collection if settings else '')
+    assert cc.init_collections(['own', 'shared'], settings={'shared': {'shared_pg': True}}) == {}
+    output = capsys.readouterr().out
+    assert '[shared] create shared' in output
+    assert '[own] create' not in output
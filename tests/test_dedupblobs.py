@@ -0,0 +1,41 @@
+import os
+
+from src.dedupblobs import dedup, pool_dir_name
+
+
+def write_blob(blobs_dir, collection, name, content):
+    path = os.path.join(str(blobs_dir), collection, name[:2], name[2:4], name[4:])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as blob:
+        blob.write(content)
+    return path
+
+
+def test_dedup(tmpdir):
+    shared_a = write_blob(tmpdir, 'a', 'aabbcc', 'shared' * 100)
+    shared_b = write_blob(tmpdir, 'b', 'aabbcc', 'shared' * 100)
+    shared_c = write_blob(tmpdir, 'c', 'ddeeff', 'shared' * 100)
+    unique = write_blob(tmpdir, 'b', 'ffeedd', 'unique')
+    write_blob(tmpdir, 'a', 'tmpxyz', 'shared' * 100)
+    os.rename(str(tmpdir / 'a' / 'tm'), str(tmpdir / 'a' / 'tmp'))
+
+    report = dedup(str(tmpdir), dry_run=True)
+    assert report == {'scanned': 4, 'hashed': 4, 'replaced': 2, 'reclaimed': 1200}
+    assert os.stat(shared_a).st_ino != os.stat(shared_b).st_ino
+
+    report = dedup(str(tmpdir), jobs=2)
+    assert report == {'scanned': 4, 'hashed': 4, 'replaced': 2, 'reclaimed': 1200}
+    assert os.stat(shared_a).st_ino == os.stat(shared_b).st_ino == os.stat(shared_c).st_ino
+    assert os.stat(shared_a).st_nlink == 4
+    assert os.stat(unique).st_nlink == 2
+    with open(shared_c) as blob:
+        assert blob.read() == 'shared' * 100
+
+    report = dedup(str(tmpdir))
+    assert report == {'scanned': 4, 'hashed': 0, 'replaced': 0, 'reclaimed': 0}
+
+    os.unlink(unique)
+    report = dedup(str(tmpdir))
+    assert report['reclaimed'] == 6
+    pool_files = [os.path.join(d, f) for d, _, files in os.walk(str(tmpdir / pool_dir_name)) for f in files]
+    assert len(pool_files) == 2
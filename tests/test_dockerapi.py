@@ -0,0 +1,148 @@
+from http.server import BaseHTTPRequestHandler
+import json
+import os
+import socketserver
+import struct
+import threading
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+from src.dockerapi import DockerClient, DockerAPIError, demultiplex, get_compose_project_name
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def address_string(self):
+        return 'fake'
+
+    def send_body(self, data, status=200, content_type='application/json'):
+        if not isinstance(data, bytes):
+            data = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_request(self, method):
+        state = self.server.state
+        state['requests'].append((method, self.path))
+        state['connections'].add(id(self.connection))
+        url = urlparse(self.path)
+        parts = url.path.split('/')[2:]
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length).decode('utf-8')) if length else None
+
+        if parts == ['containers', 'json']:
+            query = parse_qs(url.query)
+            labels = json.loads(query['filters'][0]).get('label', []) if 'filters' in query else []
+            containers = [c for c in state['containers'].values()
+                          if (query['all'] == ['1'] or c['State']['Running']) and
+                          all(label.split('=', 1) in [list(item) for item in c['Labels'].items()]
+                              for label in labels)]
+            return self.send_body([{'Id': c['Id'], 'Labels': c['Labels']} for c in containers])
+        if parts[0] == 'containers' and parts[1] not in state['containers']:
+            return self.send_body({'message': 'No such container: ' + parts[1]}, 404)
+        if parts[0] == 'containers' and parts[2] == 'json':
+            return self.send_body(state['containers'][parts[1]])
+        if parts[0] == 'containers' and parts[2] in ['start', 'stop']:
+            state['containers'][parts[1]]['State']['Running'] = parts[2] == 'start'
+            return self.send_body(b'', 204)
+        if parts[0] == 'containers' and parts[2] == 'exec':
+            state['exec'] = body['Cmd']
+            return self.send_body({'Id': 'exec1'}, 201)
+        if parts == ['exec', 'exec1', 'start']:
+            output = ' '.join(state['exec']).encode('utf-8')
+            return self.send_body(struct.pack('>BxxxL', 1, len(output)) + output +
+                                  struct.pack('>BxxxL', 2, 3) + b'err',
+                                  content_type='application/vnd.docker.raw-stream')
+        if parts == ['exec', 'exec1', 'json']:
+            return self.send_body({'ExitCode': 2})
+        self.send_body({'message': 'not found'}, 404)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+
+class FakeDockerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def container(container_id, service, running=True, health=None):
+    state = {'Running': running}
+    if health:
+        state['Health'] = {'Status': health}
+    return {'Id': container_id, 'State': state,
+            'Labels': {'com.docker.compose.project': 'docker-setup',
+                       'com.docker.compose.service': service}}
+
+
+@pytest.fixture
+def docker(tmpdir):
+    socket_path = str(tmpdir / 'docker.sock')
+    server = FakeDockerServer(socket_path, FakeDockerHandler)
+    server.state = {'requests': [], 'connections': set(), 'containers': {
+        'search1': container('search1', 'search', health='healthy'),
+        'snoop1': container('snoop1', 'snoop--testdata', running=False),
+    }}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    client = DockerClient(socket_path, timeout=5)
+    yield client, server.state
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_list_and_cache(docker):
+    client, state = docker
+    assert [c['Id'] for c in client.service_containers('docker-setup', 'search')] == ['search1']
+    assert client.service_containers('docker-setup', 'snoop--testdata') == []
+    assert [c['Id'] for c in client.service_containers('docker-setup', 'snoop--testdata', all=True)] == \
+        ['snoop1']
+    client.service_containers('docker-setup', 'search')
+    assert len(state['requests']) == 3
+    assert len(state['connections']) == 1
+
+
+def test_health_start_stop(docker):
+    client, state = docker
+    assert client.health('search1') == 'healthy'
+    assert client.health('snoop1') is None
+    assert not client.is_running('snoop1')
+    client.start('snoop1')
+    assert client.is_running('snoop1')
+    assert client.wait_healthy('snoop1', timeout=1)
+    client.stop('search1')
+    assert not client.is_running('search1')
+
+    with pytest.raises(DockerAPIError) as e:
+        client.inspect('missing')
+    assert e.value.status == 404
+
+
+def test_exec(docker):
+    client, state = docker
+    assert client.exec('search1', ['echo', 'hello']) == (2, b'echo hello', b'err')
+    assert state['exec'] == ['echo', 'hello']
+
+
+def test_demultiplex():
+    data = struct.pack('>BxxxL', 1, 3) + b'out' + struct.pack('>BxxxL', 2, 3) + b'err' + \
+        struct.pack('>BxxxL', 1, 1) + b'!'
+    assert demultiplex(data) == (b'out!', b'err')
+
+
+def test_compose_project_name(monkeypatch):
+    monkeypatch.delenv('COMPOSE_PROJECT_NAME', raising=False)
+    assert get_compose_project_name('/opt/Docker-Setup') == 'docker-setup'
+    monkeypatch.setenv('COMPOSE_PROJECT_NAME', 'hoover')
+    assert get_compose_project_name(os.getcwd()) == 'hoover'
@@ -0,0 +1,168 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import re
+import threading
+from urllib.parse import urlparse
+
+import pytest
+
+from src import es
+
+
+class FakeESHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self, method):
+        state = self.server.state
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length).decode('utf-8')) if length else None
+        path = urlparse(self.path).path
+        state['requests'].append((method, path))
+        indexes, snapshots = state['indexes'], state['snapshots']
+        parts = path.strip('/').split('/')
+
+        if parts[0] == '_snapshot' and len(parts) == 2:
+            state['repository'] = body
+            return self.send_json({'acknowledged': True})
+        if parts[0] == '_snapshot' and method == 'PUT':
+            snapshots[parts[2]] = {body['indices']: indexes[body['indices']]}
+            return self.send_json({'snapshot': {'state': 'SUCCESS'}})
+        if parts[0] == '_snapshot' and method == 'DELETE':
+            del snapshots[parts[2]]
+            return self.send_json({'acknowledged': True})
+        if parts[0] == '_snapshot' and parts[-1] == '_restore':
+            for index, docs in snapshots[parts[2]].items():
+                new_index = re.sub(body['rename_pattern'], body['rename_replacement'], index)
+                indexes[new_index] = docs if not state.get('lose_docs') else docs - 1
+            return self.send_json({'snapshot': {'shards': {'failed': 0}}})
+        if parts[0] == '_aliases':
+            action = body['actions'][0]['add']
+            state['aliases'][action['alias']] = action['index']
+            return self.send_json({'acknowledged': True})
+        if parts[0] not in indexes:
+            return self.send_json({'error': 'index_not_found_exception'}, 404)
+        if method == 'DELETE':
+            del indexes[parts[0]]
+            return self.send_json({'acknowledged': True})
+        if parts[-1] == '_count':
+            return self.send_json({'count': indexes[parts[0]]})
+        if parts[-1] == '_mapping':
+            return self.send_json({parts[0]: {'mappings': {'doc': {'properties': {
+                'filetype': {'type': 'keyword'}, 'date': {'type': 'date'}, 'text': {'type': 'text'},
+                'attachments': {'properties': {}}}}}}})
+        if parts[-1] == '_search':
+            state['search'] = body
+            return self.send_json({'hits': {'total': indexes[parts[0]]}})
+        if parts[-1] == '_settings':
+            settings = state['settings'].setdefault(parts[0], {'index.number_of_replicas': '1'})
+            if method == 'PUT':
+                for name, value in body.items():
+                    if value is None:
+                        settings.pop(name, None)
+                    else:
+                        settings[name] = value
+                return self.send_json({'acknowledged': True})
+            return self.send_json({parts[0]: {'settings': settings}})
+        return self.send_json({})
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+
+@pytest.fixture
+def es_server():
+    server = HTTPServer(('127.0.0.1', 0), FakeESHandler)
+    server.state = {'requests': [], 'indexes': {'testdata': 10, 'other': 5}, 'snapshots': {},
+                    'aliases': {}, 'settings': {}}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%d' % server.server_address[1], server.state
+    server.shutdown()
+    server.server_close()
+
+
+def test_rename_index(es_server):
+    es_url, state = es_server
+    es.rename_index(es_url, 'testdata', 'renamed')
+    assert state['indexes'] == {'renamed': 10, 'other': 5}
+    assert state['snapshots'] == {}
+    assert state['repository']['settings']['location'] == es.snapshot_repository_location
+
+
+def test_rename_index_alias(es_server):
+    es_url, state = es_server
+    es.rename_index(es_url, 'testdata', 'renamed', alias=True)
+    assert state['aliases'] == {'renamed': 'testdata'}
+    assert state['indexes'] == {'testdata': 10, 'other': 5}
+    assert not any(path.startswith('/_snapshot') for _, path in state['requests'])
+
+
+def test_rename_index_errors(es_server):
+    es_url, state = es_server
+    with pytest.raises(RuntimeError):
+        es.rename_index(es_url, 'missing', 'renamed')
+    with pytest.raises(RuntimeError):
+        es.rename_index(es_url, 'testdata', 'other')
+
+    state['lose_docs'] = True
+    with pytest.raises(RuntimeError):
+        es.rename_index(es_url, 'testdata', 'renamed')
+    assert state['indexes'] == {'testdata': 10, 'other': 5}
+    assert state['snapshots'] == {}
+
+
+def test_bulk_mode(es_server):
+    es_url, state = es_server
+    previous = es.set_bulk_mode(es_url, 'testdata')
+    assert previous == {'index.refresh_interval': None, 'index.number_of_replicas': '1',
+                        'index.translog.durability': None}
+    assert state['settings']['testdata'] == {'index.refresh_interval': '-1', 'index.number_of_replicas': '0',
+                                             'index.translog.durability': 'async'}
+
+    es.set_serve_mode(es_url, 'testdata', previous)
+    assert state['settings']['testdata'] == {'index.number_of_replicas': '1'}
+    assert state['requests'][-1] == ('POST', '/testdata/_refresh')
+
+
+def test_optimize(es_server):
+    es_url, state = es_server
+    assert es.optimize(es_url, 'testdata') == ['filetype', 'date']
+    assert ('POST', '/testdata/_forcemerge') in state['requests']
+    assert state['settings']['testdata']['index.blocks.write'] == 'true'
+    assert state['search']['aggs'] == {'filetype': {'terms': {'field': 'filetype', 'size': 1}},
+                                       'date': {'stats': {'field': 'date'}}}
+
+    es.set_bulk_mode(es_url, 'testdata')
+    assert 'index.blocks.write' not in state['settings']['testdata']
+
+
+def test_optimize_bulk_serve(es_server):
+    es_url, state = es_server
+    es.optimize(es_url, 'testdata')
+    previous = es.set_bulk_mode(es_url, 'testdata')
+    assert 'index.blocks.write' not in previous
+    es.set_serve_mode(es_url, 'testdata', previous)
+    assert state['settings']['testdata'] == {'index.number_of_replicas': '1'}
+
+    # settings saved in the collection settings before the write block was excluded from them
+    es.set_bulk_mode(es_url, 'testdata')
+    es.set_serve_mode(es_url, 'testdata', dict(previous, **{'index.blocks.write': 'true'}))
+    assert state['settings']['testdata'] == {'index.number_of_replicas': '1'}
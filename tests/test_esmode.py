@@ -0,0 +1,31 @@
+import io
+
+from src.esmode import ModeSwitcher
+from tests.stubs import FakeQueues
+
+
+def test_mode_switcher():
+    now = [0]
+    switched = []
+    queues = FakeQueues({'a': 10})
+    switcher = ModeSwitcher(queues, lambda collection, mode: switched.append((collection, mode)),
+                            grace=60, clock=lambda: now[0], output=io.StringIO())
+
+    modes = switcher.step({'a': 'serve', 'b': 'serve'})
+    assert modes == {'a': 'bulk', 'b': 'serve'}
+    assert switched == [('a', 'bulk')]
+
+    queues.depths = {}
+    now[0] = 30
+    assert switcher.step(modes) == modes
+    now[0] = 60
+    assert switcher.step(modes) == modes
+    queues.depths = {'a': 1}
+    now[0] = 70
+    assert switcher.step(modes) == modes
+    queues.depths = {}
+    now[0] = 100
+    assert switcher.step(modes) == modes
+    now[0] = 160
+    assert switcher.step(modes) == {'a': 'serve', 'b': 'serve'}
+    assert switched == [('a', 'bulk'), ('a', 'serve')]
@@ -0,0 +1,77 @@
+import hashlib
+import io
+import os
+import subprocess
+
+from src.ocrcollection import ocr_collection, is_registered, set_registered
+
+
+class StubEngine:
+    extensions = ('.pdf', '.png')
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, source_path, output_path):
+        self.calls.append(os.path.basename(source_path))
+        with open(source_path, 'rb') as source:
+            content = source.read()
+        if content == b'broken':
+            raise subprocess.CalledProcessError(2, ['stub', source_path])
+        with open(output_path, 'wb') as output:
+            output.write(b'ocr ' + content)
+
+
+def write_document(data_dir, name, content):
+    path = os.path.join(str(data_dir), name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as document:
+        document.write(content)
+
+
+def test_ocr_collection(tmpdir):
+    data_dir, output_dir = tmpdir / 'collection', str(tmpdir / 'ocr' / 'source')
+    manifest_path, tmp_dir = str(tmpdir / 'ocr-source.db'), str(tmpdir / 'ocr' / '.tmp')
+    write_document(data_dir, 'a.pdf', b'first')
+    write_document(data_dir, 'sub/b.PNG', b'second')
+    write_document(data_dir, 'sub/copy.pdf', b'first')
+    write_document(data_dir, 'c.txt', b'text')
+    write_document(data_dir, '.hidden/d.pdf', b'hidden')
+    write_document(data_dir, 'e.pdf', b'broken')
+
+    engine = StubEngine()
+    output = io.StringIO()
+    report = ocr_collection(str(data_dir), output_dir, engine, manifest_path, tmp_dir, jobs=1, output=output)
+    assert report == {'scanned': 4, 'skipped': 0, 'processed': 2, 'failed': 1}
+    assert 'FAILED e.pdf' in output.getvalue()
+    first = hashlib.md5(b'first').hexdigest()
+    with open(os.path.join(output_dir, first + '.pdf'), 'rb') as result:
+        assert result.read() == b'ocr first'
+    assert sorted(os.listdir(output_dir)) == \
+        sorted([first + '.pdf', hashlib.md5(b'second').hexdigest() + '.pdf'])
+    assert os.listdir(tmp_dir) == []
+
+    engine = StubEngine()
+    report = ocr_collection(str(data_dir), output_dir, engine, manifest_path, tmp_dir, jobs=2,
+                            output=io.StringIO())
+    assert report == {'scanned': 4, 'skipped': 3, 'processed': 0, 'failed': 1}
+    assert engine.calls == ['e.pdf']
+
+    write_document(data_dir, 'e.pdf', b'fixed')
+    report = ocr_collection(str(data_dir), output_dir, StubEngine(), manifest_path, tmp_dir,
+                            output=io.StringIO())
+    assert report == {'scanned': 4, 'skipped': 3, 'processed': 1, 'failed': 0}
+
+
+def test_registered(tmpdir):
+    data_dir = tmpdir / 'collection'
+    write_document(data_dir, 'a.pdf', b'first')
+    manifests = [str(tmpdir / collection / 'ocr-shared.db') for collection in ['testdata', 'other']]
+    for manifest_path in manifests:
+        os.makedirs(os.path.dirname(manifest_path))
+        ocr_collection(str(data_dir), str(tmpdir / 'ocr' / 'shared'), StubEngine(), manifest_path,
+                       str(tmpdir / 'ocr' / '.tmp'), output=io.StringIO())
+        assert not is_registered(manifest_path)
+    set_registered(manifests[0])
+    assert is_registered(manifests[0])
+    assert not is_registered(manifests[1])
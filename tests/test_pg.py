@@ -0,0 +1,15 @@
+from src import pg
+
+
+def test_close_connections_before_drop_and_rename(monkeypatch):
+    commands = []
+    monkeypatch.setattr(pg, 'stream', lambda cmd, prefix=None: commands.append(cmd))
+
+    pg.drop_database('snoop-pg', 'snoop_testdata')
+    pg.rename_database('snoop-pg', 'snoop_other', 'snoop_renamed')
+    assert len(commands) == 4
+    assert commands[0].startswith(pg.get_exec_command('snoop-pg', 'psql -U snoop'))
+    assert "pg_terminate_backend(pid)" in commands[0] and "datname = 'snoop_testdata'" in commands[0]
+    assert commands[1] == pg.get_exec_command('snoop-pg', 'dropdb -U snoop --if-exists snoop_testdata')
+    assert "datname = 'snoop_other'" in commands[2]
+    assert commands[3].endswith("-c 'ALTER DATABASE snoop_other RENAME TO snoop_renamed' postgres")
@@ -0,0 +1,39 @@
+import socket
+
+import src.ports
+from src.ports import PortAllocator, port_in_use
+
+
+def test_port_allocator():
+    ports = PortAllocator(100)
+    assert [ports.allocate(check_host=False) for _ in range(3)] == [100, 101, 102]
+    ports.release(101)
+    ports.release(100)
+    assert ports.peek() == 100
+    assert ports.allocate(check_host=False) == 100
+    assert ports.allocate(check_host=False) == 101
+    assert ports.allocate(check_host=False) == 103
+
+    ports.reserve(106)
+    assert ports.free == {104, 105}
+    assert ports.allocate(check_host=False) == 104
+
+    saved = ports.to_dict()
+    assert saved == {'next': 107, 'free': [105]}
+    ports = PortAllocator.from_dict(100, saved, used=[100, 106])
+    assert ports.free == {101, 102, 103, 104, 105}
+    assert ports.allocate(check_host=False) == 101
+
+
+def test_port_allocator_skips_host_ports(monkeypatch):
+    monkeypatch.setattr(src.ports, 'port_in_use', lambda port: port in [100, 101])
+    ports = PortAllocator(100)
+    assert ports.allocate() == 102
+    assert ports.free == {100, 101}
+
+
+def test_port_in_use():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('0.0.0.0', 0))
+        sock.listen()
+        assert port_in_use(sock.getsockname()[1])
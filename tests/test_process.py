@@ -0,0 +1,166 @@
+from subprocess import CalledProcessError, TimeoutExpired
+import time
+
+import pytest
+import yaml
+
+from src.common import orig_docker_file_name, docker_file_name
+import src.common as c
+import src.process as process
+from src.process import stream, run_many
+
+
+def test_stream(capsys):
+    output = stream('echo one; echo two >&2; echo three', prefix='test')
+    assert output.splitlines() == ['one', 'two', 'three'] or sorted(output.splitlines()) == \
+        ['one', 'three', 'two']
+    captured = capsys.readouterr()
+    assert captured.out == '[test] one\n[test] three\n'
+    assert captured.err == '[test] two\n'
+
+    with pytest.raises(CalledProcessError) as e:
+        stream('echo failed; exit 3')
+    assert e.value.returncode == 3
+    assert e.value.output == b'failed\n'
+
+
+def test_stream_output_tail(capsys):
+    output = stream('seq 1 %d' % (process.output_tail_lines * 3))
+    assert output.splitlines() == [str(line) for line in range(process.output_tail_lines * 2 + 1,
+                                                               process.output_tail_lines * 3 + 1)]
+    assert len(capsys.readouterr().out.splitlines()) == process.output_tail_lines * 3
+
+    with pytest.raises(CalledProcessError) as e:
+        stream('seq 1 %d; exit 1' % (process.output_tail_lines * 3))
+    assert len(e.value.output.splitlines()) == process.output_tail_lines
+
+
+def test_stream_timeout():
+    start = time.time()
+    with pytest.raises(TimeoutExpired):
+        stream('sleep 10', timeout=0.2)
+    assert time.time() - start < 5
+
+
+def test_run_many(capsys):
+    start = time.time()
+    done = []
+    results = run_many({'a': 'sleep 0.5; echo a', 'b': ['sleep 0.5', 'false', 'echo b'], 'c': 'sleep 0.5'},
+                       concurrency=3, on_done=lambda prefix, error: done.append(prefix))
+    assert time.time() - start < 1.4
+    assert list(results) == ['a', 'b', 'c']
+    assert results['a'] is None and results['c'] is None
+    assert isinstance(results['b'], CalledProcessError)
+    assert sorted(done) == ['a', 'b', 'c']
+    output = capsys.readouterr().out
+    assert '[a] a' in output and '[b] b' not in output
+
+
+def test_run_many_concurrency():
+    start = time.time()
+    run_many({str(i): 'sleep 0.3' for i in range(4)}, concurrency=2)
+    assert time.time() - start >= 0.6
+
+
+def write_services(file_path, services):
+    with open(str(file_path), 'w') as docker_file:
+        yaml.dump({'version': '3.3', 'services': services}, docker_file)
+
+
+def test_apply_changed_services(monkeypatch, tmpdir, capsys):
+    monkeypatch.setattr(process, 'root_dir', tmpdir)
+    monkeypatch.setattr(c, 'root_dir', tmpdir)
+    commands = []
+    monkeypatch.setattr(process, 'stream', lambda cmd, **kwargs: commands.append(cmd))
+    orig, current = tmpdir / orig_docker_file_name, tmpdir / docker_file_name
+
+    unchanged = {'search': {'image': 'search'}, 'snoop-rabbitmq': {'image': 'rabbitmq'}}
+    old_services = dict(unchanged, **{
+        'snoop-pg--a': {'image': 'postgres'},
+        'snoop--a': {'image': 'snoop'},
+        'snoop-worker--a': {'image': 'snoop'},
+        'snoop-pg--b': {'image': 'postgres'},
+        'snoop--b': {'image': 'snoop'},
+        'snoop-tika': {'image': 'tika'},
+        'snoop-stats-es': {'image': 'es'},
+    })
+    new_services = dict(unchanged, **{
+        'snoop-pg': {'image': 'postgres'},
+        'pgbouncer': {'image': 'pgbouncer'},
+        'snoop-pg--a': {'image': 'postgres', 'labels': {'config': 'changed'}},
+        'snoop--a': {'image': 'snoop', 'depends_on': ['pgbouncer']},
+        'snoop-worker--a': {'image': 'snoop', 'depends_on': ['pgbouncer']},
+        'snoop-tika': {'image': 'haproxy'},
+        'snoop-tika-1': {'image': 'tika'},
+        'snoop-tika-cache': {'image': 'python'},
+    })
+    write_services(orig, old_services)
+    write_services(current, new_services)
+
+    process.apply_changed_services()
+    assert commands[0].endswith(' up -d --no-deps --no-recreate --remove-orphans search')
+    # the shared postgres first, then pgbouncer, Tika and the collection levels
+    assert [command.split(' --no-deps ')[1] for command in commands[1:]] == [
+        'snoop-pg', 'pgbouncer', 'snoop-tika-1', 'snoop-tika', 'snoop-tika-cache',
+        'snoop-pg--a', 'snoop--a', 'snoop-worker--a', 'search']
+    assert all(command.startswith(process.compose_command + ' up -d') for command in commands)
+    output = capsys.readouterr().out
+    assert 'Removing services: snoop-pg--b, snoop--b, snoop-stats-es\n' in output
+    # the applied services become the orig ones
+    assert process.read_docker_services(orig) == new_services
+
+    # reverting the changes removes the shared postgres, pgbouncer and the Tika replicas
+    commands.clear()
+    write_services(current, old_services)
+    process.apply_changed_services()
+    assert [command.split(' --no-deps ')[1] for command in commands[1:]] == [
+        'snoop-stats-es', 'snoop-tika', 'snoop-pg--a snoop-pg--b', 'snoop--a snoop--b', 'snoop-worker--a',
+        'search']
+    assert 'Removing services: pgbouncer, snoop-pg, snoop-tika-1, snoop-tika-cache\n' in \
+        capsys.readouterr().out
+
+    commands.clear()
+    process.apply_changed_services()
+    assert commands == []
+    assert 'No collection services to restart.' in capsys.readouterr().out
+
+    # services whose settings files changed are recreated with the changed docker services
+    process.apply_changed_services(['snoop--b', 'snoop-worker--b'])
+    assert [command.split(' --no-deps ')[1] for command in commands] == ['snoop--b']
+
+    # a failed recreation keeps the changes pending for the next run
+    def fail(cmd, **kwargs):
+        raise CalledProcessError(1, cmd, output=b'')
+
+    monkeypatch.setattr(process, 'stream', fail)
+    write_services(current, new_services)
+    with pytest.raises(SystemExit):
+        process.apply_changed_services()
+    assert process.read_docker_services(orig) == old_services
+
+
+class FakeClient:
+    def __init__(self):
+        self.exec_calls = []
+
+    def clear_cache(self):
+        pass
+
+    def exec(self, container, command):
+        self.exec_calls.append((container, command))
+        return 0, b'', b''
+
+
+def test_wait_service(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(process, 'get_client', lambda: client)
+    monkeypatch.setattr(process.time, 'sleep', lambda seconds: None)
+    states = [[], [], [{'Id': 'abc'}]]
+    monkeypatch.setattr(process, 'get_service_containers', lambda service: states.pop(0))
+    process.wait_service('snoop--testdata')
+    assert client.exec_calls == [('abc', ['/wait'])]
+
+    monkeypatch.setattr(process, 'get_service_containers', lambda service: [])
+    with pytest.raises(RuntimeError) as e:
+        process.wait_service('snoop--testdata', timeout=0)
+    assert 'snoop--testdata' in str(e.value)
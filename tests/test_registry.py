@@ -0,0 +1,58 @@
+from collections import OrderedDict
+import multiprocessing
+import time
+
+import src.common as c
+from src import registry
+
+
+def add_collection(settings_dir, collection):
+    c.settings_dir_name = settings_dir
+
+    @c.registry_locked
+    def create():
+        data = c.get_collections_data()
+        time.sleep(0.2)
+        data['collections'][collection] = {'image': 'snoop2', 'autoindex': False,
+                                           'snoop_port': data['ports']['snoop_port'].allocate(False)}
+        c.write_collections_settings(data)
+
+    create()
+
+
+def test_read_write(tmpdir):
+    connection = registry.connect(str(tmpdir))
+    assert not registry.is_initialized(connection)
+    registry.initialize(connection, OrderedDict((('b', {'snoop_port': 2}), ('A', {'snoop_port': 1}))),
+                        {'snoop_port': {'next': 3}})
+    assert registry.is_initialized(connection)
+    assert list(registry.read_collections(connection)) == ['A', 'b']
+    assert registry.read_ports(connection) == {'snoop_port': {'next': 3}}
+    assert registry.get_collection(connection, 'a') == {'snoop_port': 1}
+    assert registry.find_collection_by_port(connection, 2) == ('b', 'snoop_port')
+
+    registry.write(connection, {'c': {'snoop_port': 3}})
+    assert list(registry.read_collections(connection)) == ['c']
+
+    registry.write_settings(connection, {'tika_replicas': 'auto', 'tika_heap': '2g'})
+    registry.write_settings(connection, {'tika_heap': None})
+    assert registry.read_settings(connection) == {'tika_replicas': 'auto'}
+    registry.close_all()
+
+
+def test_concurrent_commands(monkeypatch, tmpdir):
+    monkeypatch.setattr(c, 'settings_dir_name', str(tmpdir))
+    c.get_registry()
+    registry.close_all()
+
+    processes = [multiprocessing.Process(target=add_collection, args=(str(tmpdir), name))
+                 for name in ['testdata1', 'testdata2', 'testdata3']]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    data = c.get_collections_data()
+    assert list(data['collections']) == ['testdata1', 'testdata2', 'testdata3']
+    assert sorted(s['snoop_port'] for s in data['collections'].values()) == [45025, 45026, 45027]
+    registry.close_all()
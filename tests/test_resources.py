@@ -0,0 +1,53 @@
+from src.resources import parse_cpuset, format_cpuset, split_cores, get_memory_bytes, size_tika, \
+    split_postgres_memory, size_postgres, size_pools
+
+
+def test_cpuset():
+    assert parse_cpuset('0-3,6,8-9') == [0, 1, 2, 3, 6, 8, 9]
+    assert format_cpuset([9, 0, 1, 2, 3, 6, 8]) == '0-3,6,8-9'
+    assert format_cpuset([5]) == '5'
+
+
+def test_split_cores():
+    cores = list(range(8))
+    allocation = split_cores({'small': 10, 'big': 90, 'idle': 0}, cores)
+    assert sorted(core for cpus in allocation.values() for core in cpus) == cores
+    assert len(allocation['big']) > len(allocation['small']) >= len(allocation['idle']) == 1
+
+    assert split_cores({'a': 1, 'b': 5, 'c': None}, [0, 1]) == {'b': [0], 'a': [1], 'c': [0]}
+    assert split_cores({}, cores) == {}
+
+
+def test_get_memory_bytes(tmpdir):
+    meminfo = tmpdir / 'meminfo'
+    meminfo.write('MemTotal:       16303460 kB\nMemFree:         1000 kB\n')
+    assert get_memory_bytes(str(meminfo)) == 16303460 * 1024
+
+
+def test_size_tika():
+    assert size_tika(32, 128 * 2 ** 30) == (8, '4096m')
+    assert size_tika(32, 8 * 2 ** 30) == (2, '1024m')
+    assert size_tika(2, 4 * 2 ** 30) == (1, '1024m')
+    assert size_tika(64, 512 * 2 ** 30, replicas=4) == (4, '8192m')
+    assert size_tika(8, None) == (1, '1024m')
+
+
+def test_size_postgres():
+    memory = split_postgres_memory({'a': 'ingest', 'b': 'serve', 'c': 'archived', 'd': None}, 56 * 2 ** 30)
+    assert memory == {'a': 8 * 2 ** 30, 'b': 4 * 2 ** 30, 'c': 2 * 2 ** 30}
+    assert split_postgres_memory({'a': None}, 56 * 2 ** 30) == {}
+    assert split_postgres_memory({'a': 'archived'}, 2 ** 30)['a'] == 256 * 2 ** 20
+
+    settings = size_postgres('ingest', 8 * 2 ** 30)
+    assert settings['shared_buffers'] == '2048MB'
+    assert settings['effective_cache_size'] == '6144MB'
+    assert settings['work_mem'] == '20MB'
+    assert settings['synchronous_commit'] == 'off'
+    assert size_postgres('serve', 8 * 2 ** 30)['work_mem'] == '40MB'
+    assert size_postgres('archived', 128 * 2 ** 20)['work_mem'] == '4MB'
+
+
+def test_size_pools():
+    assert size_pools({'a': 10, 'b': 20}) == {'a': 10, 'b': 20}
+    assert size_pools({'a': 60, 'b': 120}) == {'a': 30, 'b': 60}
+    assert size_pools({'a': 1000, 'b': 1}, max_connections=20) == {'a': 9, 'b': 1}
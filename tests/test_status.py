@@ -0,0 +1,85 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import io
+import json
+import threading
+
+import pytest
+
+from src import status
+
+
+def make_server(responses):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path not in responses:
+                self.send_error(404)
+                return
+            body = json.dumps(responses[self.path]).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def servers():
+    snoop = make_server({'/collection/json': {'name': 'testdata', 'stats': {'task_matrix': {
+        'filesystem.walk': {'success': 10, 'pending': 2},
+        'digests.gather': {'success': 5, 'pending': 3, 'deferred': 1, 'error': 1, 'broken': 1},
+        'ocr.walk_source': {'success': 1, 'avg_duration': 1.5},
+    }}}})
+    flower = make_server({'/api/tasks': {
+        '1': {'state': 'STARTED'}, '2': {'state': 'STARTED'}, '3': {'state': 'SUCCESS'},
+        '4': {'state': 'RECEIVED'}, '5': {'state': 'FAILURE'},
+    }})
+    yield snoop.server_address[1], flower.server_address[1]
+    for server in [snoop, flower]:
+        server.shutdown()
+        server.server_close()
+
+
+def test_poll_collections(servers):
+    snoop_port, flower_port = servers
+    collections = {
+        'testdata': {'snoop_port': snoop_port, 'flower_port': flower_port, 'autoindex': True},
+        'flowerless': {'snoop_port': flower_port, 'flower_port': flower_port, 'autoindex': True},
+        'down': {'snoop_port': 1, 'autoindex': False},
+    }
+    statuses = status.poll_collections(collections, host='127.0.0.1')
+    assert list(statuses) == ['testdata', 'flowerless', 'down']
+    assert statuses['testdata'] == {'pending': 6, 'active': 2, 'succeeded': 16, 'failed': 2,
+                                    'error': None}
+    assert statuses['flowerless']['pending'] == 1
+    assert statuses['flowerless']['succeeded'] == 1
+    assert statuses['flowerless']['error'].startswith('snoop:')
+    assert statuses['down']['pending'] is None
+    assert statuses['down']['error']
+
+
+def test_progress_tracker():
+    now = [0]
+    tracker = status.ProgressTracker(window=120, clock=lambda: now[0])
+    assert tracker.update('a', {'succeeded': 100, 'pending': 100}) == (None, None)
+    now[0] = 60
+    assert tracker.update('a', {'succeeded': 130, 'pending': 60}) == (30, 120)
+    now[0] = 180
+    assert tracker.update('a', {'succeeded': 190, 'pending': 0}) == (30, 0)
+
+
+def test_watch(servers):
+    snoop_port, flower_port = servers
+    output = io.StringIO()
+    status.watch({'testdata': {'snoop_port': snoop_port, 'flower_port': flower_port, 'autoindex': True}},
+                 interval=0, iterations=2, output=output)
+    lines = output.getvalue().splitlines()
+    assert len(lines) == 6
+    assert lines[1].split()[:5] == ['testdata', '6', '2', '16', '2']
+    assert lines[4].split()[-2:] == ['0.0', '-']
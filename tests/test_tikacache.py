@@ -0,0 +1,126 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import http.client
+import os
+import threading
+
+import pytest
+
+from src.tikacache import Store, ProxyServer, parse_size
+
+
+@pytest.fixture
+def tika():
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_PUT(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            requests.append((self.path, self.headers.get('Accept'), body))
+            status = 422 if body == b'broken' else 200
+            result = b'text of ' + body
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(result)))
+            self.end_headers()
+            self.wfile.write(result)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:%d' % server.server_address[1], requests
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def proxy(tika, tmpdir):
+    tika_url, requests = tika
+    server = ProxyServer(('127.0.0.1', 0), tika_url, Store(str(tmpdir / 'cache'), max_size=40))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server, requests
+    server.shutdown()
+    server.server_close()
+
+
+def request(server, method, path, body=None, headers=None):
+    connection = http.client.HTTPConnection(*server.server_address)
+    connection.request(method, path, body=body, headers=headers or {})
+    response = connection.getresponse()
+    result = response.status, response.getheader('Content-Type'), response.read()
+    connection.close()
+    return result
+
+
+def test_proxy_cache(proxy):
+    server, requests = proxy
+    assert request(server, 'PUT', '/rmeta/text', b'doc1') == (200, 'text/plain', b'text of doc1')
+    assert request(server, 'PUT', '/rmeta/text', b'doc1') == (200, 'text/plain', b'text of doc1')
+    assert len(requests) == 1
+
+    request(server, 'PUT', '/rmeta/text', b'doc1', {'Accept': 'application/json'})
+    request(server, 'PUT', '/language/string', b'doc1')
+    assert len(requests) == 3
+
+    assert request(server, 'PUT', '/rmeta/text', b'broken')[0] == 422
+    assert request(server, 'PUT', '/rmeta/text', b'broken')[0] == 422
+    assert len(requests) == 5
+
+    # each result takes 12 bytes, the least recently used ones are evicted
+    request(server, 'PUT', '/rmeta/text', b'doc1')
+    request(server, 'PUT', '/rmeta/text', b'doc2')
+    assert server.store.size <= 40
+    assert len(requests) == 6
+    request(server, 'PUT', '/rmeta/text', b'doc1')
+    assert len(requests) == 6
+    request(server, 'PUT', '/rmeta/text', b'doc1', {'Accept': 'application/json'})
+    assert len(requests) == 7
+
+    status, content_type, metrics = request(server, 'GET', '/metrics')
+    metrics = dict(line.split() for line in metrics.decode('utf-8').splitlines() if not line.startswith('#'))
+    assert metrics['tikacache_hits_total'] == '3'
+    assert metrics['tikacache_misses_total'] == '7'
+    assert int(metrics['tikacache_evictions_total']) >= 1
+    assert metrics['tikacache_size_bytes'] == str(server.store.size)
+
+
+def test_store_reopen(tmpdir):
+    store = Store(str(tmpdir), max_size=100)
+    with store.tmp_file() as tmp_file:
+        tmp_file.write(b'result')
+    store.put('abcd', 'text/plain', tmp_file.name)
+    assert Store(str(tmpdir)).size == 6
+    content_type, result_file = Store(str(tmpdir)).get('abcd')
+    with result_file:
+        assert content_type == 'text/plain'
+        assert result_file.read() == b'result'
+
+
+def test_store_get_evicted(tmpdir):
+    store = Store(str(tmpdir), max_size=10)
+    with store.tmp_file() as tmp_file:
+        tmp_file.write(b'result')
+    store.put('abcd', 'text/plain', tmp_file.name)
+    _, result_file = store.get('abcd')
+    with store.tmp_file() as tmp_file:
+        tmp_file.write(b'other')
+    store.put('efgh', 'text/plain', tmp_file.name)
+    with result_file:
+        assert result_file.read() == b'result'
+    assert store.get('abcd') is None
+
+    os.remove(store.path('efgh'))
+    assert store.get('efgh') is None
+    assert store.count() == 0
+
+
+def test_parse_size():
+    assert parse_size('20g') == 20 * 2 ** 30
+    assert parse_size('512M') == 512 * 2 ** 20
+    assert parse_size('100') == 100
+    assert parse_size('1t') == 2 ** 40
+    with pytest.raises(ValueError):
+        parse_size('1x')
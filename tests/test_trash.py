@@ -0,0 +1,55 @@
+import os
+import time
+
+from src import trash
+
+
+def make_tree(path, dirs=3, files=5):
+    for d in range(dirs):
+        os.makedirs(os.path.join(path, str(d), 'sub'))
+        for f in range(files):
+            with open(os.path.join(path, str(d), 'sub', str(f)), 'w') as blob:
+                blob.write('x' * 10)
+    os.symlink('/nonexistent', os.path.join(path, 'link'))
+
+
+def test_move_to_trash(tmpdir):
+    path = str(tmpdir / 'blobs' / 'collection')
+    make_tree(path)
+    trashed = trash.move_to_trash(path)
+    assert not os.path.exists(path)
+    assert os.path.dirname(trashed) == str(tmpdir / 'blobs' / trash.trash_dir_name)
+    assert trash.list_trash([str(tmpdir / 'blobs')]) == [trashed]
+    assert trash.move_to_trash(path) is None
+
+
+def test_empty_trash(tmpdir):
+    roots = [str(tmpdir / 'blobs'), str(tmpdir / 'volumes')]
+    make_tree(str(tmpdir / 'blobs' / 'a'))
+    make_tree(str(tmpdir / 'volumes' / 'b'))
+    trash.move_to_trash(str(tmpdir / 'blobs' / 'a'))
+    trash.move_to_trash(str(tmpdir / 'volumes' / 'b'))
+
+    progress = trash.empty_trash(roots, str(tmpdir / 'trash.lock'), rate_limit=0, report_interval=None)
+    assert trash.list_trash(roots) == []
+    assert progress.files == 32
+    assert progress.bytes >= 300
+
+
+def test_empty_trash_locked(tmpdir):
+    make_tree(str(tmpdir / 'blobs' / 'a'))
+    trash.move_to_trash(str(tmpdir / 'blobs' / 'a'))
+    lock_path = str(tmpdir / 'trash.lock')
+    with trash.reaper_lock(lock_path) as locked:
+        assert locked
+        progress = trash.empty_trash([str(tmpdir / 'blobs')], lock_path, report_interval=None)
+    assert progress.files == 0
+    assert len(trash.list_trash([str(tmpdir / 'blobs')])) == 1
+
+
+def test_rate_limiter():
+    limiter = trash.RateLimiter(100)
+    start = time.monotonic()
+    for _ in range(21):
+        limiter.acquire()
+    assert time.monotonic() - start >= 0.19
@@ -0,0 +1,40 @@
+import os
+
+from src.usage import get_usage, format_size
+
+
+def write_file(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+
+
+def test_get_usage(tmpdir):
+    blobs, pg = str(tmpdir / 'blobs'), str(tmpdir / 'pg')
+    for name in ['aa/bb/1', 'aa/cc/2', 'dd/ee/3']:
+        write_file(os.path.join(blobs, name), 5000)
+    write_file(os.path.join(pg, 'base', '1'), 5000)
+    cache_path = str(tmpdir / 'usage.db')
+    roots = {blobs: True, pg: False, str(tmpdir / 'missing'): True}
+
+    usage = get_usage(roots, cache_path, jobs=4)
+    assert usage[blobs]['files'] == 3
+    assert usage[blobs]['scanned'] == 6
+    assert usage[blobs]['size'] == 3 * usage[pg]['size'] > 0
+    assert usage[str(tmpdir / 'missing')]['size'] == 0
+
+    usage = get_usage(roots, cache_path, jobs=4)
+    assert usage[blobs]['files'] == 3
+    assert usage[blobs]['scanned'] == 0
+    assert usage[pg]['scanned'] == 2
+
+    write_file(os.path.join(blobs, 'aa', 'cc', '4'), 5000)
+    usage = get_usage(roots, cache_path, jobs=4)
+    assert usage[blobs]['files'] == 4
+    assert usage[blobs]['scanned'] == 1
+
+
+def test_format_size():
+    assert format_size(10) == '10 B'
+    assert format_size(1536) == '1.5 KB'
+    assert format_size(3 * 2 ** 40) == '3.0 TB'